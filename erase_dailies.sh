@@ -4,10 +4,20 @@ DALIES=$( echo /Volumes/bigbig/theaiguy/daily/*[0-9])
 
 export EXEC=$PWD
 #echo $DALIES
+STORES=""
 for WORKDIR in $DALIES; do
+        # the blob store this run's fuse step wrote to (run.blob_store, relative to the run dir)
+        STORES="$STORES
+$(cd $WORKDIR && python $EXEC/scripts/blob_store.py where)"
         rm -rf $WORKDIR/run
         rm -rf $WORKDIR/eval_out
         rm -rf $WORKDIR/logs
         rm  $WORKDIR/experiment.yaml $WORKDIR/evaluate.yaml
 done
 
+# drop blobs no remaining daily run links to (see scripts/blob_store.py)
+echo "$STORES" | sort -u | while read -r BLOB_STORE; do
+        if [ -n "$BLOB_STORE" ] && [ -d "$BLOB_STORE" ]; then
+                python $EXEC/scripts/blob_store.py gc "$BLOB_STORE"
+        fi
+done
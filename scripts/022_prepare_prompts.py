@@ -115,5 +115,9 @@ policy: Dict[str, Any] = {
     ]
 }
 
+# keep the artifact choice 044_bench_artifacts recorded in this file
+if POLICY.exists():
+    prev = json.loads(POLICY.read_text(encoding="utf-8"))
+    policy.update({k: prev[k] for k in ("artifact_choice", "artifact_bench") if k in prev})
 POLICY.write_text(json.dumps(policy, indent=2), encoding="utf-8")
 print(f"\nWrote {POLICY}")
@@ -1,11 +1,13 @@
 # scripts/022_experiment_matrix.py
 from __future__ import annotations
-import sys, os, json, math, csv, time
+import sys, os, json, math, csv, time, itertools
 from pathlib import Path
 from typing import Dict, Any, Tuple, List
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from config_loader import load_config
+from throughput_profile import load_db, predict_row, fmt_seconds
+from train_memory import memory_budget_gb
 
 # --- STEP-AWARE CONFIG ---
 CFG = load_config()
@@ -22,6 +24,8 @@ REPORT   = DATA_DIR / CFG.run.report
 
 RUN_DIR  = Path(CFG.run.output_dir)
 EXPERIMENTS_CSV = DATA_DIR / CFG.run.experiments_csv
+PROFILE_DB = load_db(CFG.run.profile_db)
+BUDGET_GB  = memory_budget_gb(CFG.train["memory_budget_gb"], CFG.train["memory_fraction"])
 
 # ---------- EDITABLE BLOCK (overridable via params) ----------
 EXPERIMENTS      = [ CFG.run.model ]
@@ -32,6 +36,8 @@ MAX_SEQ_LENGTH   = STEP_CFG["max_seq_length"]
 LEARNING_RATE    = STEP_CFG["learning_rate"]
 BF16             = STEP_CFG["bf16"]
 ITERS_OVERRIDE   = STEP_CFG["iters_override"]
+LORA_RANK        = STEP_CFG["lora_rank"]
+SWEEP            = STEP_CFG["sweep"]
 # ------------------------------------------------------------
 
 def load_contract() -> Dict[str, Any]:
@@ -61,6 +67,19 @@ def resolve_files_from_contract(ct: Dict[str, Any]) -> Dict[str, str]:
         files["validation"] = files["val"]
     return files
 
+def sweep_grid() -> List[Dict[str, Any]]:
+    """Cartesian product of the sweep lists (a single default point when disabled)."""
+    base = {"learning_rate": LEARNING_RATE, "lora_rank": LORA_RANK,
+            "batch_size": BATCH_SIZE, "max_seq_length": MAX_SEQ_LENGTH}
+    if not SWEEP["enabled"]:
+        return [base]
+    axes = {k: list(SWEEP[k]) if getattr(SWEEP, k, None) else [v] for k, v in base.items()}
+    return [dict(zip(axes, combo)) for combo in itertools.product(*axes.values())]
+
+def sweep_id(model_tag: str, hp: Dict[str, Any]) -> str:
+    return (f"{model_tag}-lr{hp['learning_rate']:g}-r{hp['lora_rank']}"
+            f"-b{hp['batch_size']}-s{hp['max_seq_length']}")
+
 def estimate_iters(num_train: int, epochs: int, batch: int, accum: int) -> int:
     steps = max(1, math.ceil((epochs * max(1, num_train)) / max(1, batch * accum)))
     return max(100, steps)
@@ -83,38 +102,56 @@ timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 modelName =  EXPERIMENTS
 for model_id in modelName:
     model_tag = model_id.replace("/", "--")
-    out_root  = DATA_DIR / model_tag
-    adapter_path = out_root / "adapter"
-    logs_dir     = out_root / "logs"
-
-    iters = ITERS_OVERRIDE or estimate_iters(
-        num_train=train_count,
-        epochs=EPOCHS,
-        batch=BATCH_SIZE,
-        accum=GRAD_ACCUM,
-    )
-
-    est_tokens = MAX_SEQ_LENGTH * BATCH_SIZE * GRAD_ACCUM * iters
-
-    rows.append({
-        "created_utc": timestamp,
-        "model_id": model_id,
-        "data_dir": str(data_dir),
-        "train_file": files.get("train"),
-        "valid_file": files.get("validation"),
-        "train_examples": train_count,
-        "valid_examples": valid_count,
-        "epochs": EPOCHS,
-        "iters": iters,
-        "batch_size": BATCH_SIZE,
-        "grad_accum": GRAD_ACCUM,
-        "max_seq_length": MAX_SEQ_LENGTH,
-        "learning_rate": LEARNING_RATE,
-        "bf16": int(bool(BF16)),
-        "adapter_path": str(adapter_path),
-        "log_dir": str(logs_dir),
-        "est_tokens": est_tokens
-    })
+    for hp in sweep_grid():
+        out_root = DATA_DIR / model_tag
+        sid = ""
+        if SWEEP["enabled"]:
+            sid = sweep_id(model_tag, hp)
+            out_root = out_root / "sweep" / sid
+        adapter_path = out_root / "adapter"
+        logs_dir     = out_root / "logs"
+        batch, seq = int(hp["batch_size"]), int(hp["max_seq_length"])
+
+        iters = ITERS_OVERRIDE or estimate_iters(
+            num_train=train_count,
+            epochs=EPOCHS,
+            batch=batch,
+            accum=GRAD_ACCUM,
+        )
+
+        est_tokens = seq * batch * GRAD_ACCUM * iters
+
+        rows.append({
+            "created_utc": timestamp,
+            "model_id": model_id,
+            "data_dir": str(data_dir),
+            "train_file": files.get("train"),
+            "valid_file": files.get("validation"),
+            "train_examples": train_count,
+            "valid_examples": valid_count,
+            "epochs": EPOCHS,
+            "iters": iters,
+            "batch_size": batch,
+            "grad_accum": GRAD_ACCUM,
+            "max_seq_length": seq,
+            "learning_rate": float(hp["learning_rate"]),
+            "lora_rank": int(hp["lora_rank"]),
+            "bf16": int(bool(BF16)),
+            "adapter_path": str(adapter_path),
+            "log_dir": str(logs_dir),
+            "est_tokens": est_tokens,
+            # successive-halving bookkeeping, filled in by 03_train.py
+            "sweep_id": sid,
+            "rung": "",
+            "rung_iters": "",
+            "val_loss": "",
+            "sweep_status": "pending" if sid else "",
+        })
+
+# 2b) Cost model: measured throughput for this machine, if profiled
+for r in rows:
+    pred = predict_row(PROFILE_DB, r)
+    r.update(pred or {"est_seconds": "", "est_peak_mem_gb": "", "est_trained_tokens": "", "profile_source": ""})
 
 # 3) Write experiments.csv
 EXPERIMENTS_CSV.parent.mkdir(parents=True, exist_ok=True)
@@ -130,9 +167,17 @@ with EXPERIMENTS_CSV.open("w", newline="", encoding="utf-8") as f:
 print("=== EXPERIMENT MATRIX ===")
 print(f"Data dir: {data_dir}")
 print(f"Counts: train={train_count} valid={valid_count}")
+if SWEEP["enabled"]:
+    print(f"Sweep: {len(rows)} configurations over {len(EXPERIMENTS)} model(s)")
 print(f"Wrote: {EXPERIMENTS_CSV}\n")
 for r in rows:
-    print(f"- {r['model_id']}")
+    print(f"- {r['model_id']}  {r['sweep_id']}")
     print(f"   iters={r['iters']}  bs={r['batch_size']}  accum={r['grad_accum']}  "
-          f"max_len={r['max_seq_length']}  lr={r['learning_rate']}  bf16={r['bf16']}")
+          f"max_len={r['max_seq_length']}  lr={r['learning_rate']}  rank={r['lora_rank']}  bf16={r['bf16']}")
     print(f"   est_tokens≈{r['est_tokens']:,}  adapter={r['adapter_path']}")
+    if r["profile_source"]:
+        print(f"   ≈{fmt_seconds(r['est_seconds'])} wall-clock, peak≈{r['est_peak_mem_gb']} GB ({r['profile_source']})")
+        if r["est_peak_mem_gb"] > BUDGET_GB:
+            print(f"   ⚠️  exceeds the {BUDGET_GB:.1f} GB training memory budget")
+    else:
+        print("   no throughput profile yet (run the profile_throughput step)")
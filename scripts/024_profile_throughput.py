@@ -0,0 +1,90 @@
+# scripts/024_profile_throughput.py
+# STEP — Throughput micro-benchmark for experiment planning
+# For every distinct (model, max_seq_length, batch_size, lora_rank) in
+# experiments.csv, train a handful of LoRA steps on this machine and cache
+# it/sec, tokens/sec, tokens/iter and peak memory in the profile DB
+# (run.profile_db). Then annotate experiments.csv with predicted wall-clock
+# and memory per row, and warn about rows that will not fit.
+
+from __future__ import annotations
+import sys, os, csv, shutil
+from pathlib import Path
+from typing import Dict, Any, List
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from config_loader import load_config
+from throughput_profile import (load_db, save_db, machine_id, machine_entries, entry_key,
+                                measure, predict_row, fmt_seconds)
+from train_memory import model_shape, memory_budget_gb, GB
+from experiments_csv import save_rows
+
+# --- STEP-AWARE CONFIG ---
+CFG = load_config()
+STEP_NAME = os.environ["STEP_NAME"]
+STEP_CFG  = CFG[STEP_NAME]
+PARAMS    = STEP_CFG
+
+DATA_DIR  = Path(CFG.run.data_dir)
+EXPERIMENTS_CSV = DATA_DIR / CFG.run.experiments_csv
+BENCH_DIR = Path(CFG.run.output_dir) / "profile"
+PROFILE_DB = CFG.run.profile_db
+
+BENCH_ITERS = int(STEP_CFG["bench_iters"])
+REFRESH     = bool(STEP_CFG["refresh"])
+BUDGET_GB   = memory_budget_gb(CFG.train["memory_budget_gb"], CFG.train["memory_fraction"])
+
+def load_rows(path: Path) -> List[Dict[str, Any]]:
+    with path.open("r", encoding="utf-8") as f:
+        return [dict(x) for x in csv.DictReader(f)]
+
+if not EXPERIMENTS_CSV.exists():
+    raise SystemExit("experiments.csv not found (run prepare_experiments first).")
+
+rows = load_rows(EXPERIMENTS_CSV)
+db = load_db(PROFILE_DB)
+entries = machine_entries(db)
+print(f"Machine: {machine_id()}  profile DB: {Path(PROFILE_DB).expanduser()} ({len(entries)} entries)")
+
+# 1) Measure what is missing
+combos = {}
+for r in rows:
+    rank = int(float(r.get("lora_rank") or 8))
+    key = entry_key(r["model_id"], int(float(r["max_seq_length"])), int(float(r["batch_size"])), rank)
+    combos.setdefault(key, r)
+
+for key, r in combos.items():
+    if key in entries and entries[key].get("ok") and not REFRESH:
+        print(f"[cached] {key}")
+        continue
+    seq, batch = int(float(r["max_seq_length"])), int(float(r["batch_size"]))
+    rank = int(float(r.get("lora_rank") or 8))
+    print(f"\n=== BENCH {key} ({BENCH_ITERS} iters) ===")
+    work = BENCH_DIR / key.replace("/", "--").replace("|", "_")
+    res = measure(r["model_id"], r["data_dir"], seq, batch, rank, BENCH_ITERS, work)
+    entries[key] = {
+        **res,
+        "model_id": r["model_id"], "seq": seq, "batch": batch, "rank": rank,
+        "weights_gb": round(model_shape(r["model_id"])["weight_bytes"] / GB, 2),
+    }
+    save_db(db, PROFILE_DB)
+    if res["ok"]:
+        print(f"→ {res['it_per_sec']} it/s, {res['tokens_per_sec']} tok/s, peak {res['peak_mem_gb']} GB")
+        shutil.rmtree(work / "adapter", ignore_errors=True)
+    else:
+        print(f"❌ benchmark failed (rc={res['returncode']}); likely out of memory. See {res['log']}")
+
+# 2) Predict per row
+print("\n=== PLAN ===")
+for i, r in enumerate(rows):
+    pred = predict_row(db, r)
+    if not pred:
+        print(f"- row {i} {r['model_id']}: no profile")
+        continue
+    r.update(pred)
+    fits = pred["est_peak_mem_gb"] <= BUDGET_GB
+    print(f"- row {i} {r.get('sweep_id') or r['model_id']}: iters={r['iters']} "
+          f"≈{fmt_seconds(pred['est_seconds'])}  peak≈{pred['est_peak_mem_gb']} GB"
+          f"{'' if fits else f'  ⚠️ exceeds {BUDGET_GB:.1f} GB budget'}")
+
+save_rows(EXPERIMENTS_CSV, rows)
+print(f"\nUpdated: {EXPERIMENTS_CSV}")
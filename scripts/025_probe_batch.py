@@ -0,0 +1,151 @@
+# scripts/025_probe_batch.py
+# STEP — Largest batch size (and optionally sequence length) that fits
+# For every distinct (model, max_seq_length, lora_rank) in experiments.csv,
+# train a few LoRA steps on synthetic worst-case data (every example at least
+# max_seq_length tokens long) and search for the largest batch size that
+# completes within the memory ceiling: doubling until the first failure, then
+# bisecting. Results go into the throughput profile DB and experiments.csv
+# (probe_max_batch / probe_max_seq); with apply: true, rows whose batch_size
+# is over the limit are rebatched (see train_memory.rebatch).
+
+from __future__ import annotations
+import sys, os, csv, json, shutil
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from config_loader import load_config
+from throughput_profile import load_db, save_db, machine_id, machine_entries, entry_key, measure
+from train_memory import model_shape, memory_budget_gb, rebatch, GB
+from experiments_csv import save_rows
+
+# --- STEP-AWARE CONFIG ---
+CFG = load_config()
+STEP_NAME = os.environ["STEP_NAME"]
+STEP_CFG  = CFG[STEP_NAME]
+PARAMS    = STEP_CFG
+
+DATA_DIR  = Path(CFG.run.data_dir)
+EXPERIMENTS_CSV = DATA_DIR / CFG.run.experiments_csv
+PROBE_DIR = Path(CFG.run.output_dir) / "probe"
+PROFILE_DB = CFG.run.profile_db
+
+PROBE_ITERS  = int(STEP_CFG["probe_iters"])
+MAX_BATCH    = int(STEP_CFG["max_batch"])
+SEARCH_SEQ   = bool(STEP_CFG["search_seq"])
+MAX_SEQ_CAP  = int(STEP_CFG["max_seq_cap"])
+APPLY        = bool(STEP_CFG["apply"])
+GRAD_ACCUM_FLAG = bool(CFG.train["grad_accum_flag"])
+CEILING_GB   = float(STEP_CFG["memory_ceiling_gb"]) or \
+               memory_budget_gb(CFG.train["memory_budget_gb"], CFG.train["memory_fraction"])
+
+def load_rows(path: Path) -> List[Dict[str, Any]]:
+    with path.open("r", encoding="utf-8") as f:
+        return [dict(x) for x in csv.DictReader(f)]
+
+def synthetic_data(seq: int) -> Path:
+    """train/valid.jsonl whose every line is longer than `seq` tokens (mlx_lm truncates)."""
+    d = PROBE_DIR / "data" / f"seq{seq}"
+    if (d / "train.jsonl").exists():
+        return d
+    d.mkdir(parents=True, exist_ok=True)
+    # ~1 token per word for common English words; pad generously
+    text = " ".join(["the quick brown fox jumps over the lazy dog"] * (seq // 9 + 16))
+    line = json.dumps({"text": text}) + "\n"
+    (d / "train.jsonl").write_text(line * max(64, MAX_BATCH * 2), encoding="utf-8")
+    (d / "valid.jsonl").write_text(line * 4, encoding="utf-8")
+    return d
+
+def fits(model_id: str, seq: int, batch: int, rank: int, entries: Dict[str, Any],
+         db: Dict[str, Any], tried: Dict[Tuple[int, int], bool]) -> bool:
+    if (seq, batch) in tried:
+        return tried[(seq, batch)]
+    key = entry_key(model_id, seq, batch, rank)
+    print(f"\n--- PROBE {key} ---")
+    work = PROBE_DIR / key.replace("/", "--").replace("|", "_")
+    res = measure(model_id, str(synthetic_data(seq)), seq, batch, rank, PROBE_ITERS, work)
+    ok = bool(res["ok"]) and res["peak_mem_gb"] <= CEILING_GB
+    if res["ok"]:
+        # a successful probe is a (pessimistic) throughput measurement too
+        entries.setdefault(key, {
+            **res, "model_id": model_id, "seq": seq, "batch": batch, "rank": rank,
+            "weights_gb": round(model_shape(model_id)["weight_bytes"] / GB, 2),
+        })
+        save_db(db, PROFILE_DB)
+    peak = f" (peak {res['peak_mem_gb']} GB)" if res["ok"] else f" (rc={res['returncode']})"
+    print(f"→ {'fits' if ok else 'does not fit'}{peak}")
+    shutil.rmtree(work, ignore_errors=True)
+    tried[(seq, batch)] = ok
+    return ok
+
+def largest(ok, lo: int, cap: int) -> int:
+    """Largest n in [lo, cap] with ok(n), assuming monotonicity; 0 if ok(lo) fails."""
+    if not ok(lo):
+        return 0
+    hi = lo
+    while hi < cap:
+        nxt = min(cap, hi * 2)
+        if not ok(nxt):
+            break
+        lo = hi = nxt
+    else:
+        return hi
+    bad = nxt
+    while bad - lo > 1:
+        mid = (lo + bad) // 2
+        if ok(mid):
+            lo = mid
+        else:
+            bad = mid
+    return lo
+
+if not EXPERIMENTS_CSV.exists():
+    raise SystemExit("experiments.csv not found (run prepare_experiments first).")
+
+rows = load_rows(EXPERIMENTS_CSV)
+db = load_db(PROFILE_DB)
+entries = machine_entries(db)
+print(f"Memory ceiling: {CEILING_GB:.1f} GB · {PROBE_ITERS} steps per probe")
+
+limits: Dict[Tuple[str, int, int], Dict[str, int]] = {}
+for r in rows:
+    model_id = r["model_id"]
+    seq = int(float(r["max_seq_length"]))
+    rank = int(float(r.get("lora_rank") or 8))
+    key = (model_id, seq, rank)
+    if key in limits:
+        continue
+    tried: Dict[Tuple[int, int], bool] = {}
+    max_batch = largest(lambda b: fits(model_id, seq, b, rank, entries, db, tried), 1, MAX_BATCH)
+    max_seq = 0
+    if SEARCH_SEQ:
+        # longest sequence at batch 1, in steps of 256 tokens
+        step = 256
+        n = largest(lambda k: fits(model_id, k * step, 1, rank, entries, db, tried), 1, max(1, MAX_SEQ_CAP // step))
+        max_seq = n * step
+    limits[key] = {"max_batch": max_batch, "max_seq": max_seq}
+    print(f"\n{model_id} seq={seq} r={rank}: max batch {max_batch}"
+          f"{f', max seq {max_seq}' if SEARCH_SEQ else ''}")
+    probes = db.setdefault("probes", {}).setdefault(machine_id(), {})
+    probes[f"{model_id}|seq={seq}|r={rank}"] = {**limits[key], "ceiling_gb": round(CEILING_GB, 1)}
+    save_db(db, PROFILE_DB)
+
+print("\n=== LIMITS ===")
+for i, r in enumerate(rows):
+    lim = limits[(r["model_id"], int(float(r["max_seq_length"])), int(float(r.get("lora_rank") or 8)))]
+    r["probe_max_batch"] = lim["max_batch"]
+    r["probe_max_seq"] = lim["max_seq"] or ""
+    b = int(float(r["batch_size"]))
+    if lim["max_batch"] == 0:
+        print(f"- row {i} {r.get('sweep_id') or r['model_id']}: ❌ batch 1 does not fit at seq {r['max_seq_length']}")
+    elif b > lim["max_batch"]:
+        if APPLY:
+            r["iters"], r["batch_size"] = int(float(r["iters"])), b
+            r["grad_accum"] = int(float(r.get("grad_accum") or 1))
+            adj = rebatch(r, lim["max_batch"], 0, GRAD_ACCUM_FLAG)
+            print(f"- row {i} {r.get('sweep_id') or r['model_id']}: batch {b} → {adj['to']}")
+        else:
+            print(f"- row {i} {r.get('sweep_id') or r['model_id']}: ⚠️ batch {b} > max {lim['max_batch']}")
+
+save_rows(EXPERIMENTS_CSV, rows)
+print(f"\nUpdated: {EXPERIMENTS_CSV}")
@@ -1,12 +1,13 @@
 # scripts/031_register.py
 from __future__ import annotations
-import sys, os, json, hashlib, time, csv
+import sys, os, json, time, csv
 from pathlib import Path
 from typing import Dict, Any, List
 
 # --- Config loader ---
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from config_loader import load_config
+from digest_cache import DigestCache, list_files
 
 # --- STEP-AWARE CONFIG ---
 CFG = load_config()
@@ -19,34 +20,15 @@ OUT_DIR  = Path( CFG.run.output_dir); OUT_DIR.mkdir(exist_ok=True)
 DATA_DIR  = Path( CFG.run.data_dir)
 EXPERIMENTS_CSV = DATA_DIR / CFG.run.experiments_csv
 ARTIFACTS = DATA_DIR /  CFG.run.artifacts
+DIGESTS   = DigestCache(DATA_DIR / CFG.run.digest_cache)
+HASH_WORKERS = int(STEP_CFG["hash_workers"])
+FAST_HASH    = bool(STEP_CFG["fast_hash"])
 
 # --------------------------
 # Utilities
 # --------------------------
-def sha256_file(p: Path) -> str:
-    h = hashlib.sha256()
-    with p.open("rb") as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
 def gather_dir_files(root: Path) -> List[Dict[str, Any]]:
-    out = []
-    if not root.exists():
-        return out
-    for p in sorted(root.rglob("*")):
-        if p.is_file():
-            out.append({
-                "path": str(p.resolve()),
-                "rel": str(p.relative_to(root)),
-                "bytes": p.stat().st_size,
-                "sha256": sha256_file(p),
-                "mtime_utc": time.strftime(
-                    "%Y-%m-%dT%H:%M:%SZ",
-                    time.gmtime(p.stat().st_mtime)
-                ),
-            })
-    return out
+    return list_files(root, DIGESTS, HASH_WORKERS, FAST_HASH)
 
 def load_rows(path: Path) -> List[Dict[str, Any]]:
     with path.open("r", encoding="utf-8") as f:
@@ -111,4 +93,6 @@ for r in rows:
 
 # Write to artifacts.json
 ARTIFACTS.write_text(json.dumps(registry, indent=2), encoding="utf-8")
+DIGESTS.save()
 print(f"[OK] Wrote artifact registry: {ARTIFACTS}")
+print(f"     digests: {DIGESTS.hits} cached, {DIGESTS.misses} hashed")
@@ -13,12 +13,16 @@ Pipeline compliance:
 
 from __future__ import annotations
 from pathlib import Path
-import sys, os, json, hashlib, time, shlex, subprocess, shutil
+import sys, os, json, time, shlex, subprocess, shutil, hashlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List
 
 # --- Config loader --------------------------------------------------
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from config_loader import load_config
+from digest_cache import DigestCache, list_files as cached_list_files
+from blob_store import open_store
+import stream_fuse
 
 CFG = load_config()
 STEP_NAME = os.environ["STEP_NAME"]
@@ -42,10 +46,22 @@ def log(msg: str):
 
 # --- Controls -------------------------------------------------------
 DO_FUSE = STEP_CFG["do_fuse"]
+FUSE_IMPL = STEP_CFG["fuse_impl"]   # "stream" (in-repo, bounded memory) | "mlx_lm"
 Q_BITS  = int(STEP_CFG["q_bits"])
 Q_GROUP = int(STEP_CFG["q_group"])
 DTYPE   = STEP_CFG["dtype"]
 DRY_RUN = bool(STEP_CFG["dry_run"])
+# [{bits, group, dtype}, ...]; empty → the single q_bits/q_group/dtype variant.
+# The first variant is the run's primary quantized_dir.
+VARIANTS = [
+    {"bits": int(v.get("bits", Q_BITS)), "group": int(v.get("group", Q_GROUP)), "dtype": v.get("dtype", DTYPE)}
+    for v in (x.as_dict() for x in (STEP_CFG["variants"] or []))
+] or [{"bits": Q_BITS, "group": Q_GROUP, "dtype": DTYPE}]
+QUANT_WORKERS = int(STEP_CFG["quant_workers"])
+HASH_WORKERS = int(STEP_CFG["hash_workers"])
+FAST_HASH    = bool(STEP_CFG["fast_hash"])
+DIGESTS = DigestCache(DATA_DIR / CFG.run.digest_cache)
+BLOBS   = open_store(CFG.run.blob_store)
 
 def run_cmd(cmd: str) -> int:
     log(f"[MLX] {cmd}")
@@ -54,28 +70,70 @@ def run_cmd(cmd: str) -> int:
         return 0
     return subprocess.run(cmd, shell=True).returncode
 
-def sha256_file(p: Path) -> str:
+def fuse_streaming(model_id: str, adapter_dir: Path, fused_dir: Path) -> bool:
+    """In-repo streaming fuse into <fused_dir>.partial; False when unsupported (→ mlx_lm fuse)."""
+    partial = fused_dir.with_name(fused_dir.name + ".partial")
+    shutil.rmtree(partial, ignore_errors=True)
+    log(f"[stream_fuse] {model_id} + {adapter_dir} → {fused_dir}")
+    if DRY_RUN:
+        log("DRY_RUN=True → not executing.")
+        return True
+    try:
+        info = stream_fuse.fuse(model_id, adapter_dir, partial, log=log)
+    except Exception as e:
+        shutil.rmtree(partial, ignore_errors=True)
+        why = "unsupported" if isinstance(e, stream_fuse.Unsupported) else "failed"
+        log(f"[stream_fuse] {why} ({e}); falling back to mlx_lm fuse")
+        return False
+    partial.rename(fused_dir)
+    log(f"[stream_fuse] merged {info['merged']} LoRA targets across {info['shards']} shards")
+    return True
+
+def variant_name(v: Dict[str, Any]) -> str:
+    return f"q{v['bits']}-g{v['group']}-{v['dtype']}"
+
+def fused_digest(files: List[Dict[str, Any]]) -> str:
+    """Digest of the fused weights: hash over (rel, file digest) of every file."""
     h = hashlib.sha256()
-    with p.open("rb") as f:
-        for chunk in iter(lambda: f.read(1024*1024), b""):
-            h.update(chunk)
+    for f in sorted(files, key=lambda f: f["rel"]):
+        h.update(f"{f['rel']}\0{f.get('sha256') or f.get('xxh3_128')}\n".encode())
     return h.hexdigest()
 
+def quant_key(digest: str, v: Dict[str, Any]) -> Dict[str, Any]:
+    return {"fused_digest": digest, **v}
+
+def read_key(q_dir: Path) -> Dict[str, Any]:
+    try:
+        return json.loads((q_dir / ".quant_key.json").read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+def quantize(fused_dir: Path, q_dir: Path, v: Dict[str, Any], key: Dict[str, Any]) -> int:
+    """mlx_lm convert into <q_dir>.partial, then swap it into place with its key file."""
+    partial = q_dir.with_name(q_dir.name + ".partial")
+    shutil.rmtree(partial, ignore_errors=True)
+    cmd_q = (
+        f"{py} -m mlx_lm convert "
+        f"--hf-path {shlex.quote(str(fused_dir))} "
+        f"--mlx-path {shlex.quote(str(partial))} "
+        f"--q-bits {v['bits']} "
+        f"--q-group-size {v['group']} "
+        f"--dtype {shlex.quote(v['dtype'])} -q"
+    )
+    rc = run_cmd(cmd_q)
+    if rc != 0 or DRY_RUN:
+        shutil.rmtree(partial, ignore_errors=True)
+        return rc
+    (partial / ".quant_key.json").write_text(json.dumps(key, indent=2), encoding="utf-8")
+    shutil.rmtree(q_dir, ignore_errors=True)
+    partial.rename(q_dir)
+    return 0
+
 def list_files(root: Path) -> List[Dict[str, Any]]:
-    out = []
-    if not root.exists():
-        return out
-    for p in sorted(root.rglob("*")):
-        if p.is_file():
-            stat = p.stat()
-            out.append({
-                "path": str(p.resolve()),
-                "rel": str(p.relative_to(root)),
-                "bytes": stat.st_size,
-                "sha256": sha256_file(p),
-                "mtime_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(stat.st_mtime)),
-            })
-    return out
+    files = cached_list_files(root, DIGESTS, HASH_WORKERS, FAST_HASH)
+    if BLOBS:
+        BLOBS.ingest_files(files, DIGESTS)
+    return files
 
 # --- Artifact Load --------------------------------------------------
 if not ARTIFACTS.exists():
@@ -88,6 +146,7 @@ if not runs:
 
 py = shlex.quote(sys.executable)
 updated = False
+jobs: Dict[str, Dict[str, Any]] = {}   # q_dir → job; rc None = needs convert
 
 # --- Main Loop ------------------------------------------------------
 for entry in runs:
@@ -106,7 +165,8 @@ for entry in runs:
             f"--save-path {shlex.quote(str(fused_dir))}"
         )
         log("=== FUSE ===")
-        rc = run_cmd(cmd_fuse)
+        streamed = FUSE_IMPL == "stream" and fuse_streaming(model_id, adapter_dir, fused_dir)
+        rc = 0 if streamed else run_cmd(cmd_fuse)
         if rc != 0:
             log(f"❌ Fuse failed for {model_id}")
             continue
@@ -114,6 +174,7 @@ for entry in runs:
         entry.setdefault("files", {})["fused"] = list_files(fused_dir)
         updated = True
     elif fused_dir.exists():
+        # unchanged files come straight from the digest cache
         entry["fused_dir"] = str(fused_dir.resolve())
         entry.setdefault("files", {})["fused"] = list_files(fused_dir)
 
@@ -121,38 +182,70 @@ for entry in runs:
         log(f"Skipping quantize for {model_id}: fused_dir missing.")
         continue
 
-    # 2) Quantize ----------------------------------------------------
-    q_dir = output_dir / "quantized"
-    if q_dir.exists():
-        log(f"Removing pre-existing quantized dir: {q_dir}")
-        shutil.rmtree(q_dir)
+    # 2) Quantize (collect) -----------------------------------------
+    q_root = output_dir / "quantized"
+    if (q_root / "config.json").exists():
+        # single-variant layout from before variants existed
+        log(f"Removing legacy quantized dir: {q_root}")
+        shutil.rmtree(q_root)
+    digest = fused_digest(entry["files"]["fused"])
+    for v in VARIANTS:
+        q_dir = q_root / variant_name(v)
+        if str(q_dir) in jobs:  # rows of the same model share output_root
+            jobs[str(q_dir)]["entries"].append(entry)
+            continue
+        key = quant_key(digest, v)
+        jobs[str(q_dir)] = {"entries": [entry], "fused_dir": fused_dir, "q_dir": q_dir, "variant": v,
+                            "key": key, "rc": 0 if read_key(q_dir) == key else None}
 
-    cmd_q = (
-        f"{py} -m mlx_lm convert "
-        f"--hf-path {shlex.quote(str(fused_dir))} "
-        f"--mlx-path {shlex.quote(str(q_dir))} "
-        f"--q-bits {Q_BITS} "
-        f"--q-group-size {Q_GROUP} "
-        f"--dtype {shlex.quote(DTYPE)} -q"
-    )
-    log("=== QUANTIZE ===")
-    rc = run_cmd(cmd_q)
-    if rc != 0:
-        log(f"❌ Quantize failed for {model_id}")
-        continue
+# --- Quantize (run) -------------------------------------------------
+todo = [j for j in jobs.values() if j["rc"] is None]
+for j in jobs.values():
+    if j["rc"] == 0:
+        log(f"⏭️  {j['entries'][0]['model_id']} {j['q_dir'].name}: fused weights unchanged; skipping convert.")
+if todo:
+    log(f"=== QUANTIZE ({len(todo)} variants, {QUANT_WORKERS} workers) ===")
+    with ThreadPoolExecutor(max_workers=max(1, QUANT_WORKERS)) as pool:
+        for j, rc in zip(todo, pool.map(lambda j: quantize(j["fused_dir"], j["q_dir"], j["variant"], j["key"]), todo)):
+            j["rc"] = rc
+            if rc != 0:
+                log(f"❌ Quantize failed for {j['entries'][0]['model_id']} {j['q_dir'].name}")
 
-    entry["quantized_dir"] = str(q_dir.resolve())
-    entry["quantize_bits"] = Q_BITS
-    entry["q_group_size"]  = Q_GROUP
-    entry.setdefault("files", {})["quantized"] = list_files(q_dir)
+# --- Register variants ----------------------------------------------
+for entry in runs:
+    mine = [j for j in jobs.values()
+            if any(e is entry for e in j["entries"]) and j["rc"] == 0 and j["q_dir"].exists()]
+    if not mine:
+        continue
+    variants = []
+    for j in mine:
+        v = j["variant"]
+        variants.append({
+            "name": j["q_dir"].name,
+            "dir": str(j["q_dir"].resolve()),
+            "bits": v["bits"], "group": v["group"], "dtype": v["dtype"],
+            "fused_digest": j["key"]["fused_digest"],
+            "files": j.get("files") or j.setdefault("files", list_files(j["q_dir"])),
+        })
+    primary = variants[0]
+    entry["quantized_dir"] = primary["dir"]
+    entry["quantize_bits"] = primary["bits"]
+    entry["q_group_size"]  = primary["group"]
+    entry["quantized_variants"] = variants
+    entry.setdefault("files", {})["quantized"] = primary["files"]
     updated = True
 
 # --- Save Updated Artifacts ----------------------------------------
 if updated:
     registry["updated_utc"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
     ARTIFACTS.write_text(json.dumps(registry, indent=2), encoding="utf-8")
+DIGESTS.save()
 
 log("=== FUSE/QUANTIZE SUMMARY ===")
+log(f"Digests: {DIGESTS.hits} cached, {DIGESTS.misses} hashed")
+if BLOBS:
+    log(f"Blob store {BLOBS.root}: {BLOBS.added} new, {BLOBS.linked} deduplicated "
+        f"({BLOBS.saved_bytes / 1024**3:.2f} GB saved), {BLOBS.skipped} skipped (other volume)")
 log(f"Wrote: {ARTIFACTS}")
 for entry in registry.get("runs", []):
     log(f"- {entry['model_id']}")
@@ -163,3 +256,5 @@ for entry in registry.get("runs", []):
         log(f"   quantized_dir: {entry['quantized_dir']} "
             f"(q{entry.get('quantize_bits')}, group={entry.get('q_group_size')}) "
             f"files={len(entry.get('files',{}).get('quantized',[]))}")
+        for v in entry.get("quantized_variants", [])[1:]:
+            log(f"   + variant:     {v['dir']}")
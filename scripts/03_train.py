@@ -1,12 +1,19 @@
 # scripts/03_train.py  (LoRA training patch for MLX 0.26.x)
 
 from __future__ import annotations
-import sys, os, csv, shlex, subprocess
+import sys, os, csv, json, shlex, time, math
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from typing import Dict, Any, List, Optional
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from config_loader import load_config
+from train_log import stream_cmd, read_metrics, last_value, looks_like_oom
+from train_memory import estimate_row_memory_gb, memory_budget_gb, rebatch
+from throughput_profile import load_db, predict_row, fmt_seconds
+import train_ckpt
+from experiments_csv import save_rows
+from digest_cache import DigestCache
 
 # --- STEP-AWARE CONFIG ---
 CFG = load_config()
@@ -17,6 +24,9 @@ PARAMS    = STEP_CFG
 # Resolve from params > global config
 OUT_DIR = Path( CFG.run.data_dir); OUT_DIR.mkdir(exist_ok=True)
 EXPERIMENTS_CSV = OUT_DIR / CFG.run.experiments_csv
+SUMMARY_CSV     = OUT_DIR / "train_summary.csv"
+ADJUST_LOG      = OUT_DIR / "train_adjustments.jsonl"
+DIGESTS         = DigestCache(OUT_DIR / CFG.run.digest_cache)
 
 # ---- Controls (can be overridden by step.params) ----
 DRY_RUN          = STEP_CFG["dry_run"]
@@ -25,6 +35,16 @@ ONLY_ROW         = STEP_CFG["only_row"]
 STEPS_PER_REPORT = STEP_CFG["steps_per_report"]
 STEPS_PER_EVAL   = STEP_CFG["steps_per_eval"]
 VAL_BATCHES      = STEP_CFG["val_batches"]
+SAVE_EVERY       = int(STEP_CFG["save_every"])
+KEEP_CHECKPOINTS = int(STEP_CFG["keep_checkpoints"])
+RESUME           = bool(STEP_CFG["resume"])
+MAX_CONCURRENT   = int(STEP_CFG["max_concurrent"])
+MEMORY_BUDGET_GB = memory_budget_gb(STEP_CFG["memory_budget_gb"], STEP_CFG["memory_fraction"])
+PROFILE_DB       = load_db(CFG.run.profile_db)
+OOM_RETRIES      = int(STEP_CFG["oom_retries"])
+GRAD_ACCUM_FLAG  = bool(STEP_CFG["grad_accum_flag"])
+ASHA_MIN_ITERS   = int(STEP_CFG["asha"]["min_iters"])
+ASHA_ETA         = max(2, int(STEP_CFG["asha"]["eta"]))
 # ------------------------------------------------------
 
 
@@ -33,10 +53,11 @@ def load_rows(path: Path) -> List[Dict[str, Any]]:
         r = csv.DictReader(f)
         rows = [dict(x) for x in r]
     for x in rows:
-        for k in ("epochs", "iters", "batch_size", "grad_accum", "max_seq_length", "bf16"):
+        for k in ("epochs", "iters", "batch_size", "grad_accum", "max_seq_length", "bf16",
+                  "lora_rank", "rung", "rung_iters"):
             if k in x and x[k] != "":
                 x[k] = int(float(x[k]))
-        for k in ("learning_rate",):
+        for k in ("learning_rate", "val_loss"):
             if k in x and x[k] != "":
                 x[k] = float(x[k])
     return rows
@@ -52,17 +73,30 @@ def ensure_dirs(row: Dict[str, Any]):
     Path(row["adapter_path"]).mkdir(parents=True, exist_ok=True)
     Path(row["log_dir"]).mkdir(parents=True, exist_ok=True)
 
-def build_cmd(row: Dict[str, Any]) -> str:
+def write_lora_config(row: Dict[str, Any]) -> Optional[Path]:
+    """The LoRA rank is only settable through an mlx_lm config file."""
+    if not row.get("lora_rank"):
+        return None
+    import yaml
+    p = Path(row["adapter_path"]) / "lora_config.yaml"
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_text(yaml.safe_dump({"lora_parameters": {
+        "rank": int(row["lora_rank"]), "dropout": 0.0, "scale": 20.0,
+    }}), encoding="utf-8")
+    return p
+
+def build_cmd(row: Dict[str, Any], start_iter: int = 0, resume_file: Optional[str] = None) -> str:
     py = shlex.quote(sys.executable)
     model = shlex.quote(row["model_id"])
     data_dir = shlex.quote(row["data_dir"])
-    iters = int(row["iters"])
+    iters = int(row["iters"]) - start_iter
     bs = int(row["batch_size"])
     maxlen = int(row["max_seq_length"])
     lr = float(row["learning_rate"])
     adapter = shlex.quote(row["adapter_path"])
+    lora_cfg = write_lora_config(row)
 
-    # NOTE: MLX lora subcommand (no grad-accum, bf16, log-dir)
+    # NOTE: MLX lora subcommand (no bf16, log-dir; grad-accum only with grad_accum_flag)
     parts = [
         f"{py} -m mlx_lm lora",
         f"--model {model}",
@@ -79,40 +113,280 @@ def build_cmd(row: Dict[str, Any]) -> str:
     if VAL_BATCHES:      parts += [f"--val-batches {int(VAL_BATCHES)}"]
     if STEPS_PER_REPORT: parts += [f"--steps-per-report {int(STEPS_PER_REPORT)}"]
     if STEPS_PER_EVAL:   parts += [f"--steps-per-eval {int(STEPS_PER_EVAL)}"]
+    if lora_cfg:         parts += [f"-c {shlex.quote(str(lora_cfg))}"]
+    if GRAD_ACCUM_FLAG and int(row.get("grad_accum") or 1) > 1:
+        parts += [f"--grad-accumulation-steps {int(row['grad_accum'])}"]
+    if SAVE_EVERY:       parts += [f"--save-every {SAVE_EVERY}"]
+    if resume_file:      parts += [f"--resume-adapter-file {shlex.quote(resume_file)}"]
     return " ".join(parts)
 
-def run_cmd(cmd: str, log_path: str = "run/lora_last.log") -> int:
-    print("\n[MLX train]", cmd)
+# what a checkpoint must have been trained with to be resumed; batch_size,
+# grad_accum and iters are left out because OOM backoff and sweep promotion
+# change them on purpose between launches of the same run
+RESUME_KEYS = ("model_id", "learning_rate", "max_seq_length", "lora_rank")
+
+def ckpt_fingerprint(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Training data sha256 (through the registry's digest cache) and the row's resume-relevant hyperparameters."""
+    train = Path(row["data_dir"]) / "train.jsonl"
+    return {"train_sha256": DIGESTS.digest(train) if train.exists() else "",
+            "hparams": {k: row.get(k, "") for k in RESUME_KEYS}}
+
+def row_log_paths(row: Dict[str, Any]) -> tuple[Path, Path]:
+    """Per-row (log, metrics JSONL) paths under the row's log_dir."""
+    log_dir = Path(row["log_dir"])
+    return log_dir / "train.log", log_dir / "metrics.jsonl"
+
+def run_cmd(cmd: str, row: Dict[str, Any], tags: Optional[Dict[str, Any]] = None,
+            prefix: str = "", start_iter: int = 0) -> int:
+    print(f"\n{prefix}[MLX train]", cmd)
     if DRY_RUN:
         print("DRY_RUN=True -> not executing.")
         return 0
 
-    with open(log_path, "w", encoding="utf-8") as log_file:
-        process = subprocess.run(
-            cmd,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-        )
-        log_file.write(process.stdout)
-
-    if process.returncode != 0:
-        print(f"❌ Training failed. See log: {log_path}")
+    log_path, metrics_path = row_log_paths(row)
+    if not start_iter:
+        metrics_path.unlink(missing_ok=True)
+    rc = stream_cmd(cmd, log_path, metrics_path, prefix=prefix, tags=tags,
+                    iter_offset=start_iter, append=bool(start_iter))
+
+    if rc != 0:
+        print(f"{prefix}❌ Training failed. See log: {log_path}")
     else:
-        print(f"✅ Training completed. Log: {log_path}")
-    return process.returncode
+        print(f"{prefix}✅ Training completed. Log: {log_path}  Metrics: {metrics_path}")
+    return rc
+
+def back_off(idx: int, row: Dict[str, Any], done_iters: int, prefix: str) -> Dict[str, Any]:
+    """Halve the batch of an OOM-killed row, compensating per rebatch(), and log it."""
+    adj = rebatch(row, max(1, int(row["batch_size"]) // 2), done_iters, GRAD_ACCUM_FLAG)
+    rec = {
+        "time_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "row": idx, "model_id": row["model_id"], "sweep_id": row.get("sweep_id", ""),
+        "reason": "oom", "done_iters": done_iters, **adj,
+    }
+    with ADJUST_LOG.open("a", encoding="utf-8") as f:
+        f.write(json.dumps(rec) + "\n")
+    log_path, _ = row_log_paths(row)
+    with log_path.open("a", encoding="utf-8") as f:
+        f.write(f"\n[03_train] OOM backoff: {adj['from']} -> {adj['to']}\n")
+    print(f"{prefix}🔻 OOM: retrying with batch_size={adj['to']['batch_size']} "
+          f"grad_accum={adj['to']['grad_accum']} iters={adj['to']['iters']} (was {adj['from']})")
+    return rec
+
+def train_row(idx: int, row: Dict[str, Any], prefix: str) -> Dict[str, Any]:
+    t0 = time.time()
+    ensure_dirs(row)
+    adjustments: List[Dict[str, Any]] = []
+    for attempt in range(OOM_RETRIES + 1):
+        target = int(row["iters"])
+        if DRY_RUN:   # leave checkpoint state alone: plan_resume(resume=False) deletes it
+            resume_file, start, manifest = None, 0, None
+        else:
+            fp = ckpt_fingerprint(row)
+            if RESUME and train_ckpt.stale(train_ckpt.load_manifest(Path(row["adapter_path"])), fp):
+                print(f"{prefix}⚠️  checkpoints were trained on other data or hyperparameters; starting over.")
+            resume_file, start, manifest = train_ckpt.plan_resume(
+                Path(row["adapter_path"]), target, KEEP_CHECKPOINTS, RESUME, fp)
+        if start >= target:
+            print(f"{prefix}⏭️  already trained to iter {start}/{target}; skipping.")
+            status, rc = "complete", 0
+            break
+        if resume_file:
+            print(f"{prefix}↻ resuming from iter {start}/{target}: {resume_file}")
+        rc = run_cmd(build_cmd(row, start, resume_file), row,
+                     tags={"model_id": row["model_id"], "row": idx}, prefix=prefix, start_iter=start)
+        if not DRY_RUN:
+            train_ckpt.finish(Path(row["adapter_path"]), manifest, KEEP_CHECKPOINTS,
+                              target if rc == 0 else None)
+        status = "ok" if rc == 0 else "failed"
+        if rc == 0 or attempt == OOM_RETRIES or int(row["batch_size"]) <= 1:
+            break
+        if not looks_like_oom(rc, row_log_paths(row)[0]):
+            break
+        done = (train_ckpt.latest_valid(train_ckpt.load_manifest(Path(row["adapter_path"]))) or {}).get("iter", 0)
+        adjustments.append(back_off(idx, row, done if RESUME else 0, prefix))
+    log_path, metrics_path = row_log_paths(row)
+    recs = read_metrics(metrics_path)
+    return {
+        "row": idx,
+        "model_id": row["model_id"],
+        "adapter_path": row["adapter_path"],
+        "status": status,
+        "start_iter": start,
+        "batch_size": row["batch_size"],
+        "grad_accum": row.get("grad_accum", ""),
+        "oom_backoffs": len(adjustments),
+        "returncode": rc,
+        "seconds": round(time.time() - t0, 1),
+        "est_mem_gb": row["_est_mem_gb"],
+        "last_iter": last_value(recs, "iter"),
+        "train_loss": last_value(recs, "train_loss"),
+        "val_loss": last_value(recs, "val_loss"),
+        "tokens_per_sec": last_value(recs, "tokens_per_sec"),
+        "peak_mem_gb": last_value(recs, "peak_mem_gb"),
+        "log": str(log_path),
+        "error": "",
+    }
+
+def failed_result(row: Dict[str, Any], err: BaseException) -> Dict[str, Any]:
+    """A train_row()-shaped result for a row whose run raised."""
+    return {
+        "row": row["_idx"], "model_id": row["model_id"], "adapter_path": row["adapter_path"],
+        "status": "failed", "start_iter": 0, "batch_size": row["batch_size"],
+        "grad_accum": row.get("grad_accum", ""), "oom_backoffs": 0, "returncode": None,
+        "seconds": 0.0, "est_mem_gb": row["_est_mem_gb"], "last_iter": None, "train_loss": None,
+        "val_loss": None, "tokens_per_sec": None, "peak_mem_gb": None,
+        "log": "", "error": f"{type(err).__name__}: {err}",
+    }
+
+def run_rows(todo: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Launch rows concurrently while their estimated memory fits the budget.
+    A row bigger than the whole budget still runs, but only on its own.
+    Failures are recorded and the remaining rows keep going.
+    """
+    pending = [(r["_idx"], r) for r in todo]
+    running: Dict[Any, Dict[str, Any]] = {}
+    results: List[Dict[str, Any]] = []
+    concurrent = MAX_CONCURRENT > 1 and len(todo) > 1
+
+    with ThreadPoolExecutor(max_workers=max(1, MAX_CONCURRENT)) as pool:
+        while pending or running:
+            in_use = sum(r["_est_mem_gb"] for r in running.values())
+            while pending and len(running) < max(1, MAX_CONCURRENT):
+                idx, row = pending[0]
+                need = row["_est_mem_gb"]
+                if running and in_use + need > MEMORY_BUDGET_GB:
+                    break
+                if need > MEMORY_BUDGET_GB:
+                    print(f"⚠️  row {idx} estimated at {need:.1f} GB > budget {MEMORY_BUDGET_GB:.1f} GB; running it alone.")
+                pending.pop(0)
+                prefix = f"[row {idx}] " if concurrent else ""
+                print(f"\n=== RUN row {idx} · {row.get('sweep_id') or row['model_id']} · iters {row['iters']} · est {need:.1f} GB "
+                      f"(in use {in_use:.1f}/{MEMORY_BUDGET_GB:.1f} GB) ===")
+                running[pool.submit(train_row, idx, row, prefix)] = row
+                in_use += need
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for fut in done:
+                row = running.pop(fut)
+                try:
+                    results.append(fut.result())
+                except Exception as e:   # setup / bookkeeping errors fail this row only
+                    print(f"❌ row {row['_idx']} ({row['model_id']}): {type(e).__name__}: {e}")
+                    results.append(failed_result(row, e))
+    return sorted(results, key=lambda r: r["row"])
+
+def rung_budgets(max_iters: int) -> List[int]:
+    """min_iters, min_iters·eta, ... capped at (and always ending with) max_iters."""
+    out, b = [], max(1, ASHA_MIN_ITERS)
+    while b < max_iters:
+        out.append(b)
+        b *= ASHA_ETA
+    return out + [max_iters]
+
+def effective_batch(row: Dict[str, Any]) -> int:
+    return int(row["batch_size"]) * (int(row.get("grad_accum") or 1) if GRAD_ACCUM_FLAG else 1)
+
+def rung_target(r: Dict[str, Any], budget: int) -> int:
+    """
+    Iterations that train a sweep row on `budget` iterations' worth of examples
+    at its starting effective batch. After an OOM backoff without gradient
+    accumulation the row runs smaller batches, so it needs more iterations to
+    see as many examples as its peers.
+    """
+    done_budget, done_iters = r["_rung_done"]
+    scale = r["_base_batch"] / effective_batch(r)
+    return done_iters + math.ceil((min(budget, r["_base_iters"]) - done_budget) * scale)
+
+def run_sweep(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Successive halving over one model's sweep rows: every configuration trains to the
+    first rung budget, the best 1/eta by final validation loss continue
+    (resuming from their checkpoint) to the next budget, and so on.
+    Rung outcomes are written back to experiments.csv after every rung.
+    Budgets count examples (iterations at each row's starting effective
+    batch), so rows that backed off after an OOM are ranked on the same
+    number of examples as the rest (rung_target).
+    """
+    active = list(rows)
+    results: List[Dict[str, Any]] = []
+    for r in rows:
+        r["_base_batch"], r["_base_iters"], r["_rung_done"] = effective_batch(r), int(r["iters"]), (0, 0)
+    budgets = rung_budgets(max(r["_base_iters"] for r in rows))
+    for rung, budget in enumerate(budgets):
+        print(f"\n##### SWEEP {rows[0]['model_id']} rung {rung}: {len(active)} config(s) → {budget} iters #####")
+        rung_rows = [{**r, "iters": rung_target(r, budget)} for r in active]
+        rung_results = run_rows(rung_rows)
+        results.extend(rung_results)
+        by_idx = {res["row"]: res for res in rung_results}
+        for r, rr in zip(active, rung_rows):
+            res = by_idx[r["_idx"]]
+            r["batch_size"], r["grad_accum"] = rr["batch_size"], rr.get("grad_accum", "")  # keep OOM backoffs
+            r["_rung_done"] = (min(budget, r["_base_iters"]), int(rr["iters"]))   # rebatch() rescaled rr["iters"]
+            r["iters"] = rung_target(r, r["_base_iters"])                        # full budget at the current batch
+            r["rung"], r["rung_iters"] = rung, rr["iters"]
+            r["val_loss"] = res["val_loss"] if res["val_loss"] is not None else ""
+            r["sweep_status"] = "failed" if res["status"] == "failed" else "stopped"
+
+        def score(r):
+            v = r["val_loss"]
+            return v if v != "" and not math.isnan(v) else math.inf
+        ranked = sorted((r for r in active if r["sweep_status"] != "failed"), key=score)
+        last = rung == len(budgets) - 1 or all(r["_base_iters"] <= budget for r in ranked)
+        keep = ranked[:1] if last else ranked[:max(1, len(ranked) // ASHA_ETA)]
+        for r in keep:
+            r["sweep_status"] = "best" if last else "promoted"
+        save_rows(EXPERIMENTS_CSV, ALL_ROWS)
+        print(f"rung {rung}: " + ", ".join(f"{r['sweep_id']}={r['val_loss']}" for r in ranked[:5]))
+        if last or not keep:
+            break
+        active = keep
+    return results
+
+def write_summary(results: List[Dict[str, Any]]):
+    if not results:
+        return
+    with SUMMARY_CSV.open("w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+        w.writeheader()
+        for r in results:
+            w.writerow(r)
+    print("\n=== TRAIN SUMMARY ===")
+    for r in results:
+        print(f"- row {r['row']} {r['model_id']}: {r['status']} rc={r['returncode']} "
+              f"{r['seconds']}s est={r['est_mem_gb']}GB peak={r['peak_mem_gb']} "
+              f"train_loss={r['train_loss']} val_loss={r['val_loss']}")
+    print(f"Wrote: {SUMMARY_CSV}")
 
 # --- MAIN ---
 rows = load_rows(EXPERIMENTS_CSV)
+ALL_ROWS = rows
+for i, row in enumerate(rows):
+    row["_idx"] = i
 todo = select_rows(rows, ONLY_MODEL_ID, ONLY_ROW)
+for row in todo:
+    row["_est_mem_gb"] = estimate_row_memory_gb(row, PROFILE_DB)
+    pred = predict_row(PROFILE_DB, row)
+    if pred:
+        print(f"row {row['_idx']}: ≈{fmt_seconds(pred['est_seconds'])}, peak ≈{pred['est_peak_mem_gb']} GB "
+              f"({pred['profile_source']})")
+    if row["_est_mem_gb"] > MEMORY_BUDGET_GB:
+        print(f"⚠️  row {row['_idx']} ({row['model_id']}) needs ≈{row['_est_mem_gb']} GB, "
+              f"more than the {MEMORY_BUDGET_GB:.1f} GB budget — it may not fit.")
+sweep = [r for r in todo if r.get("sweep_id")]
+plain = [r for r in todo if not r.get("sweep_id")]
 
-print(f"Found {len(rows)} rows; running {len(todo)} row(s). DRY_RUN={DRY_RUN}")
-for i, row in enumerate(todo):
-    print(f"\n=== RUN {i+1}/{len(todo)} ===")
-    ensure_dirs(row)
-    rc = run_cmd(build_cmd(row))
-    if rc != 0:
-        print(f"❌ Training failed with returncode={rc}")
-        break
-    print("✅ Training launched.")
+print(f"Found {len(rows)} rows; running {len(todo)} row(s) ({len(sweep)} in sweep). DRY_RUN={DRY_RUN} "
+      f"max_concurrent={MAX_CONCURRENT} memory_budget={MEMORY_BUDGET_GB:.1f} GB")
+results = run_rows(plain) if plain else []
+# successive halving per base model: val losses of different models are not comparable
+for model_id in dict.fromkeys(r["model_id"] for r in sweep):
+    results += run_sweep([r for r in sweep if r["model_id"] == model_id])
+write_summary(results)
+DIGESTS.save()
+if any(r["oom_backoffs"] for r in results):
+    save_rows(EXPERIMENTS_CSV, ALL_ROWS)
+    print(f"Batch sizes adjusted after OOM; see {ADJUST_LOG} (experiments.csv updated).")
+failed = [r for r in results if r["status"] == "failed"]
+if failed:
+    print(f"❌ {len(failed)}/{len(results)} row(s) failed: {[r['row'] for r in failed]}")
+    sys.exit(1)
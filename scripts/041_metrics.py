@@ -10,6 +10,7 @@ from pathlib import Path
 # --- Config loader ---
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from config_loader import load_config
+from corpus_index import open_index
 
 # --- STEP-AWARE CONFIG ---
 CFG = load_config()
@@ -18,15 +19,17 @@ STEP_CFG  = CFG[STEP_NAME]
 PARAMS    = STEP_CFG
 
 # Resolve paths (params > global cfg)
-OUT_DIR   = Path( CFG.data.output_dir); OUT_DIR.mkdir(exist_ok=True)
-EVAL_DIR  = Path(CFG.eval.output_dir); EVAL_DIR.mkdir(exist_ok=True)
+OUT_DIR   = Path( CFG.run.data_dir); OUT_DIR.mkdir(exist_ok=True)
+EVAL_DIR  = Path(CFG.run.eval_dir); EVAL_DIR.mkdir(exist_ok=True)
 RUN_DIR   = Path( CFG.run.output_dir)
 
-CONTRACT  = OUT_DIR / CFG.data.contract
-GEN_JSONL = EVAL_DIR / CFG.eval.generations + ".jsonl"
-GEN_CSV   = EVAL_DIR / CFG.eval.generations + ".csv"
-OUT_SUM   = EVAL_DIR / CFG.eval.summary + ".csv"
-OUT_JSON  = EVAL_DIR / CFG.eval.analysis + ".json"
+CONTRACT  = OUT_DIR / CFG.run.contract
+CATALOG   = OUT_DIR / CFG.run.catalog
+INDEX_DIR = OUT_DIR / CFG.run.corpus_index
+GEN_JSONL = EVAL_DIR / (CFG.run.generations + ".jsonl")
+GEN_CSV   = EVAL_DIR / (CFG.run.generations + ".csv")
+OUT_SUM   = EVAL_DIR / (CFG.run.summary + ".csv")
+OUT_JSON  = EVAL_DIR / (CFG.run.analysis + ".json")
 
 # --- Safety checks ---
 if not GEN_JSONL.exists():
@@ -58,31 +61,19 @@ def distinct_n(tokens, n=1):
     ngrams = set(tuple(tokens[i:i+n]) for i in range(len(tokens)-n+1))
     return len(ngrams) / max(1, (len(tokens)-n+1))
 
-# ----- Load training examples for memorization checks -----
+# ----- Training corpus index for memorization checks -----
 c = json.loads(CONTRACT.read_text(encoding="utf-8"))
 train_path = Path(c["filenames"]["train"]["resolved"])
 text_field = next((k for k,v in c["schema"]["fields"].items() if str(v).lower()=="string"), "text")
-
-train_texts = []
-with train_path.open("r", encoding="utf-8") as f:
-    for line in f:
-        try:
-            obj = json.loads(line)
-            t = obj.get(text_field, "")
-            if isinstance(t, str):
-                train_texts.append(t.strip())
-        except Exception:
-            pass
-train_blob = "\n\n".join(train_texts)
-train_set = set(train_texts)
+index = open_index(train_path, CATALOG, INDEX_DIR, text_field)
 
 # ----- Per-row metrics -----
 def row_metrics(r):
     gen = str(r.get("generation", ""))
     toks = gen.split()
     d1 = distinct_n(toks, 1); d2 = distinct_n(toks, 2)
-    exact_mem = gen.strip() in train_set
-    substr_mem = (not exact_mem) and (len(gen.strip()) >= 20) and (gen.strip() in train_blob)
+    exact_mem = index.is_entry(gen.strip())
+    substr_mem = (not exact_mem) and (len(gen.strip()) >= 20) and index.contains(gen.strip())
     return {
         **r,
         "len_chars": len(gen),
@@ -93,6 +84,7 @@ def row_metrics(r):
         "distinct2": round(d2, 4),
         "memorized_exact": int(exact_mem),
         "memorized_substring": int(substr_mem),
+        "longest_train_match": index.longest_match(gen),
     }
 
 m = pd.DataFrame([row_metrics(r) for r in df.to_dict(orient="records")])
@@ -110,11 +102,12 @@ agg = (m.groupby("mode")
              distinct2_mean=("distinct2","mean"),
              mem_exact_rate=("memorized_exact","mean"),
              mem_sub_rate=("memorized_substring","mean"),
+             longest_match_mean=("longest_train_match","mean"),
            )
          .reset_index())
 
 for col in ["avg_len_chars","med_len_chars","avg_len_words","sent_end_rate","trailing_ws_rate",
-            "distinct1_mean","distinct2_mean","mem_exact_rate","mem_sub_rate"]:
+            "distinct1_mean","distinct2_mean","mem_exact_rate","mem_sub_rate","longest_match_mean"]:
     if col in agg.columns:
         agg[col] = agg[col].map(lambda x: round(float(x), 4))
 
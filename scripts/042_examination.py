@@ -10,11 +10,18 @@ import os, sys, json, textwrap, time
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple
 from collections import defaultdict
-from mlx_lm import load as mlx_load, generate as mlx_generate
 
 # --- Config loader ---
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from config_loader import load_config
+from model_pool import get_pool
+from prefix_cache import get_prefix_cache
+from gen_cache import open_gen_cache
+from serve_client import open_client
+from stop_matcher import policy_stop_strings
+from digest_cache import DigestCache
+from gen_engine import draft_path, spec_summary
+from token_stats import write_entropy
 
 # --- STEP-AWARE CONFIG ---
 CFG       = load_config()
@@ -42,6 +49,20 @@ ONLY_MODEL_ID       = ""  # "" = all; or exact id
 PROMPTS             = STEP_CFG.prompts
 MAX_NEW_TOKENS_SHORT = 64
 MAX_NEW_TOKENS_LONG  = 128
+POOL                 = get_pool(CFG.run.model_pool_gb)
+PREFIXES             = get_prefix_cache(CFG.run.prefix_cache_mb, CFG.run.prefix_min_tokens)
+DIGESTS              = DigestCache(Path(CFG.run.data_dir) / CFG.run.digest_cache)
+GEN_CACHE            = open_gen_cache(Path(CFG.run.data_dir), CFG.run.gen_cache, DIGESTS, open_client(CFG.run.server))
+STOP_STRINGS         = policy_stop_strings(Path(CFG.run.output_dir) / CFG.run.policy, Path(CFG.run.data_dir) / CFG.run.policy)
+GEN_BATCH            = int(CFG.run.gen_batch_size)
+BUDGETS              = [("short", MAX_NEW_TOKENS_SHORT), ("long", MAX_NEW_TOKENS_LONG)]
+DRAFT                = getattr(STEP_CFG, "draft_model", "")   # "" = off, "quantized", or a path / hub id
+NUM_DRAFT            = int(getattr(STEP_CFG, "num_draft_tokens", 3))
+VERIFY_SPEC          = bool(getattr(STEP_CFG, "verify_speculative", False))
+SPEC_PATH            = EVAL_DIR / f"{STEP_NAME}_speculative.json"
+TOKEN_STATS          = int(getattr(STEP_CFG, "token_stats", 0))   # top-k for per-token uncertainty stats (0 = off)
+ENTROPY_TOKENS       = EVAL_DIR / f"{STEP_NAME}_entropy_tokens.jsonl"
+ENTROPY_SUMMARY      = EVAL_DIR / f"{STEP_NAME}_entropy_summary.csv"
 # -------------------
 
 def load_runs() -> List[Dict[str, Any]]:
@@ -90,20 +111,25 @@ PROMPT_VARIANTS = [
     ("fewshot", pv_fewshot),
 ]
 
-def run_generation(model_path: str, adapter_path: Optional[str], prompts: List[str], max_new: int):
-    model, tok = mlx_load(model_path, adapter_path=adapter_path or None)
-    outs=[]
-    for p in prompts:
-        txt = mlx_generate(model=model, tokenizer=tok, prompt=p, max_tokens=max_new)
-        cont = txt[len(p):] if txt.startswith(p) else txt  # strip echoed prompt
-        outs.append(cont.strip())
-    meta = {
-        "eos_token": getattr(tok, "eos_token", None),
-        "eos_token_id": getattr(tok, "eos_token_id", None),
-        "pad_token": getattr(tok, "pad_token", None),
-        "pad_token_id": getattr(tok, "pad_token_id", None),
-    }
-    return outs, meta
+def run_generation(model_path: str, adapter_path: Optional[str], prompts: List[str], budgets: List[int],
+                   draft: Optional[str] = None):
+    """
+    One batched decode per prompt to the largest budget; every smaller budget
+    is a token-count checkpoint on the same stream (identical under greedy
+    decoding). With a `draft` model path, misses are decoded speculatively.
+    Returns {budget: [output per prompt]}, meta, speculative summary, and the
+    engine outputs (with token_stats when TOKEN_STATS is set).
+    """
+    load = lambda: POOL.get(model_path, adapter_path or None)
+    top = max(budgets)
+    res = GEN_CACHE.generate(load, prompts, top, model_path, adapter_path,
+                             batch_size=GEN_BATCH, stop_strings=STOP_STRINGS, prefix_cache=PREFIXES,
+                             checkpoints=[b for b in budgets if b < top],
+                             draft_path=draft, load_draft=(lambda: POOL.get(draft)[0]) if draft else None,
+                             num_draft=NUM_DRAFT, verify=VERIFY_SPEC, token_stats=TOKEN_STATS)
+    outs = {b: [(o["text"] if b == top else o["checkpoints"][str(b)]).strip() for o in res] for b in budgets}
+    meta = GEN_CACHE.tokenizer_meta(load, model_path, adapter_path)
+    return outs, meta, spec_summary(res), res
 
 def preview(text: str, width=120) -> str:
     return textwrap.shorten(text.replace("\n"," ⏎ "), width=width, placeholder="…")
@@ -112,44 +138,53 @@ def preview(text: str, width=120) -> str:
 runs = load_runs()
 stamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 rows=[]
+spec_rows={}
+entropy_items=[]
 
 for run in runs:
     art_list = pick_artifacts(run)
 
     for model_path, adapter_path, art_label in art_list:
-        for pv_label, pv_fn in PROMPT_VARIANTS:
-            prompts_v = [pv_fn(p) for p in PROMPTS]
-
-            outs_short, meta = run_generation(model_path, adapter_path, prompts_v, MAX_NEW_TOKENS_SHORT)
-            outs_long,  _    = run_generation(model_path, adapter_path, prompts_v, MAX_NEW_TOKENS_LONG)
-
-            print(f"\n=== {run['model_id']} | {art_label} | {pv_label} | max_new={MAX_NEW_TOKENS_SHORT} ===")
-            for p, o in zip(PROMPTS, outs_short):
-                print(f"- {p}\n→ {preview(o)}")
-
-            print(f"\n=== {run['model_id']} | {art_label} | {pv_label} | max_new={MAX_NEW_TOKENS_LONG} ===")
-            for p, o in zip(PROMPTS, outs_long):
-                print(f"- {p}\n→ {preview(o)}")
-
-            # record minimal table
-            for budget, outs in [("short", outs_short), ("long", outs_long)]:
-                for p, o in zip(PROMPTS, outs):
-                    rows.append({
-                        "timestamp_utc": stamp,
-                        "model_id": run["model_id"],
-                        "artifact": art_label,
-                        "prompt_variant": pv_label,
-                        "budget": budget,
-                        "model_path": model_path,
-                        "adapter_path": adapter_path or "",
-                        "eos_token": meta["eos_token"],
-                        "eos_token_id": meta["eos_token_id"],
-                        "prompt": p,
-                        "generation": o,
-                        "len_chars": len(o),
-                        "len_words": len(o.split()),
-                        "is_empty": int(len(o.strip())==0),
-                    })
+        # the whole prompt-variant matrix for this artifact in one batch; budgets are checkpoints
+        matrix = [(pv_label, pv_fn(p), p) for pv_label, pv_fn in PROMPT_VARIANTS for p in PROMPTS]
+        draft = draft_path(DRAFT, run)
+        if draft and Path(draft).resolve() == Path(model_path).resolve():
+            draft = None   # the quantized artifact does not draft for itself
+        by_budget, meta, spec, res = run_generation(model_path, adapter_path, [m[1] for m in matrix],
+                                               [max_new for _, max_new in BUDGETS], draft)
+        if spec:
+            spec_rows[f"{run['model_id']}|{art_label}"] = {"draft": draft, **spec}
+        entropy_items += [({"step": STEP_NAME, "model_id": run["model_id"], "artifact": art_label,
+                            "prompt_variant": pv, "prompt": p}, o) for (pv, _, p), o in zip(matrix, res)]
+
+        for pv_label, _ in PROMPT_VARIANTS:
+            for budget, max_new in BUDGETS:
+                print(f"\n=== {run['model_id']} | {art_label} | {pv_label} | max_new={max_new} ===")
+                for (pv, _, p), o in zip(matrix, by_budget[max_new]):
+                    if pv == pv_label:
+                        print(f"- {p}\n→ {preview(o)}")
+
+        # record minimal table (same row order as one run per variant × budget)
+        for pv_label, _ in PROMPT_VARIANTS:
+            for budget, max_new in BUDGETS:
+                for (pv, _, p), o in zip(matrix, by_budget[max_new]):
+                    if pv == pv_label:
+                        rows.append({
+                            "timestamp_utc": stamp,
+                            "model_id": run["model_id"],
+                            "artifact": art_label,
+                            "prompt_variant": pv_label,
+                            "budget": budget,
+                            "model_path": model_path,
+                            "adapter_path": adapter_path or "",
+                            "eos_token": meta["eos_token"],
+                            "eos_token_id": meta["eos_token_id"],
+                            "prompt": p,
+                            "generation": o,
+                            "len_chars": len(o),
+                            "len_words": len(o.split()),
+                            "is_empty": int(len(o.strip())==0),
+                        })
 
 # --- Save quick JSONL ---
 with ABL_PATH.open("w", encoding="utf-8") as f:
@@ -173,5 +208,17 @@ with ABL_YAML.open("w", encoding="utf-8") as yf:
     yaml.safe_dump(dict(grouped), yf, allow_unicode=True, sort_keys=False)
 
 print(f"Wrote grouped YAML → {ABL_YAML}")
+if spec_rows:
+    SPEC_PATH.write_text(json.dumps(spec_rows, indent=2), encoding="utf-8")
+    for k, v in spec_rows.items():
+        print(f"[speculative] {k}: acceptance {v['acceptance_rate']:.0%}, {v['tokens_per_sec']} tok/s"
+              + (f", {v['mismatches']}/{v['verified']} differ from plain decoding" if "verified" in v else ""))
+if TOKEN_STATS:
+    n = write_entropy(entropy_items, ENTROPY_TOKENS, ENTROPY_SUMMARY)
+    print(f"[entropy] {n} generations → {ENTROPY_TOKENS} and {ENTROPY_SUMMARY}")
 print("Tip: Look for cases where 'fused' + 'fewshot' fills in while 'quantized' + 'plain' is empty.")
+POOL.report()
+PREFIXES.report()
+GEN_CACHE.report()
+DIGESTS.save()
 
@@ -10,11 +10,16 @@ import os, sys, json, textwrap, time
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple
 from collections import defaultdict
-from mlx_lm import load as mlx_load, generate as mlx_generate
 
 # --- Config loader ---
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from config_loader import load_config
+from model_pool import get_pool
+from prefix_cache import get_prefix_cache
+from gen_cache import open_gen_cache
+from serve_client import open_client
+from stop_matcher import policy_stop_strings
+from digest_cache import DigestCache
 
 # --- STEP-AWARE CONFIG ---
 CFG       = load_config()
@@ -23,25 +28,30 @@ STEP_CFG  = CFG[STEP_NAME]
 PARAMS    = STEP_CFG
 
 # Resolve paths (params > global cfg)
-OUT_DIR   = Path(CFG.data.output_dir)); OUT_DIR.mkdir(exist_ok=True)
-EVAL_DIR  = Path(CFG.eval.output_dir)); EVAL_DIR.mkdir(exist_ok=True)
-RUN_DIR   = Path(CFG.run.output_dir))
+OUT_DIR   = Path(CFG.run.data_dir); OUT_DIR.mkdir(exist_ok=True)
+EVAL_DIR  = Path(CFG.run.eval_dir); EVAL_DIR.mkdir(exist_ok=True)
+RUN_DIR   = Path(CFG.run.output_dir)
 
-ARTIFACTS = RUN_DIR / CFG.data.artifacts)
-CONTRACT  = OUT_DIR / CFG.data.contract)
+ARTIFACTS = OUT_DIR / CFG.run.artifacts
+CONTRACT  = OUT_DIR / CFG.run.contract
 
-GEN_JSONL = EVAL_DIR / STEP_CFG.generations + ".jsonl"
-GEN_CSV   = EVAL_DIR / STEP_CFG.generations + ".csv"
-OUT_SUM   = EVAL_DIR / STEP_CFG.summary + ".csv"
-OUT_JSON  = EVAL_DIR / STEP_CFG.analysis + ".json"
-ABL_PATH  = EVAL_DIR / STEP_CFG.ablations + ".jsonl"
-ABL_YAML  = EVAL_DIR / STEP_CFG.ablations + ".yaml"
+GEN_JSONL = EVAL_DIR / (CFG.run.generations + ".jsonl")
+GEN_CSV   = EVAL_DIR / (CFG.run.generations + ".csv")
+OUT_SUM   = EVAL_DIR / (CFG.run.summary + ".csv")
+OUT_JSON  = EVAL_DIR / (CFG.run.analysis + ".json")
+ABL_PATH  = EVAL_DIR / (CFG.run.ablations + ".jsonl")
+ABL_YAML  = EVAL_DIR / (CFG.run.ablations + ".yaml")
 
 # ---- Controls ----
 ONLY_MODEL_ID       = ""  # "" = all; or exact id
-PROMPTS             = STEP_CFG.prompts)
+PROMPTS             = STEP_CFG.prompts
 MAX_NEW_TOKENS_SHORT = 64
 MAX_NEW_TOKENS_LONG  = 128
+POOL                 = get_pool(CFG.run.model_pool_gb)
+PREFIXES             = get_prefix_cache(CFG.run.prefix_cache_mb, CFG.run.prefix_min_tokens)
+DIGESTS              = DigestCache(Path(CFG.run.data_dir) / CFG.run.digest_cache)
+GEN_CACHE            = open_gen_cache(Path(CFG.run.data_dir), CFG.run.gen_cache, DIGESTS, open_client(CFG.run.server))
+STOP_STRINGS         = policy_stop_strings(Path(CFG.run.output_dir) / CFG.run.policy, Path(CFG.run.data_dir) / CFG.run.policy)
 # -------------------
 
 def load_runs() -> List[Dict[str, Any]]:
@@ -91,18 +101,11 @@ PROMPT_VARIANTS = [
 ]
 
 def run_generation(model_path: str, adapter_path: Optional[str], prompts: List[str], max_new: int):
-    model, tok = mlx_load(model_path, adapter_path=adapter_path or None)
-    outs=[]
-    for p in prompts:
-        txt = mlx_generate(model=model, tokenizer=tok, prompt=p, max_tokens=max_new)
-        cont = txt[len(p):] if txt.startswith(p) else txt  # strip echoed prompt
-        outs.append(cont.strip())
-    meta = {
-        "eos_token": getattr(tok, "eos_token", None),
-        "eos_token_id": getattr(tok, "eos_token_id", None),
-        "pad_token": getattr(tok, "pad_token", None),
-        "pad_token_id": getattr(tok, "pad_token_id", None),
-    }
+    load = lambda: POOL.get(model_path, adapter_path or None)
+    outs = [o["text"].strip() for o in GEN_CACHE.generate(load, prompts, max_new, model_path, adapter_path,
+                                                          batch_size=int(CFG.run.gen_batch_size), stop_strings=STOP_STRINGS,
+                                                          prefix_cache=PREFIXES)]
+    meta = GEN_CACHE.tokenizer_meta(load, model_path, adapter_path)
     return outs, meta
 
 def preview(text: str, width=120) -> str:
@@ -174,3 +177,7 @@ with ABL_YAML.open("w", encoding="utf-8") as yf:
 
 print(f"Wrote grouped YAML → {ABL_YAML}")
 print("Tip: Look for cases where 'fused' + 'fewshot' fills in while 'quantized' + 'plain' is empty.")
+POOL.report()
+PREFIXES.report()
+GEN_CACHE.report()
+DIGESTS.save()
@@ -0,0 +1,216 @@
+# scripts/044_bench_artifacts.py
+# STEP — Speed / size / quality benchmark across registered artifacts
+# For every artifact of the newest run of each model in artifacts.json
+# (base+adapter, fused, each quantized variant) measure:
+#   load time, prefill and decode tokens/sec at several context lengths,
+#   peak memory, on-disk size, and validation perplexity (+ delta vs fused).
+# Outputs:
+#   eval_out/artifact_bench.csv   (one row per artifact)
+#   eval_out/artifact_bench.json  (same, with per-context detail)
+# With write_policy: true, the generation policy gets an `artifact_choice`
+# per benchmarked run (keyed by artifact_resolver.run_key): the smallest
+# artifact whose perplexity is within ppl_tolerance (relative) of the fused
+# model. artifact_resolver.resolve("default") (used by serve_local and
+# chat_jim) picks that artifact when the run is the newest one.
+
+from __future__ import annotations
+import os, sys, gc, json, csv, math, time
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import mlx.core as mx
+import mlx.nn as nn
+from mlx_lm import load as mlx_load
+from mlx_lm.generate import stream_generate
+
+# --- Config loader ---
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from config_loader import load_config
+from train_memory import resolve_model_dir
+from artifact_resolver import run_key
+
+# --- STEP-AWARE CONFIG ---
+CFG       = load_config()
+STEP_NAME = os.environ["STEP_NAME"]
+STEP_CFG  = CFG[STEP_NAME]
+PARAMS    = STEP_CFG
+
+DATA_DIR  = Path(CFG.run.data_dir)
+EVAL_DIR  = Path(CFG.run.eval_dir); EVAL_DIR.mkdir(exist_ok=True)
+ARTIFACTS = DATA_DIR / CFG.run.artifacts
+CONTRACT  = DATA_DIR / CFG.run.contract
+POLICY    = DATA_DIR / CFG.run.policy    # the generation policy 022_prepare_prompts writes
+OUT_CSV   = EVAL_DIR / (STEP_CFG["output"] + ".csv")
+OUT_JSON  = EVAL_DIR / (STEP_CFG["output"] + ".json")
+
+# ---- Controls ----
+CONTEXT_LENGTHS = [int(x) for x in STEP_CFG["context_lengths"]]
+DECODE_TOKENS   = int(STEP_CFG["decode_tokens"])
+PPL_EXAMPLES    = int(STEP_CFG["ppl_examples"])
+PPL_MAX_TOKENS  = int(STEP_CFG["ppl_max_tokens"])
+PPL_TOLERANCE   = float(STEP_CFG["ppl_tolerance"])
+INCLUDE_ADAPTER = bool(STEP_CFG["include_adapter"])
+WRITE_POLICY    = bool(STEP_CFG["write_policy"])
+# -------------------
+
+def valid_texts(n: int) -> List[str]:
+    c = json.loads(CONTRACT.read_text(encoding="utf-8"))
+    path = Path(c["filenames"]["valid"]["resolved"])
+    fields = c.get("schema", {}).get("fields", {})
+    field = next((k for k, v in fields.items() if str(v).lower() == "string"), "text")
+    out = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if len(out) >= n:
+                break
+            try:
+                val = json.loads(line).get(field)
+            except Exception:
+                continue
+            if isinstance(val, str) and val.strip():
+                out.append(val)
+    return out
+
+def dir_bytes(p: Optional[str]) -> int:
+    if not p or not Path(p).exists():
+        return 0
+    return sum(f.stat().st_size for f in Path(p).rglob("*") if f.is_file())
+
+def newest_runs(runs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The last-registered run of each model_id (older sweep runs are not benchmarked)."""
+    return list({r["model_id"]: r for r in runs}.values())
+
+def list_artifacts(runs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """(model_id, run, label, kind, model_path, adapter_path) per distinct artifact."""
+    out, seen = [], set()
+    def add(run, label, kind, model_path, adapter_path=None):
+        key = (model_path, adapter_path or "")
+        if not model_path or key in seen:
+            return
+        seen.add(key)
+        out.append({"model_id": run["model_id"], "run": run_key(run), "label": label, "kind": kind,
+                    "model_path": model_path, "adapter_path": adapter_path or ""})
+    for run in runs:
+        if run.get("fused_dir") and Path(run["fused_dir"]).exists():
+            add(run, "fused", "fused", run["fused_dir"])
+        variants = run.get("quantized_variants") or (
+            [{"name": "quantized", "dir": run["quantized_dir"]}] if run.get("quantized_dir") else [])
+        for v in variants:
+            if Path(v["dir"]).exists():
+                add(run, f"quantized:{v['name']}", "quantized", v["dir"])
+        if INCLUDE_ADAPTER and run.get("adapter_dir"):
+            add(run, "base+adapter", "adapter", run["model_id"], run["adapter_dir"])
+    return out
+
+def on_disk_bytes(a: Dict[str, Any]) -> int:
+    if a["adapter_path"]:
+        base = resolve_model_dir(a["model_path"])
+        return dir_bytes(str(base) if base else None) + dir_bytes(a["adapter_path"])
+    return dir_bytes(a["model_path"])
+
+def context_tokens(tok, texts: List[str], n: int) -> List[int]:
+    ids: List[int] = []
+    i = 0
+    while len(ids) < n and texts:
+        ids.extend(tok.encode(texts[i % len(texts)] + "\n"))
+        i += 1
+    return ids[:n]
+
+def speed(model, tok, prompt_ids: List[int]) -> Dict[str, float]:
+    mx.reset_peak_memory()
+    last = None
+    for last in stream_generate(model, tok, prompt_ids, max_tokens=DECODE_TOKENS):
+        pass
+    return {
+        "prefill_tps": round(last.prompt_tps, 1),
+        "decode_tps": round(last.generation_tps, 1),
+        "peak_mem_gb": round(last.peak_memory, 2),
+    }
+
+def perplexity(model, tok, texts: List[str]) -> float:
+    nll, n = 0.0, 0
+    for t in texts:
+        ids = tok.encode(t)[:PPL_MAX_TOKENS]
+        if len(ids) < 2:
+            continue
+        x = mx.array(ids)[None]
+        logits = model(x[:, :-1]).astype(mx.float32)
+        nll += nn.losses.cross_entropy(logits, x[:, 1:], reduction="sum").item()
+        n += len(ids) - 1
+    return math.exp(nll / max(1, n))
+
+def bench(a: Dict[str, Any], texts: List[str]) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    model, tok = mlx_load(a["model_path"], adapter_path=a["adapter_path"] or None)
+    mx.eval(model.parameters())
+    res: Dict[str, Any] = {**a, "load_seconds": round(time.perf_counter() - t0, 2),
+                           "bytes": on_disk_bytes(a), "contexts": {}}
+    for n in CONTEXT_LENGTHS:
+        res["contexts"][n] = speed(model, tok, context_tokens(tok, texts, n))
+    res["ppl"] = round(perplexity(model, tok, texts), 4)
+    res["peak_mem_gb"] = max(c["peak_mem_gb"] for c in res["contexts"].values())
+    del model, tok
+    gc.collect()
+    mx.clear_cache()
+    return res
+
+def choose(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Smallest artifact per run within PPL_TOLERANCE of the run's fused perplexity."""
+    choice = {}
+    for run in dict.fromkeys(r["run"] for r in results):
+        mine = [r for r in results if r["run"] == run]
+        ref = next((r["ppl"] for r in mine if r["kind"] == "fused"), min(r["ppl"] for r in mine))
+        ok = [r for r in mine if r["ppl"] <= ref * (1 + PPL_TOLERANCE)]
+        best = min(ok, key=lambda r: r["bytes"])
+        choice[run] = {k: best[k] for k in ("model_id", "label", "kind", "model_path", "adapter_path", "bytes", "ppl",
+                                             "ppl_delta")}
+    return choice
+
+# --- Orchestrate ---
+runs = json.loads(ARTIFACTS.read_text(encoding="utf-8")).get("runs", [])
+artifacts = list_artifacts(newest_runs(runs))
+if not artifacts:
+    raise SystemExit("No artifacts to benchmark in artifacts.json (run fuse first).")
+texts = valid_texts(PPL_EXAMPLES)
+print(f"Benchmarking {len(artifacts)} artifacts · contexts {CONTEXT_LENGTHS} · "
+      f"{DECODE_TOKENS} decode tokens · ppl on {len(texts)} validation examples")
+
+results = []
+for a in artifacts:
+    print(f"\n=== {a['model_id']} | {a['label']} ===")
+    try:
+        r = bench(a, texts)
+    except Exception as e:
+        print(f"❌ {a['label']}: {e}")
+        continue
+    for n, c in r["contexts"].items():
+        print(f"  ctx {n:>6}: prefill {c['prefill_tps']} tok/s · decode {c['decode_tps']} tok/s · peak {c['peak_mem_gb']} GB")
+    print(f"  load {r['load_seconds']}s · {r['bytes'] / 1024**3:.2f} GB on disk · ppl {r['ppl']}")
+    results.append(r)
+
+for r in results:
+    ref = next((x["ppl"] for x in results if x["run"] == r["run"] and x["kind"] == "fused"), None)
+    r["ppl_delta"] = round(r["ppl"] - ref, 4) if ref else None
+
+stamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+OUT_JSON.write_text(json.dumps({"created_utc": stamp, "results": results}, indent=2), encoding="utf-8")
+cols = ["model_id", "label", "kind", "model_path", "adapter_path", "bytes", "load_seconds", "peak_mem_gb", "ppl", "ppl_delta"]
+with OUT_CSV.open("w", newline="", encoding="utf-8") as f:
+    w = csv.DictWriter(f, fieldnames=cols + [f"{k}_{n}" for n in CONTEXT_LENGTHS for k in ("prefill_tps", "decode_tps")])
+    w.writeheader()
+    for r in results:
+        row = {k: r[k] for k in cols}
+        for n, c in r["contexts"].items():
+            row[f"prefill_tps_{n}"], row[f"decode_tps_{n}"] = c["prefill_tps"], c["decode_tps"]
+        w.writerow(row)
+print(f"\nWrote {OUT_CSV}\nWrote {OUT_JSON}")
+
+if WRITE_POLICY and results:
+    choice = choose(results)
+    policy = json.loads(POLICY.read_text(encoding="utf-8")) if POLICY.exists() else {}
+    policy["artifact_choice"] = choice
+    policy["artifact_bench"] = {"path": str(OUT_JSON), "ppl_tolerance": PPL_TOLERANCE, "created_utc": stamp}
+    POLICY.write_text(json.dumps(policy, indent=2), encoding="utf-8")
+    for c in choice.values():
+        print(f"Policy: {c['model_id']} → {c['label']} ({c['bytes'] / 1024**3:.2f} GB, ppl Δ {c['ppl_delta']})")
+    print(f"Updated {POLICY}")
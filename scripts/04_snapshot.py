@@ -7,7 +7,16 @@ import pandas as pd
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from config_loader import load_config
-from mlx_lm import load as mlx_load, generate as mlx_generate
+from model_pool import get_pool
+from prefix_cache import get_prefix_cache
+from gen_cache import open_gen_cache
+from serve_client import open_client
+from digest_cache import DigestCache
+from corpus_index import open_index
+from shot_sampler import ShotSampler
+from stop_matcher import policy_stop_strings
+from gen_engine import cut_at_stop, draft_path, spec_summary
+from token_stats import write_entropy
 
 import os, sys
 from pathlib import Path
@@ -29,6 +38,17 @@ SEED = STEP_CFG.alt_seed
 N_SHOTS = STEP_CFG.n_shots
 MIN_WORDS = STEP_CFG.min_words
 RETRIES = STEP_CFG.retries
+POOL = get_pool(CFG.run.model_pool_gb)
+PREFIXES = get_prefix_cache(CFG.run.prefix_cache_mb, CFG.run.prefix_min_tokens)
+DIGESTS = DigestCache(Path(CFG.run.data_dir) / CFG.run.digest_cache)
+GEN_CACHE = open_gen_cache(Path(CFG.run.data_dir), CFG.run.gen_cache, DIGESTS, open_client(CFG.run.server))
+GEN_BATCH = int(CFG.run.gen_batch_size)
+STOP_STRINGS = policy_stop_strings(Path(CFG.run.output_dir) / CFG.run.policy, Path(CFG.run.data_dir) / CFG.run.policy)
+DRAFT = getattr(STEP_CFG, "draft_model", "")
+NUM_DRAFT = int(getattr(STEP_CFG, "num_draft_tokens", 3))
+VERIFY_SPEC = bool(getattr(STEP_CFG, "verify_speculative", False))
+TOKEN_STATS = int(getattr(STEP_CFG, "token_stats", 0))   # top-k for per-token uncertainty stats (0 = off)
+ARTIFACTS = Path(CFG.run.data_dir) / CFG.run.artifacts
 
 OUT_DIR = Path(CFG.run.output_dir)
 OUT_DIR.mkdir(exist_ok=True)
@@ -38,6 +58,9 @@ EVAL_DIR.mkdir(exist_ok=True)
 JSONL_PATH = EVAL_DIR / (CFG.run.generations + ".jsonl")
 CSV_PATH = EVAL_DIR / (CFG.run.generations + ".csv")
 TOKMETA = OUT_DIR / (CFG.run.tokmeta + ".json")
+SPEC_PATH = EVAL_DIR / f"{STEP_NAME}_speculative.json"
+ENTROPY_TOKENS = EVAL_DIR / f"{STEP_NAME}_entropy_tokens.jsonl"
+ENTROPY_SUMMARY = EVAL_DIR / f"{STEP_NAME}_entropy_summary.csv"
 CUSTOM_STOP = "\n\n"
 MODES = ["default_eos", "no_eos", "custom_stop"]
 os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
@@ -68,20 +91,13 @@ for t in train_lines:
     h = sha(t)
     if h not in seen:
         seen.add(h); unique.append(t)
-short = [t for t in unique if wc(t) <= 4]
-medium = [t for t in unique if 5 <= wc(t) <= 12]
-longer = [t for t in unique if wc(t) > 12]
-train_blob = "\n\n".join(unique)
-train_set = set(unique)
-
-def pick_diverse_shots(k: int) -> List[str]:
-    pool = []
-    if short: pool.append(random.choice(short))
-    if medium: pool.append(random.choice(medium))
-    if longer: pool.append(random.choice(longer))
-    rest = [t for t in unique if t not in pool]
-    random.shuffle(rest)
-    return (pool + rest)[:k]
+SHOTS = ShotSampler(unique)   # length buckets as index arrays, O(k) seeded draws
+# memorization checks go through the persisted corpus index (built once per train file)
+INDEX = open_index(train_path, Path(CFG.run.data_dir) / CFG.run.catalog,
+                   Path(CFG.run.data_dir) / CFG.run.corpus_index, text_field)
+
+def pick_diverse_shots(k: int, prompt: str, attempt: int) -> List[str]:
+    return SHOTS.draw(k, SHOTS.rng(SEED, prompt, attempt))
 
 def format_fewshot(prompt: str, shots: List[str]) -> str:
     return "Some Proverbs:\n- " + "\n- ".join(shots) + f"\n\n{prompt}\n- "
@@ -93,23 +109,66 @@ def trim_on_custom_stop(text: str, stop: str) -> str:
 def is_bad(gen: str) -> bool:
     g = gen.strip()
     if wc(g) < MIN_WORDS: return True
-    if g in train_set: return True
-    if len(g) >= 24 and g in train_blob: return True
+    if INDEX.is_entry(g): return True
+    if len(g) >= 24 and INDEX.contains(g): return True
     return False
 
-def generate_once(p: str, model, tok) -> tuple[str, str, list[str]]:
-    tries = 0
-    while True:
-        shots = pick_diverse_shots(N_SHOTS)
-        fp = format_fewshot(p, shots)
-        txt = mlx_generate(model=model, tokenizer=tok, prompt=fp, max_tokens=MAX_NEW)
-        gen = txt[len(fp):] if txt.startswith(fp) else txt
-        gen = gen.strip()
-        if not is_bad(gen) or tries >= RETRIES:
-            return fp, gen, shots
-        tries += 1
+def mode_output(o: dict, mode: str) -> str:
+    """A mode's generation, cut from the single ignore-EOS token stream (policy stops end the EOS modes)."""
+    if mode == "no_eos":
+        return o["text"].strip()
+    gen = o["text_eos"]
+    stop_at = cut_at_stop(gen, STOP_STRINGS)
+    gen = (gen if stop_at is None else gen[:stop_at]).strip()
+    if mode == "custom_stop":
+        gen = trim_on_custom_stop(gen, CUSTOM_STOP).strip()
+    return gen
+
+def run_entry_for(model_id: str, adapter: str) -> dict:
+    """This experiment's artifacts.json entry (for draft_model: quantized), or {}."""
+    if not ARTIFACTS.exists():
+        return {}
+    for r in json.loads(ARTIFACTS.read_text(encoding="utf-8")).get("runs", []):
+        if r.get("model_id") == model_id and Path(r.get("adapter_dir", "")).resolve() == Path(adapter).resolve():
+            return r
+    return {}
+
+def generate_matrix(prompts: List[str], load, model_path: str, adapter_path: str,
+                    draft: Optional[str] = None) -> List[tuple[str, dict, list[str]]]:
+    """
+    One (few-shot prompt, engine output, shots) per entry of `prompts`, generated
+    as a batch; bad generations are redrawn with fresh shots (up to RETRIES),
+    again batched together. Cached generations are reused (see gen_cache.py);
+    shots are seeded per (prompt, attempt), so a re-run asks for the same prompts.
+    With a `draft` model path, misses are decoded speculatively; with
+    TOKEN_STATS, outputs carry per-token uncertainty stats (token_stats.py).
+    Decoding ignores EOS and the policy stop strings, so every mode comes out
+    of the same full-budget stream (mode_output); badness is judged on the
+    EOS-terminated text.
+    """
+    results: List[Optional[tuple]] = [None] * len(prompts)
+    todo = list(range(len(prompts)))
+    for tries in range(RETRIES + 1):
+        drawn = {i: pick_diverse_shots(N_SHOTS, prompts[i], tries) for i in todo}
+        fps = {i: format_fewshot(prompts[i], drawn[i]) for i in todo}
+        outs = GEN_CACHE.generate(load, [fps[i] for i in todo], MAX_NEW, model_path, adapter_path, seed=SEED,
+                                  ignore_eos=True, stop_strings=[],
+                                  batch_size=GEN_BATCH, prefix_cache=PREFIXES,
+                                  draft_path=draft, load_draft=(lambda: POOL.get(draft)[0]) if draft else None,
+                                  num_draft=NUM_DRAFT, verify=VERIFY_SPEC, token_stats=TOKEN_STATS)
+        retry = []
+        for i, o in zip(todo, outs):
+            results[i] = (fps[i], o, drawn[i])
+            if is_bad(mode_output(o, "default_eos")):
+                retry.append(i)
+        todo = retry
+        if not todo:
+            break
+    return results  # type: ignore[return-value]
 
 all_rows = []
+spec_rows = {}
+entropy_items = []
 ts = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 df = pd.read_csv(EXPERIMENTS_CSV)
 
@@ -129,19 +188,21 @@ for i, row in df.iterrows():
         print(f"[WARN] Skipping row {i} — no valid model found")
         continue
 
-    model, tok = mlx_load(model_path, adapter_path=adapter_path)
-    TOKMETA.write_text(json.dumps({
-        "eos_token": getattr(tok, "eos_token", None),
-        "eos_token_id": getattr(tok, "eos_token_id", None),
-        "pad_token": getattr(tok, "pad_token", None),
-        "pad_token_id": getattr(tok, "pad_token_id", None),
-    }, indent=2), encoding="utf-8")
-
-    for p in PROMPTS:
+    load = lambda: POOL.get(model_path, adapter_path)
+    TOKMETA.write_text(json.dumps(GEN_CACHE.tokenizer_meta(load, model_path, adapter_path), indent=2), encoding="utf-8")
+    draft = draft_path(DRAFT, run_entry_for(base, adapter))
+    if DRAFT and not draft:
+        print(f"[WARN] draft_model={DRAFT!r} not available for row {i}; decoding without a draft")
+
+    # one decode per prompt; the modes are cut from it
+    matrix = generate_matrix(list(PROMPTS), load, model_path, adapter_path, draft)
+    spec = spec_summary([o for _, o, _ in matrix])
+    if spec:
+        spec_rows[f"{base}|{artifact_label}"] = {"draft": draft, **spec}
+    for p, (fp, o, shots) in zip(PROMPTS, matrix):
+        entropy_items.append(({"step": STEP_NAME, "model_id": base, "artifact": artifact_label, "prompt": p}, o))
         for mode in MODES:
-            fp, gen, shots = generate_once(p, model, tok)
-            if mode == "custom_stop":
-                gen = trim_on_custom_stop(gen, CUSTOM_STOP).strip()
+            gen = mode_output(o, mode)
             all_rows.append({
                 "timestamp": ts, "seed": SEED,
                 "model_id": base, "artifact": artifact_label,
@@ -152,6 +213,7 @@ for i, row in df.iterrows():
                 "output_text": gen, "generation": gen,
                 "shots": shots, "max_new_tokens": MAX_NEW,
                 "custom_stop": CUSTOM_STOP if mode == "custom_stop" else "",
+                "eos_index": o.get("eos_index"),
             })
             print(f"[{mode}] {p} → {gen[:80]}...")
 
@@ -171,3 +233,15 @@ with CSV_PATH.open("w", encoding="utf-8", newline="") as f:
         w.writerow({k: rr.get(k, "") for k in csv_cols})
 
 print(f"Rows written: {len(all_rows)} → {JSONL_PATH} and {CSV_PATH}")
+if spec_rows:
+    SPEC_PATH.write_text(json.dumps(spec_rows, indent=2), encoding="utf-8")
+    for k, v in spec_rows.items():
+        print(f"[speculative] {k}: acceptance {v['acceptance_rate']:.0%}, {v['tokens_per_sec']} tok/s"
+              + (f", {v['mismatches']}/{v['verified']} differ from plain decoding" if "verified" in v else ""))
+if TOKEN_STATS:
+    n = write_entropy(entropy_items, ENTROPY_TOKENS, ENTROPY_SUMMARY)
+    print(f"[entropy] {n} generations → {ENTROPY_TOKENS} and {ENTROPY_SUMMARY}")
+POOL.report()
+PREFIXES.report()
+GEN_CACHE.report()
+DIGESTS.save()
@@ -1,27 +1,32 @@
 # scripts/115_entropy.py
-# STEP 11.5 — Entropy meter for generation (per-token + per-sample)
+# STEP 11.5 — Entropy meter for generation (reader)
+# Inputs (written by snapshot / examination with token_stats: k, from the same decode):
+#   eval_out/<step>_entropy_tokens.jsonl   (one record per generated token)
+#   eval_out/<step>_entropy_summary.csv    (one record per prompt/result)
 # Outputs:
-#   eval_out/entropy_tokens.jsonl   (one record per generated token)
-#   eval_out/entropy_summary.csv    (one record per prompt/result)
+#   eval_out/entropy_by_artifact.csv       (one record per step × model × artifact)
 
 """
 Entropy Meter for Language Model Generations
 --------------------------------------------
-This script measures *per-token uncertainty* during generation.
+This script reports *per-token uncertainty* during generation.
 
 Each generation step, the model emits log-probabilities over its vocabulary.
 We convert those to probabilities and compute Shannon entropy:
     H(p) = -Σ p * log(p)
 Low entropy → model is confident; high entropy → model is uncertain.
+
+The statistics — entropy, varentropy, top-k mass, rank and logprob of the
+chosen token — are computed on-device while snapshot / examination decode
+(token_stats.py), so nothing is generated twice. This step aggregates them per
+artifact and lists the most uncertain generations and tokens.
 """
 
 from __future__ import annotations
-import os, sys, json, math, csv, time
+import os, sys, json, csv
+from collections import defaultdict
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Tuple
-
-from mlx_lm import load as mlx_load
-from mlx_lm.generate import stream_generate  # yields GenerationResponse objects
+from typing import Dict, List, Any
 
 # --- Config loader ---
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
@@ -33,149 +38,65 @@ STEP_NAME = os.environ["STEP_NAME"]
 STEP_CFG  = CFG[STEP_NAME]
 PARAMS    = STEP_CFG
 
-EVAL_DIR  = Path( CFG.eval.output_dir); EVAL_DIR.mkdir(exist_ok=True)
-RUN_DIR   = Path( CFG.run.output_dir)
-
-ARTIFACTS     = RUN_DIR / CFG.data.artifacts)
-POLICY_JSON   = EVAL_DIR / CFG.eval.policy)
-GEN_JSONL     = EVAL_DIR / (CFG.eval.generations) + ".jsonl")
-
-TOK_PATH      = EVAL_DIR / "entropy_tokens.jsonl"
-SUM_PATH      = EVAL_DIR / "entropy_summary.csv"
-
-MAX_NEW   = int(STEP_CFG.max_new_tokens)
-STOP_STRS = getattr(PARAMS, "stop_strings", ["\n\n", "==="])
+EVAL_DIR  = Path( CFG.run.eval_dir); EVAL_DIR.mkdir(exist_ok=True)
+OUT_PATH  = EVAL_DIR / "entropy_by_artifact.csv"
+TOP_N     = int(getattr(PARAMS, "top_n", 10))
 
 # --------------------------
 # Helpers
 # --------------------------
-def load_policy() -> Dict[str, Any]:
-    if POLICY_JSON.exists():
-        return json.loads(POLICY_JSON.read_text(encoding="utf-8"))
-    return {"prompt_policy": {"name": "plain"}, "artifact_preference": ["quantized","fused","adapter"]}
-
-def load_prompts_from_generations(path: Path) -> List[str]:
-    prompts = []
-    if not path.exists():
-        raise SystemExit(f"Missing generations.jsonl at {path}")
-    with path.open("r", encoding="utf-8") as f:
-        for line in f:
-            obj = json.loads(line)
-            if "prompt" in obj:
-                prompts.append(obj["prompt"])
-    return prompts
-
-def pick_artifact(artifacts_path: Path, policy: Dict[str, Any]) -> Tuple[str, Optional[str], str]:
-    pref = policy.get("artifact_preference", ["quantized","fused","adapter"])
-    data = json.loads(artifacts_path.read_text(encoding="utf-8"))
-    runs = data.get("runs", [])
-    if not runs:
-        raise RuntimeError("No runs in artifacts.json")
-
-    cands = []
-    for run in reversed(runs):  # newest last
-        model_id   = run.get("model_id","").strip()
-        adapter    = (run.get("adapter_dir") or "").strip() or None
-        fused_dir  = (run.get("fused_dir") or "").strip()
-        quant_dir  = (run.get("quantized_dir") or "").strip()
-        if quant_dir and Path(quant_dir).exists():
-            cands.append(("quantized", quant_dir, None))
-        if fused_dir and Path(fused_dir).exists():
-            cands.append(("fused", fused_dir, None))
-        if adapter and model_id:
-            cands.append(("adapter", model_id, adapter))
-
-    for want in pref:
-        for lab, mpath, apath in cands:
-            if lab == want:
-                return mpath, apath, lab
-    return cands[0][1], cands[0][2], cands[0][0]
-
-def entropy_from_logprobs(logprobs) -> float:
-    vals = list(logprobs)
-    m = max(vals)
-    exps = [math.exp(v - m) for v in vals]
-    Z = sum(exps)
-    ps = [e / (Z + 1e-12) for e in exps]
-    return -sum(p * math.log(p + 1e-12) for p in ps)
-
-def trim_on_stops(text: str, stops: List[str]) -> str:
-    cut = len(text)
-    for s in stops:
-        i = text.find(s)
-        if i != -1:
-            cut = min(cut, i)
-    return text[:cut]
-
-def median(xs: List[float]) -> float:
-    if not xs: return 0.0
-    ys = sorted(xs); n = len(ys); h = n//2
-    return (ys[h] if n%2 else 0.5*(ys[h-1]+ys[h]))
-
-def apply_prompt_policy(prompt: str, policy: Dict[str,Any]) -> str:
-    pp = policy.get("prompt_policy", {"name": "plain"})
-    name = pp.get("name", "plain")
-    if name == "directive":
-        return f"{prompt}{pp.get('directive',{}).get('suffix','')}"
-    if name == "fewshot":
-        fs = pp.get("fewshot", {})
-        shots  = fs.get("shots", [])
-        prefix = fs.get("prefix","")
-        joiner = fs.get("joiner","\n")
-        suffix = fs.get("suffix","\n")
-        return f"{prefix}{joiner.join(shots)}{suffix}".replace("{prompt}", prompt)
-    return prompt
+def read_summaries() -> List[Dict[str, Any]]:
+    rows = []
+    for p in sorted(EVAL_DIR.glob("*_entropy_summary.csv")):
+        with p.open("r", encoding="utf-8", newline="") as f:
+            rows += list(csv.DictReader(f))
+    return rows
+
+def read_tokens() -> List[Dict[str, Any]]:
+    recs = []
+    for p in sorted(EVAL_DIR.glob("*_entropy_tokens.jsonl")):
+        with p.open("r", encoding="utf-8") as f:
+            recs += [r for r in map(json.loads, f) if not r.get("past_eos")]
+    return recs
+
+def group_key(r: Dict[str, Any]) -> tuple:
+    return (r.get("step", ""), r.get("model_id", ""), r.get("artifact", ""))
 
 # --------------------------
 # Main
 # --------------------------
-policy   = load_policy()
-prompts  = load_prompts_from_generations(GEN_JSONL)
-model_path, adapter_path, artifact_label = pick_artifact(ARTIFACTS, policy)
-model, tok = mlx_load(model_path, adapter_path=adapter_path)
-
-toks_f = TOK_PATH.open("w", encoding="utf-8", newline="")
-sum_f  = SUM_PATH.open("w", encoding="utf-8", newline="")
-sum_writer = csv.writer(sum_f)
-sum_writer.writerow(["artifact","prompt_idx","prompt","tokens","mean_entropy","median_entropy","min_entropy","max_entropy"])
-
-for i, user_prompt in enumerate(prompts):
-    full_prompt = apply_prompt_policy(user_prompt, policy)
-    buf = ""
-    entropies: List[float] = []
-    token_ids: List[int] = []
-
-    for step in stream_generate(model=model, tokenizer=tok, prompt=full_prompt, max_tokens=MAX_NEW):
-        token_id   = step.token
-        piece      = step.text
-        logprobs   = step.logprobs
-
-        buf += piece
-        token_ids.append(token_id)
-
-        if logprobs is not None:
-            H = entropy_from_logprobs(logprobs.tolist())
-            entropies.append(H)
-            rec = {
-                "artifact": artifact_label,
-                "prompt_idx": i,
-                "token_index": len(token_ids)-1,
-                "token_id": token_id,
-                "token_text": piece,
-                "entropy": H,
-            }
-            toks_f.write(json.dumps(rec, ensure_ascii=False) + "\n")
-
-        if any(s in buf for s in STOP_STRS):
-            break
-
-    gen = trim_on_stops(buf, STOP_STRS).strip()
-    mean_H = sum(entropies)/len(entropies) if entropies else 0.0
-    sum_writer.writerow([artifact_label, i, user_prompt, len(token_ids),
-                         f"{mean_H:.4f}", f"{median(entropies):.4f}",
-                         f"{min(entropies) if entropies else 0.0:.4f}",
-                         f"{max(entropies) if entropies else 0.0:.4f}"])
-
-toks_f.close(); sum_f.close()
-print(f"[OK] Wrote per-token → {TOK_PATH}")
-print(f"[OK] Wrote per-sample → {SUM_PATH}")
+summaries = read_summaries()
+if not summaries:
+    raise SystemExit(f"No *_entropy_summary.csv in {EVAL_DIR}; set token_stats (e.g. 10) for snapshot or "
+                     f"examination and re-run it (cached generations are reused only with the same token_stats).")
+
+groups: Dict[tuple, List[Dict[str, Any]]] = defaultdict(list)
+for r in summaries:
+    groups[group_key(r)].append(r)
+
+cols = ["step", "model_id", "artifact", "generations", "tokens", "mean_entropy", "mean_varentropy",
+        "mean_topk_mass", "mean_rank", "mean_logprob"]
+with OUT_PATH.open("w", encoding="utf-8", newline="") as f:
+    w = csv.writer(f)
+    w.writerow(cols)
+    for (step, model_id, artifact), rs in groups.items():
+        n_tok = sum(int(r["tokens"]) for r in rs)
+        # token-weighted means over the group's generations
+        wmean = lambda k: sum(float(r[k]) * int(r["tokens"]) for r in rs) / n_tok if n_tok else 0.0
+        vals = [wmean(k) for k in ("mean_entropy", "mean_varentropy", "mean_topk_mass", "mean_rank", "mean_logprob")]
+        w.writerow([step, model_id, artifact, len(rs), n_tok] + [f"{v:.4f}" for v in vals])
+        print(f"[{step}] {model_id} | {artifact}: {len(rs)} generations, {n_tok} tokens, "
+              f"H {vals[0]:.3f}, varentropy {vals[1]:.3f}, top-k mass {vals[2]:.3f}")
+
+print(f"\nMost uncertain generations (mean entropy):")
+for r in sorted(summaries, key=lambda r: -float(r["mean_entropy"]))[:TOP_N]:
+    print(f"  {float(r['mean_entropy']):.3f}  [{r.get('artifact', '')}] {r.get('prompt', '')[:80]}")
+
+tokens = read_tokens()
+if tokens:
+    print(f"\nMost uncertain tokens (entropy):")
+    for t in sorted(tokens, key=lambda t: -t["entropy"])[:TOP_N]:
+        print(f"  {t['entropy']:.3f}  rank {t['rank']:>3}  {t['token_text']!r}  "
+              f"[{t.get('artifact', '')}] {t.get('prompt', '')[:60]}")
+
+print(f"\n[OK] Wrote per-artifact → {OUT_PATH}")
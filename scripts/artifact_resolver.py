@@ -0,0 +1,115 @@
+# scripts/artifact_resolver.py
+# Which weights a name refers to, from artifacts.json and generation_policy.json.
+#
+#   model_path, adapter_path, label = resolve("default", ARTIFACTS, policy)
+#
+# Names:
+#   "" / "default"                   the newest run that has any artifact: the policy's
+#                                    artifact_choice for that run (run_key; 044_bench_artifacts:
+#                                    smallest artifact within the ppl tolerance) when that
+#                                    artifact belongs to this run, else its artifact_preference
+#                                    order (quantized → fused → adapter by default); older
+#                                    runs are never mixed in
+#   "quantized" | "fused" | "adapter"  that artifact of the newest run that has one
+#   "<model_id>:<label>"             that artifact of the newest run for model_id
+#   anything else                    a model path / hub id, used as is
+# Shared by serve_local.py and chat_jim.py.
+
+from __future__ import annotations
+import json
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+LABELS = ("quantized", "fused", "adapter")
+DEFAULT_PREFERENCE = ["quantized", "fused", "adapter"]
+
+def load_runs(artifacts_path: Path) -> List[Dict[str, Any]]:
+    p = Path(artifacts_path)
+    if not p.exists():
+        return []
+    return json.loads(p.read_text(encoding="utf-8")).get("runs", []) or []
+
+def load_policy(*paths: Path) -> Dict[str, Any]:
+    """The generation policy files that exist, merged; earlier paths win per key ({} if none)."""
+    out: Dict[str, Any] = {}
+    for p in reversed(paths):
+        if p and Path(p).exists():
+            out.update(json.loads(Path(p).read_text(encoding="utf-8")))
+    return out
+
+def run_key(run: Dict[str, Any]) -> str:
+    """One run's key in artifact_choice: model_id and adapter_dir (sweep runs share a model_id)."""
+    adapter = (run.get("adapter_dir") or "").strip()
+    return f"{run.get('model_id', '')}@{Path(adapter).resolve() if adapter else ''}"
+
+def candidates(run: Dict[str, Any], must_exist: bool = True) -> List[Tuple[str, str, Optional[str]]]:
+    """(label, model_path, adapter_path) for each artifact of one run."""
+    model_id  = (run.get("model_id") or "").strip()
+    adapter   = (run.get("adapter_dir") or "").strip() or None
+    fused_dir = (run.get("fused_dir") or "").strip()
+    quant_dir = (run.get("quantized_dir") or "").strip()
+    ok = (lambda p: Path(p).exists()) if must_exist else bool
+    out = []
+    if quant_dir and ok(quant_dir):
+        out.append(("quantized", quant_dir, None))
+    if fused_dir and ok(fused_dir):
+        out.append(("fused", fused_dir, None))
+    if adapter and model_id:
+        out.append(("adapter", model_id, adapter))
+    return out
+
+def chosen(run: Dict[str, Any], policy: Optional[Dict[str, Any]]) -> Optional[Tuple[str, Optional[str], str]]:
+    """The policy's artifact_choice for this run, if it is one of this run's artifacts."""
+    c = ((policy or {}).get("artifact_choice") or {}).get(run_key(run))
+    if not c:
+        return None
+    same = lambda a, b: bool(a and b) and Path(a).resolve() == Path(b).resolve()
+    if c.get("adapter_path"):
+        ok = same(c["adapter_path"], run.get("adapter_dir")) and c.get("model_path") == run.get("model_id")
+        return (c["model_path"], c["adapter_path"], "adapter") if ok else None
+    dirs = [run.get("fused_dir"), run.get("quantized_dir")] + [v.get("dir") for v in run.get("quantized_variants") or []]
+    if Path(c.get("model_path", "")).exists() and any(same(c["model_path"], d) for d in dirs):
+        return c["model_path"], None, c.get("kind") or c.get("label", "")
+    return None
+
+def resolve(name: str, artifacts_path: Path, policy: Optional[Dict[str, Any]] = None,
+            adapter_path: Optional[str] = None) -> Tuple[str, Optional[str], str]:
+    """(model_path, adapter_path, label) for `name` (see the header)."""
+    name = (name or "").strip()
+    runs = load_runs(artifacts_path)
+    if name in ("", "default"):
+        pref = (policy or {}).get("artifact_preference", DEFAULT_PREFERENCE)
+        run = next((r for r in reversed(runs) if candidates(r)), None)
+        if run is None:
+            raise LookupError(f"no artifacts in {artifacts_path}")
+        pick = chosen(run, policy)
+        if pick:
+            return pick
+        cands = candidates(run)
+        for want in pref:
+            for lab, mpath, apath in cands:
+                if lab == want:
+                    return mpath, apath, lab
+        lab, mpath, apath = cands[0]
+        return mpath, apath, lab
+    model_id, sep, label = name.rpartition(":")
+    if not sep or label not in LABELS:
+        model_id, label = "", name
+    if label in LABELS:
+        for r in reversed(runs):
+            if model_id and r.get("model_id") != model_id:
+                continue
+            for lab, mpath, apath in candidates(r):
+                if lab == label:
+                    return mpath, apath, lab
+        raise LookupError(f"no {name!r} artifact in {artifacts_path}")
+    return name, adapter_path, "path"
+
+def listing(artifacts_path: Path) -> List[Dict[str, Any]]:
+    """Every artifact of every run, newest run first (for /v1/models)."""
+    out = []
+    for r in reversed(load_runs(artifacts_path)):
+        for lab, mpath, apath in candidates(r):
+            out.append({"id": f"{r.get('model_id', '')}:{lab}", "label": lab,
+                        "model_path": mpath, "adapter_path": apath})
+    return out
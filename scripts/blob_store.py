@@ -0,0 +1,163 @@
+# scripts/blob_store.py
+# Content-addressed store for large run artifacts (fused / quantized models).
+#
+#   <store>/blobs/<algo>/<ab>/<digest>     read-only, one file per unique content
+#
+# Run directories keep their normal layout, but each file is a hardlink to its
+# blob, so byte-identical weights, tokenizers and configs across daily runs
+# take the space of one copy. The blob's link count is its reference count:
+# a blob whose only remaining link is the store itself (st_nlink == 1) is
+# garbage, which `gc` deletes. erase_dailies.sh runs gc after removing runs.
+#
+# A hardlink shares the blob's inode, so linked run files are read-only too;
+# the write bit is deliberately not restored, since writing one in place would
+# change every run that shares the blob. Anything that rewrites a stored file
+# has to unlink or replace it (write a new file, then rename over it). The
+# store is off by default (run.blob_store: ""); set it to e.g. ../blob_store
+# to share artifacts across daily runs.
+#
+# Hardlinks need the store and the run directory on the same volume; across
+# volumes the file is left out of the store (a copy there would have
+# st_nlink == 1 and be collected by the next gc) and the run keeps its own
+# file, with no blob ID in the registry.
+#
+#   python scripts/blob_store.py stats <store>
+#   python scripts/blob_store.py gc <store> [--dry-run]
+#   python scripts/blob_store.py where      # run.blob_store resolved from the CWD
+#
+# run.blob_store is relative to the step's working directory (the daily run
+# directory), so `where` has to run there too; erase_dailies.sh uses it to gc
+# the store fuse actually wrote to.
+
+from __future__ import annotations
+import os, sys, stat, errno
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+class BlobStore:
+    def __init__(self, root: Path):
+        self.root = Path(root).expanduser()
+        (self.root / "blobs").mkdir(parents=True, exist_ok=True)
+        self.linked = self.added = self.skipped = 0
+        self.saved_bytes = 0
+
+    def blob_path(self, blob_id: str) -> Path:
+        algo, digest = blob_id.split(":", 1)
+        return self.root / "blobs" / algo / digest[:2] / digest
+
+    def ingest(self, path: Path, blob_id: str) -> bool:
+        """
+        Make `path` a hardlink to the blob for `blob_id`, adding the blob if it
+        is new. Returns True when `path` now shares the blob's inode; False
+        (store untouched) when the store is on another volume.
+        """
+        path, blob = Path(path), self.blob_path(blob_id)
+        st = path.stat()
+        if blob.exists():
+            if os.path.samefile(path, blob):
+                return True
+            tmp = path.with_name(path.name + ".bloblink")
+            try:
+                os.link(blob, tmp)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                self.skipped += 1
+                return False
+            os.replace(tmp, path)
+            self.linked += 1
+            self.saved_bytes += st.st_size
+            return True
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(path, blob)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            self.skipped += 1
+            return False
+        self.added += 1
+        os.chmod(blob, READ_ONLY)
+        return True
+
+    def ingest_files(self, records: List[Dict[str, Any]], digests=None):
+        """
+        Ingest registry file records (digest_cache.list_files output) and tag
+        each file that now shares a blob with its blob ID ("sha256:<hex>" /
+        "xxh3_128:<hex>"). Relinked files get a new inode, so their
+        digest-cache entries are refreshed.
+        """
+        for rec in records:
+            algo = "sha256" if "sha256" in rec else "xxh3_128"
+            if algo not in rec:
+                continue
+            blob_id = f"{algo}:{rec[algo]}"
+            if not self.ingest(Path(rec["path"]), blob_id):
+                continue
+            rec["blob"] = blob_id
+            if digests is not None:
+                digests.remember(Path(rec["path"]), algo, rec[algo])
+
+    def blobs(self):
+        for p in (self.root / "blobs").glob("*/*/*"):
+            if p.is_file():
+                yield p
+
+    def stats(self) -> Dict[str, Any]:
+        n = size = refs = 0
+        for p in self.blobs():
+            st = p.stat()
+            n += 1
+            size += st.st_size
+            refs += st.st_nlink - 1
+        return {"blobs": n, "bytes": size, "references": refs}
+
+    def gc(self, dry_run: bool = False) -> Dict[str, int]:
+        """Delete blobs no run directory links to any more."""
+        removed = freed = 0
+        for p in list(self.blobs()):
+            st = p.stat()
+            if st.st_nlink > 1:
+                continue
+            removed += 1
+            freed += st.st_size
+            if not dry_run:
+                p.unlink()
+        return {"removed": removed, "freed_bytes": freed}
+
+def open_store(root: Optional[str]) -> Optional[BlobStore]:
+    """BlobStore for run.blob_store, or None when disabled or not creatable."""
+    if not root:
+        return None
+    try:
+        return BlobStore(Path(root))
+    except OSError as e:
+        print(f"⚠️  blob store {root} unavailable ({e}); keeping plain copies.")
+        return None
+
+def configured_root() -> Optional[Path]:
+    """run.blob_store of the config a step in the CWD would load, made absolute."""
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from config_loader import load_config
+    root = getattr(getattr(load_config(), "run", None), "blob_store", "")
+    return Path(root).expanduser().resolve() if root else None
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["where"]:
+        root = configured_root()
+        if root:
+            print(root)
+        sys.exit(0)
+    if len(sys.argv) < 3 or sys.argv[1] not in ("gc", "stats"):
+        raise SystemExit("usage: blob_store.py {gc|stats} <store> [--dry-run] | blob_store.py where")
+    store = BlobStore(Path(sys.argv[2]))
+    if sys.argv[1] == "stats":
+        s = store.stats()
+        print(f"{s['blobs']} blobs, {s['bytes'] / 1024**3:.2f} GB, {s['references']} references")
+    else:
+        dry = "--dry-run" in sys.argv[3:]
+        r = store.gc(dry_run=dry)
+        print(f"{'would remove' if dry else 'removed'} {r['removed']} blobs, "
+              f"{r['freed_bytes'] / 1024**3:.2f} GB")
@@ -16,34 +16,148 @@
 # -----------------------------
 # scripts/chat.py
 # -----------------------------
-from mlx_lm import load, generate
-from mlx_lm.utils import load_model
+# Streams each reply as it decodes. The model is the run's best artifact
+# (artifact_resolver: the generation policy's preference over artifacts.json,
+# MODEL_NAME if there is none). One KV cache lives across turns: the persona
+# preamble is prefilled once (and forked from the prefix cache on /reset),
+# and every turn only prefills its own seed on top of the conversation so far.
+# After a reply the cache is trimmed back to the tokens actually shown (the
+# EOS / stop token, and anything a stop string cut, are dropped), so the next
+# turn continues the visible conversation. When the history would outgrow
+# MAX_CONTEXT it is dropped back to the preamble. After each reply: time to first token, decode tokens/sec, context.
+from mlx_lm import load, stream_generate
+from mlx_lm.models.cache import make_prompt_cache, can_trim_prompt_cache
 import readline
+import os, sys, time
 
 from pathlib import Path
+sys.path.append(os.path.dirname(__file__))
+os.environ.setdefault("EXEC", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # config_loader needs it
+from config_loader import load_config
+from prefix_cache import PrefixCache, supports
+from artifact_resolver import resolve, load_policy
+from stop_matcher import StopMatcher, stop_token_ids, policy_stop_strings
 MODEL_NAME = "microsoft/Phi-3-mini-4k-instruct"
-WEIGHTS_PATH = Path( "phi3-mlx/model.safetensors" )
+ARTIFACT = "default"   # or "quantized" / "fused" / "adapter" / a model path
+DRAFT_MODEL = ""   # e.g. a quantized copy of the artifact: speculative decoding, same output under greedy
+NUM_DRAFT = 3
+MAX_TOKENS = 512
+MAX_CONTEXT = 4096
 
 PROMPT_TEMPLATE = """
 You are St. John's Jim, a myth-weaving, bar-stool Buddha of the Pacific Northwest.
 Tell a new short story in your usual voice. Base it on this seed:
 """
+TURN_TEMPLATE = "\n\nTell another one. Base it on this seed:\n{seed}\n"
 
-model, tokenizer = load(MODEL_NAME)
+CFG = load_config()
+POLICIES = (Path(CFG.run.output_dir) / CFG.run.policy, Path(CFG.run.data_dir) / CFG.run.policy)
+try:
+    model_path, adapter_path, label = resolve(ARTIFACT, Path(CFG.run.data_dir) / CFG.run.artifacts,
+                                              load_policy(*POLICIES))
+except LookupError as e:
+    print(f"[chat] {e}; using {MODEL_NAME}")
+    model_path, adapter_path, label = MODEL_NAME, None, "base"
+model, tokenizer = load(model_path, adapter_path=adapter_path)
+draft = load(DRAFT_MODEL)[0] if DRAFT_MODEL else None
+STOPS = policy_stop_strings(*POLICIES)
+STOP_IDS = stop_token_ids(tokenizer, STOPS)
 
-print("\n🌀 Chatting with the Jim-tuned model. Type your story seed. Ctrl+C to exit.\n")
+PREFIXES = PrefixCache(budget_mb=256, min_tokens=1)
+PREAMBLE_IDS = tokenizer.encode(PROMPT_TEMPLATE)
+
+def fresh_cache():
+    """(cache, ids still to prefill): the preamble alone, forked from the prefix cache when possible."""
+    if supports(model) and draft is None:   # a speculative cache also holds the draft's layers
+        return PREFIXES.fork(model, [PREAMBLE_IDS]), []
+    return make_prompt_cache(model) + (make_prompt_cache(draft) if draft is not None else []), list(PREAMBLE_IDS)
+
+def trim_to(cache, offset: int) -> bool:
+    """Drop cached tokens past `offset` (a draft model's layers may already be shorter); False if it cannot."""
+    if not can_trim_prompt_cache(cache):
+        return False
+    for c in cache:
+        if c.offset > offset:
+            c.trim(c.offset - offset)
+    return True
+
+def reply(cache, ids):
+    """
+    Stream one reply into `cache` and trim the cache to what was shown.
+    Returns (ids to feed ahead of the next turn, tokens generated, seconds to
+    first token, decode seconds); the ids are None when the cache could not
+    be trimmed and the history has to be dropped.
+    """
+    matcher = StopMatcher(STOPS, STOP_IDS)
+    hold = max(matcher.window - 1, 0)
+    text, sent, toks, n = "", 0, [], 0
+    start = cache[0].offset + len(ids)
+    cut = None
+    t0 = time.perf_counter()
+    t_first = None
+    kw = {"draft_model": draft, "num_draft_tokens": NUM_DRAFT} if draft is not None else {}
+    for r in stream_generate(model, tokenizer, prompt=ids, max_tokens=MAX_TOKENS, prompt_cache=cache, **kw):
+        if t_first is None:
+            t_first = time.perf_counter()
+        # the final response carries a new token only on "length" when mlx_lm did not
+        # already yield it (0.26.x repeats the last token); otherwise it flushes text
+        if r.finish_reason is None or (r.finish_reason == "length" and r.generation_tokens > n):
+            n += 1
+            if matcher.is_stop_token(r.token):
+                break
+            toks.append(r.token)
+        text += r.text
+        cut = matcher.feed(r.text)
+        if cut is not None:
+            text = text[:cut]
+            break
+        safe = max(sent, len(text) - hold)
+        print(text[sent:safe], end="", flush=True)
+        sent = safe
+    print(text[sent:], flush=True)
+    t_end = time.perf_counter()
+    if cut is not None:   # a stop string can end mid-token: drop the reply, re-feed the shown text
+        ok, refeed = trim_to(cache, start), tokenizer.encode(text, add_special_tokens=False)
+    else:   # speculative decoding has not fed the last token(s) yet: those are re-fed too
+        ok = trim_to(cache, start + len(toks))
+        refeed = toks[max(0, cache[0].offset - start):]
+    return (refeed if ok else None), n, (t_first or t_end) - t0, t_end - (t_first or t_end)
+
+print(f"\n🌀 Chatting with Jim ({label}: {model_path}). Type a story seed; /reset forgets the conversation. "
+      f"Ctrl+C to exit.\n")
+cache, pending = fresh_cache()
+turn = 0
 
 while True:
     try:
         user_input = input("Seed > ").strip()
         if not user_input:
             continue
+        if user_input == "/reset":
+            cache, pending, turn = *fresh_cache(), 0
+            print("(conversation cleared)\n")
+            continue
+
+        text = user_input + "\n" if turn == 0 else TURN_TEMPLATE.format(seed=user_input)
+        ids = pending + tokenizer.encode(text, add_special_tokens=False)
+        if cache[0].offset + len(ids) + MAX_TOKENS > MAX_CONTEXT:
+            cache, pending = fresh_cache()
+            ids = pending + tokenizer.encode(user_input + "\n", add_special_tokens=False)
+            turn = 0
+            print("(history dropped to fit the context)")
+        pending = []
 
-        full_prompt = PROMPT_TEMPLATE + user_input + "\n"
-        response = generate(model, tokenizer, prompt=full_prompt, verbose=False, max_tokens=512)
-        print("\n📘 Jim says:\n" + response + "\n")
+        print("\n📘 Jim says:")
+        pending, n, ttft, decode_s = reply(cache, ids)
+        turn += 1
+        print(f"\n[ttft {ttft:.2f}s · {(n - 1) / decode_s if decode_s > 0 and n > 1 else 0.0:.1f} tok/s · "
+              f"{n} tokens · context {cache[0].offset + len(pending or [])}]\n")
+        if pending is None:   # this cache type cannot drop the EOS / stop tokens it was fed
+            cache, pending, turn = *fresh_cache(), 0
+            print("(history dropped: the cache cannot be trimmed)\n")
 
     except (KeyboardInterrupt, EOFError):
+        PREFIXES.report()
         print("\n👋 Goodbye!")
         break
 
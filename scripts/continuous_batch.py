@@ -0,0 +1,186 @@
+# scripts/continuous_batch.py
+# Continuous batching for one loaded model: requests join and leave a running
+# decode batch between steps instead of waiting for a whole batch to finish.
+#
+#   cb = ContinuousBatcher(model, tok, max_batch=8)
+#   req = cb.submit(prompt_ids, max_tokens=128, stop_strings=[...], on_event=cb_fn)
+#   while cb.busy: cb.step()        # on_event(req, delta_text, done) as text arrives
+#
+# Layout follows gen_engine: rows share one left-padded KV cache with a
+# boolean validity mask, and every row's keys sit at the cache slot their RoPE
+# position was computed for. A new request of n prompt tokens therefore joins
+# a running batch of cache length T by being prefilled left-padded to T
+# (n ≤ T), then concatenated on the batch axis; its first token comes from
+# that prefill. Longer prompts wait until the batch drains and start the next
+# one; admission is FIFO, so a long prompt at the head of the queue is never
+# overtaken indefinitely. Finished rows are dropped from the cache the same
+# step. Models whose prompt cache is not plain KVCache (rotating / quantized
+# KV) cannot take the growing pad mask: they run one request at a time,
+# unpadded, with the model's own (window-aware) attention mask.
+#
+# Per-request sampling: temp 0 is argmax, otherwise mlx_lm's sampler at that
+# temperature. Outputs are gen_engine output dicts (text, text_eos, tokens,
+# finish_reason, eos_index, checkpoints, and token_stats for requests that
+# ask for them); greedy output equals gen_engine.generate_batch for the same
+# prompt.
+
+from __future__ import annotations
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import mlx.core as mx
+from mlx_lm.sample_utils import make_sampler
+
+from gen_engine import RowState, encode, eos_ids, pad_id, prefill_padded
+from prefix_cache import supports as plain_kv
+from stop_matcher import stop_token_ids
+from token_stats import step_stats, to_host
+
+class Request:
+    def __init__(self, ids: List[int], state: RowState, temp: float,
+                 on_event: Optional[Callable[["Request", str, bool], None]], stats_top_k: int = 0):
+        self.ids, self.state, self.temp, self.on_event = ids, state, float(temp), on_event
+        self.stats_top_k = int(stats_top_k)
+        self.submitted = time.perf_counter()
+        self.first_token_s: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.job = None   # caller's handle (serve_local attaches its Job)
+
+class ContinuousBatcher:
+    def __init__(self, model, tok, max_batch: int = 8):
+        self.model, self.tok, self.max_batch = model, tok, max(1, int(max_batch))
+        self.eos, self.pad = eos_ids(tok), pad_id(tok)
+        self.dynamic = plain_kv(model)
+        if not self.dynamic:
+            self.max_batch = 1
+        self.waiting: "deque[Request]" = deque()
+        self.rows: List[Request] = []
+        self.cache = self.valid = self.y = None
+        self._samplers: Dict[float, Any] = {}
+        self.stats = {"requests": 0, "steps": 0, "tokens": 0, "joined_running": 0, "max_rows": 0}
+
+    @property
+    def busy(self) -> bool:
+        return bool(self.rows or self.waiting)
+
+    def submit(self, prompt, max_tokens: int = 128, stop_strings: Sequence[str] = (), ignore_eos: bool = False,
+               temp: float = 0.0, checkpoints: Sequence[int] = (), token_stats: int = 0, on_event=None) -> Request:
+        """Queue a prompt (text or token ids); it joins the batch at the next step()."""
+        ids = encode(self.tok, prompt)
+        stop_ids = stop_token_ids(self.tok, stop_strings)
+        if ignore_eos:
+            stop_ids -= self.eos
+        st = RowState(self.tok, len(ids), int(max_tokens), list(stop_strings), stop_ids, self.eos, ignore_eos,
+                      set(int(n) for n in checkpoints), stream=on_event is not None, stats=token_stats > 0)
+        req = Request(ids, st, temp, on_event, token_stats)
+        self.waiting.append(req)
+        self.stats["requests"] += 1
+        return req
+
+    # ---- one scheduler iteration ----
+    def step(self):
+        self._admit()
+        if not self.rows:
+            return
+        mask = None   # a lone unpadded row: the model builds its own mask
+        if self.dynamic:
+            self.valid = mx.concatenate([self.valid, mx.ones((len(self.rows), 1), dtype=mx.bool_)], axis=1)
+            mask = self.valid[:, None, None, :]
+        logits = self.model(self.y[:, None], mask=mask, cache=self.cache)[:, -1, :]
+        self.y, stats = self._sample(logits, self.rows)
+        self.stats["steps"] += 1
+        self._push(self.rows, self.y, stats)
+        self._retire()
+
+    def _admit(self):
+        free = self.max_batch - len(self.rows)
+        if not self.waiting or free <= 0:
+            return
+        width = self.cache[0].offset if self.rows else 0
+        new: List[Request] = []
+        while self.waiting and len(new) < free:
+            if self.rows and len(self.waiting[0].ids) > width:
+                break   # waits for the batch to drain
+            new.append(self.waiting.popleft())
+        if not new:
+            return
+        cache, logits, valid = prefill_padded(self.model, [r.ids for r in new], self.pad, width)
+        y, stats = self._sample(logits, new)
+        now = time.perf_counter()
+        for r in new:
+            r.first_token_s = now - r.submitted
+        if self.rows:
+            self.stats["joined_running"] += len(new)
+            for c, n in zip(self.cache, cache):
+                c.keys = mx.concatenate([c.keys[..., :c.offset, :], n.keys[..., :n.offset, :]], axis=0)
+                c.values = mx.concatenate([c.values[..., :c.offset, :], n.values[..., :n.offset, :]], axis=0)
+            self.valid = mx.concatenate([self.valid, valid], axis=0)
+            self.y = mx.concatenate([self.y, y], axis=0)
+        else:
+            self.cache, self.valid, self.y = cache, valid, y
+        self.rows += new
+        self.stats["max_rows"] = max(self.stats["max_rows"], len(self.rows))
+        self._push(new, y, stats)
+        self._retire()
+
+    def _sample(self, logits, reqs: List[Request]):
+        """Next token per row, and token_stats per row for the requests that want them."""
+        logprobs = logits - mx.logsumexp(logits, axis=-1, keepdims=True)
+        temps = [r.temp for r in reqs]
+        if not any(temps):
+            y = mx.argmax(logprobs, axis=-1)
+        else:
+            out = []
+            for i, t in enumerate(temps):
+                if t not in self._samplers:
+                    self._samplers[t] = make_sampler(temp=t)
+                out.append(self._samplers[t](logprobs[i:i + 1]))
+            y = mx.concatenate(out, axis=0)
+        stats: List[Optional[Dict[str, float]]] = [None] * len(reqs)
+        for k in sorted({r.stats_top_k for r in reqs if r.stats_top_k > 0}):   # one pass per distinct top_k
+            st = to_host(step_stats(logprobs, y, k))
+            for i, r in enumerate(reqs):
+                if r.stats_top_k == k:
+                    stats[i] = {f: v[i] for f, v in st.items()}
+        return y, stats
+
+    def _push(self, reqs: List[Request], y, stats: List[Optional[Dict[str, float]]]):
+        for r, t, st in zip(reqs, y.tolist(), stats):
+            if r.state.done:
+                continue
+            r.state.push(int(t), st)
+            self.stats["tokens"] += 1
+            if r.state.done:
+                r.result = r.state.finish()
+            if r.on_event is not None:
+                piece = r.state.delta()
+                if piece or r.state.done:
+                    r.on_event(r, piece, r.state.done)
+
+    def _retire(self):
+        alive = [i for i, r in enumerate(self.rows) if not r.state.done]
+        if len(alive) == len(self.rows):
+            return
+        if not alive:
+            self.rows, self.cache, self.valid, self.y = [], None, None, None
+            return
+        idx = mx.array(alive)
+        for c in self.cache:
+            c.keys, c.values = c.keys[idx], c.values[idx]
+        self.valid, self.y = self.valid[idx], self.y[idx]
+        self.rows = [self.rows[i] for i in alive]
+
+    def abort(self) -> List[Request]:
+        """Drop every queued and running request (after a failed step); returns them."""
+        dropped = self.rows + list(self.waiting)
+        self.rows, self.cache, self.valid, self.y = [], None, None, None
+        self.waiting.clear()
+        return dropped
+
+    def run(self, prompts: List[Any], **kw) -> List[Dict[str, Any]]:
+        """Submit all `prompts` and step until they finish (a synchronous batch)."""
+        reqs = [self.submit(p, **kw) for p in prompts]
+        while any(r.result is None for r in reqs):
+            self.step()
+        return [r.result for r in reqs]
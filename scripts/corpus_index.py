@@ -0,0 +1,197 @@
+# scripts/corpus_index.py
+# Persisted suffix-automaton index over the deduped training text, for the
+# memorization checks (04_snapshot.is_bad, 041_metrics.py/.coffee).
+#
+#   idx = open_index(train_path, DATA_DIR / CFG.run.catalog, DATA_DIR / CFG.run.corpus_index)
+#   idx.contains(s)        s is a substring of some training example
+#   idx.is_entry(s)        s is exactly a training example
+#   idx.longest_match(s)   longest substring of s found in the training text
+#
+# All three run in time proportional to len(s) (a binary search over a state's
+# outgoing edges per character). The automaton is built over
+#   SEP t1 SEP t2 SEP ... SEP      (SEP = U+0000, stripped from the texts)
+# so matches never span two examples, and "is an entry" is contains(SEP s SEP).
+#
+# One index per training file content: <corpus_index>/<train sha256>.sam, with
+# the sha taken from the data catalog (or hashed if the catalog lacks it). The
+# first step that needs it builds it; later runs just memory-map it.
+#
+# File layout (little-endian, Unicode code points as symbols):
+#   b"SAM1", u32 version, u32 n_states, u32 n_edges
+#   i32 link[n_states], i32 length[n_states], i32 edge_start[n_states + 1],
+#   i32 edge_char[n_edges], i32 edge_to[n_edges]     (edges sorted by char per state)
+# 041_metrics.coffee reads the same file.
+#
+#   python scripts/corpus_index.py <index.sam> "some text"
+
+from __future__ import annotations
+import os, sys, json, time, struct, hashlib
+from pathlib import Path
+from typing import List, Optional, Iterable
+
+import numpy as np
+
+SEP = "\x00"
+MAGIC = b"SAM1"
+VERSION = 1
+HEADER = struct.Struct("<4sIII")
+
+def load_texts(train_path: Path, text_field: str = "text") -> List[str]:
+    """Stripped, deduped, non-empty training texts (the memorization reference)."""
+    seen, out = set(), []
+    with Path(train_path).open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                t = json.loads(line).get(text_field, "")
+            except Exception:
+                continue
+            if isinstance(t, str) and t.strip():
+                t = t.strip().replace(SEP, "")
+                if t not in seen:
+                    seen.add(t); out.append(t)
+    return out
+
+def build(texts: Iterable[str]) -> dict:
+    """Suffix automaton of SEP t1 SEP t2 ... SEP, flattened to int32 arrays."""
+    link, length, nxt = [-1], [0], [{}]
+    last = 0
+
+    def extend(c: int):
+        nonlocal last
+        cur = len(length)
+        length.append(length[last] + 1); link.append(-1); nxt.append({})
+        p = last
+        while p != -1 and c not in nxt[p]:
+            nxt[p][c] = cur
+            p = link[p]
+        if p == -1:
+            link[cur] = 0
+        else:
+            q = nxt[p][c]
+            if length[p] + 1 == length[q]:
+                link[cur] = q
+            else:
+                clone = len(length)
+                length.append(length[p] + 1); link.append(link[q]); nxt.append(dict(nxt[q]))
+                while p != -1 and nxt[p].get(c) == q:
+                    nxt[p][c] = clone
+                    p = link[p]
+                link[q] = link[cur] = clone
+        last = cur
+
+    sep = ord(SEP)
+    extend(sep)
+    for t in texts:
+        for ch in t:
+            extend(ord(ch))
+        extend(sep)
+
+    n = len(length)
+    edge_start = np.zeros(n + 1, dtype=np.int32)
+    edge_start[1:] = np.cumsum([len(d) for d in nxt])
+    edge_char = np.empty(int(edge_start[-1]), dtype=np.int32)
+    edge_to = np.empty_like(edge_char)
+    for s, d in enumerate(nxt):
+        i = int(edge_start[s])
+        for c in sorted(d):
+            edge_char[i], edge_to[i] = c, d[c]
+            i += 1
+    return {"link": np.asarray(link, dtype=np.int32), "length": np.asarray(length, dtype=np.int32),
+            "edge_start": edge_start, "edge_char": edge_char, "edge_to": edge_to}
+
+def write(arrays: dict, path: Path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(arrays["link"]), len(arrays["edge_char"])))
+        for k in ("link", "length", "edge_start", "edge_char", "edge_to"):
+            f.write(arrays[k].astype("<i4").tobytes())
+    tmp.replace(path)
+
+class CorpusIndex:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with self.path.open("rb") as f:
+            magic, version, n, e = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path}: not a corpus index (v{VERSION})")
+        mm = np.memmap(self.path, dtype="<i4", mode="r", offset=HEADER.size)
+        self.link, mm = mm[:n], mm[n:]
+        self.length, mm = mm[:n], mm[n:]
+        self.edge_start, mm = mm[:n + 1], mm[n + 1:]
+        self.edge_char, self.edge_to = mm[:e], mm[e:2 * e]
+        self.n_states, self.n_edges = n, e
+
+    def step(self, s: int, c: int) -> int:
+        lo, hi = int(self.edge_start[s]), int(self.edge_start[s + 1])
+        i = lo + int(np.searchsorted(self.edge_char[lo:hi], c))
+        return int(self.edge_to[i]) if i < hi and self.edge_char[i] == c else -1
+
+    def contains(self, text: str) -> bool:
+        s = 0
+        for ch in text:
+            s = self.step(s, ord(ch))
+            if s < 0:
+                return False
+        return True
+
+    def is_entry(self, text: str) -> bool:
+        return self.contains(SEP + text + SEP)
+
+    def longest_match(self, text: str) -> int:
+        """Length of the longest substring of `text` occurring in the corpus."""
+        s = l = best = 0
+        for ch in text:
+            c = ord(ch)
+            t = self.step(s, c)
+            while t < 0 and s:
+                s = int(self.link[s]); l = int(self.length[s])
+                t = self.step(s, c)
+            if t < 0:
+                s = l = 0
+            else:
+                s, l = t, l + 1
+                best = max(best, l)
+        return best
+
+def train_sha256(train_path: Path, catalog_path: Optional[Path] = None) -> str:
+    if catalog_path and Path(catalog_path).exists():
+        try:
+            train = json.loads(Path(catalog_path).read_text(encoding="utf-8"))["files"]["train"]
+            if Path(train["path"]).resolve() == Path(train_path).resolve() and train.get("sha256"):
+                return train["sha256"]
+        except Exception:
+            pass
+    h = hashlib.sha256()
+    with Path(train_path).open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def open_index(train_path: Path, catalog_path: Optional[Path], index_dir: Path,
+               text_field: str = "text") -> CorpusIndex:
+    """Index for this training file, building it on first use."""
+    sha = train_sha256(train_path, catalog_path)
+    path = Path(index_dir) / f"{sha}.sam"
+    if not path.exists():
+        t0 = time.perf_counter()
+        texts = load_texts(train_path, text_field)
+        arrays = build(texts)
+        write(arrays, path)
+        meta = {"train_path": str(Path(train_path).resolve()), "train_sha256": sha, "text_field": text_field,
+                "entries": len(texts), "chars": sum(len(t) for t in texts),
+                "states": len(arrays["link"]), "edges": len(arrays["edge_char"]),
+                "built_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+        path.with_suffix(".json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        print(f"[corpus_index] built {path.name}: {meta['entries']} examples, {meta['chars']} chars, "
+              f"{meta['states']} states in {time.perf_counter() - t0:.1f}s")
+    return CorpusIndex(path)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        raise SystemExit("usage: corpus_index.py <index.sam> <text>")
+    idx = CorpusIndex(Path(sys.argv[1]))
+    q = sys.argv[2]
+    print(json.dumps({"contains": idx.contains(q), "is_entry": idx.is_entry(q),
+                      "longest_match": idx.longest_match(q)}))
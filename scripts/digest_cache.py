@@ -0,0 +1,112 @@
+# scripts/digest_cache.py
+# Persistent file digest cache shared by the registry steps (031_register,
+# 032_fuse). A digest is reused while the file's (size, mtime_ns, inode) are
+# unchanged, so re-registering a multi-GB fused/quantized model is a stat()
+# per file instead of a full read. Cold files are hashed on a thread pool
+# (hashlib and xxhash release the GIL on large buffers).
+#
+# Cache file (run.digest_cache, in the data dir):
+#   {"version": 1, "entries": {"/abs/path": {"size": ..., "mtime_ns": ...,
+#                                            "ino": ..., "sha256": "...", "xxh3_128": "..."}}}
+#
+# fast=True uses xxh3_128 (pip: xxhash) for change detection only; entries
+# then carry "xxh3_128" instead of "sha256". Without xxhash it falls back to
+# sha256.
+
+from __future__ import annotations
+import os, json, time, hashlib, threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+try:
+    import xxhash
+except ImportError:  # optional: only needed for fast=True
+    xxhash = None
+
+CHUNK = 4 * 1024 * 1024
+
+def algo_name(fast: bool) -> str:
+    return "xxh3_128" if fast and xxhash is not None else "sha256"
+
+def hash_file(p: Path, algo: str) -> str:
+    h = xxhash.xxh3_128() if algo == "xxh3_128" else hashlib.sha256()
+    with Path(p).open("rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class DigestCache:
+    def __init__(self, path: Optional[Path]):
+        self.path = Path(path) if path else None
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        if self.path and self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text(encoding="utf-8")).get("entries", {})
+            except Exception:
+                self.entries = {}
+
+    def digest(self, p: Path, algo: str = "sha256", st: Optional[os.stat_result] = None) -> str:
+        key = str(Path(p).resolve())
+        st = st or os.stat(key)
+        sig = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "ino": st.st_ino}
+        with self._lock:
+            e = self.entries.get(key)
+            if e and all(e.get(k) == v for k, v in sig.items()) and algo in e:
+                self.hits += 1
+                return e[algo]
+        value = hash_file(Path(key), algo)
+        with self._lock:
+            self.misses += 1
+            e = self.entries.get(key)
+            if not (e and all(e.get(k) == v for k, v in sig.items())):
+                e = dict(sig)
+            e[algo] = value
+            self.entries[key] = e
+        return value
+
+    def remember(self, p: Path, algo: str, value: str):
+        """Record a known digest for `p` under its current stat (e.g. after relinking)."""
+        key = str(Path(p).resolve())
+        st = os.stat(key)
+        with self._lock:
+            self.entries[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                 "ino": st.st_ino, algo: value}
+
+    def save(self):
+        if not self.path:
+            return
+        # drop entries for files that no longer exist
+        self.entries = {k: v for k, v in self.entries.items() if os.path.exists(k)}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"version": 1, "entries": self.entries}), encoding="utf-8")
+        tmp.replace(self.path)
+
+def list_files(root: Path, cache: DigestCache, workers: int = 4, fast: bool = False) -> List[Dict[str, Any]]:
+    """
+    Registry file records for everything under `root`:
+    {path, rel, bytes, sha256 | xxh3_128, mtime_utc}.
+    """
+    root = Path(root)
+    if not root.exists():
+        return []
+    algo = algo_name(fast)
+    files = [(p, p.stat()) for p in sorted(root.rglob("*")) if p.is_file()]
+
+    def one(item):
+        p, st = item
+        return {
+            "path": str(p.resolve()),
+            "rel": str(p.relative_to(root)),
+            "bytes": st.st_size,
+            algo: cache.digest(p, algo, st),
+            "mtime_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(st.st_mtime)),
+        }
+
+    if workers <= 1 or len(files) <= 1:
+        return [one(x) for x in files]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(one, files))
@@ -0,0 +1,31 @@
+# scripts/experiments_csv.py
+# Writing experiments.csv back after a step annotates its rows
+# (024_profile_throughput, 025_probe_batch, 03_train).
+#
+#   save_rows(EXPERIMENTS_CSV, rows)
+#
+# Column order is first-seen order over the rows; keys starting with "_" are
+# in-memory bookkeeping (row index, estimates) and are not written. The file
+# is written to a temp file and renamed, so an interrupted step never leaves
+# a truncated experiments.csv.
+
+from __future__ import annotations
+import csv
+from pathlib import Path
+from typing import Dict, Any, List
+
+def save_rows(path: Path, rows: List[Dict[str, Any]]):
+    """Rewrite experiments.csv atomically, keeping column order and dropping _private keys."""
+    path = Path(path)
+    fieldnames: List[str] = []
+    for r in rows:
+        for k in r:
+            if not k.startswith("_") and k not in fieldnames:
+                fieldnames.append(k)
+    tmp = path.with_suffix(".csv.tmp")
+    with tmp.open("w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=fieldnames)
+        w.writeheader()
+        for r in rows:
+            w.writerow({k: r.get(k, "") for k in fieldnames})
+    tmp.replace(path)
@@ -0,0 +1,200 @@
+# scripts/gen_cache.py
+# Persistent generation cache for the evaluation steps (snapshot, examination,
+# sanity). One SQLite file (run.gen_cache, in the data dir) maps
+#
+#   sha256(artifact digest, adapter digest, full prompt, decoding params, seed, max_tokens)
+#     → the gen_engine output dict (text, tokens, finish_reason, ...)
+#
+# Artifact/adapter digests are content digests of the weight files (via the
+# shared digest cache, so re-runs cost a stat() per file), not paths: a
+# re-fused or re-trained artifact misses, an unchanged one hits.
+#
+#   cache = open_gen_cache(DATA_DIR, CFG.run.gen_cache, DIGESTS)
+#   outs = cache.generate(load, prompts, max_tokens=64, model_path=..., adapter_path=...)
+#
+# `load` is only called when something misses, so a fully cached evaluation
+# never loads a model. Each finished batch is committed immediately; an
+# interrupted evaluation resumes from the first unfinished batch.
+# An empty run.gen_cache disables the cache (everything is generated).
+# With a serve_client (run.server set), misses are generated by serve_local
+# instead of in-process, and `load` is never called.
+
+from __future__ import annotations
+import json, time, hashlib, sqlite3
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Callable, Union
+
+from digest_cache import DigestCache, list_files
+from train_memory import resolve_model_dir
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    key TEXT PRIMARY KEY,
+    created_utc TEXT,
+    artifact TEXT,
+    adapter TEXT,
+    prompt TEXT,
+    params TEXT,
+    output TEXT
+);
+CREATE TABLE IF NOT EXISTS artifact_meta (
+    artifact TEXT PRIMARY KEY,
+    meta TEXT
+);
+"""
+ADAPTER_FILES = ("adapters.safetensors", "adapter_config.json")
+
+def dir_digest(root: Path, digests: DigestCache, names: Optional[tuple] = None) -> str:
+    """One digest over (relative path, file digest) of the files under `root`."""
+    recs = list_files(root, digests, workers=4, fast=True)
+    if names:
+        recs = [r for r in recs if r["rel"] in names] or recs
+    h = hashlib.sha256()
+    for r in sorted(recs, key=lambda r: r["rel"]):
+        h.update(f"{r['rel']}\0{r.get('xxh3_128') or r.get('sha256')}\n".encode("utf-8"))
+    return h.hexdigest()
+
+class GenCache:
+    def __init__(self, path: Optional[Path], digests: Optional[DigestCache] = None, client=None):
+        self.path = Path(path) if path else None
+        self.digests = digests or DigestCache(None)
+        self.client = client
+        self.hits = self.misses = 0
+        self._digest_memo: Dict[str, str] = {}
+        self.db = None
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(self.path))
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.executescript(SCHEMA)
+
+    # ---- identities ----
+    def artifact_digest(self, path: Optional[str], adapter: bool = False) -> str:
+        if not path or self.db is None:
+            return ""
+        if path not in self._digest_memo:
+            p = Path(path)
+            root = p if p.is_dir() else resolve_model_dir(path)
+            self._digest_memo[path] = (dir_digest(root, self.digests, ADAPTER_FILES if adapter else None)
+                                       if root else f"id:{path}")
+        return self._digest_memo[path]
+
+    def key(self, artifact: str, adapter: str, prompt: str, params: Dict[str, Any]) -> str:
+        blob = json.dumps({"artifact": artifact, "adapter": adapter, "prompt": prompt, "params": params},
+                          sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    # ---- storage ----
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.db is None:
+            return None
+        row = self.db.execute("SELECT output FROM generations WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_many(self, items: List[tuple]):
+        """items: (key, artifact, adapter, prompt, params, output); one transaction."""
+        if self.db is None or not items:
+            return
+        stamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(k, stamp, a, ad, p, json.dumps(pa, sort_keys=True), json.dumps(o, ensure_ascii=False))
+                 for k, a, ad, p, pa, o in items])
+
+    def get_meta(self, artifact: str) -> Optional[Dict[str, Any]]:
+        if self.db is None:
+            return None
+        row = self.db.execute("SELECT meta FROM artifact_meta WHERE artifact = ?", (artifact,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_meta(self, artifact: str, meta: Dict[str, Any]):
+        if self.db is None:
+            return
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO artifact_meta VALUES (?, ?)", (artifact, json.dumps(meta)))
+
+    def tokenizer_meta(self, load: Callable[[], tuple], model_path: str, adapter_path: Optional[str] = None) -> Dict[str, Any]:
+        """eos/pad token info for an artifact, cached alongside its generations."""
+        art = f"{self.artifact_digest(model_path)}:{self.artifact_digest(adapter_path, adapter=True)}"
+        meta = self.get_meta(art)
+        if meta is None and self.client is not None:
+            meta = self.client.tokenizer_meta(model_path, adapter_path)
+            self.put_meta(art, meta)
+        elif meta is None:
+            _, tok = load()
+            meta = {k: getattr(tok, k, None) for k in ("eos_token", "eos_token_id", "pad_token", "pad_token_id")}
+            self.put_meta(art, meta)
+        return meta
+
+    # ---- cached generation ----
+    def generate(self, load: Callable[[], tuple], prompts: List[str], max_tokens: Union[int, List[int]],
+                 model_path: str, adapter_path: Optional[str] = None, seed: Optional[int] = None,
+                 draft_path: Optional[str] = None, load_draft: Optional[Callable[[], Any]] = None,
+                 **gen_kwargs) -> List[Dict[str, Any]]:
+        """
+        gen_engine.generate_batch with lookups first. `gen_kwargs` (stop_strings,
+        ignore_eos, temp, batch_size, prefix_cache, num_draft, verify, token_stats) are passed
+        through; everything that can change the text is part of the key. With
+        `load_draft`, misses are decoded speculatively; greedy speculative output
+        is the target's own, so the draft only enters the key when sampling.
+        """
+        from gen_engine import generate_batch
+        n = len(prompts)
+        budgets = list(max_tokens) if isinstance(max_tokens, (list, tuple)) else [int(max_tokens)] * n
+        run = None
+        if self.client is not None:   # serve_local decodes; batching and draft options are its own
+            run = lambda ps, bs: self.client.generate(model_path, adapter_path, ps, bs, **gen_kwargs)
+        if self.db is None:
+            self.misses += n
+            if run is not None:
+                return run(prompts, budgets)
+            model, tok = load()
+            if load_draft is not None:
+                gen_kwargs["draft_model"] = load_draft()
+            return generate_batch(model, tok, prompts, max_tokens=budgets, **gen_kwargs)
+        art = self.artifact_digest(model_path)
+        ada = self.artifact_digest(adapter_path, adapter=True)
+        shared = {"stop_strings": list(gen_kwargs.get("stop_strings") or []),
+                  "ignore_eos": bool(gen_kwargs.get("ignore_eos", False)),
+                  "temp": float(gen_kwargs.get("temp", 0.0)), "seed": seed,
+                  "checkpoints": sorted(int(n) for n in gen_kwargs.get("checkpoints") or [])}
+        if gen_kwargs.get("token_stats"):
+            shared["token_stats"] = int(gen_kwargs["token_stats"])
+        if load_draft is not None and self.client is None and shared["temp"] > 0:
+            shared["draft"] = self.artifact_digest(draft_path)
+        params = [{**shared, "max_tokens": b} for b in budgets]
+        keys = [self.key(art, ada, p, pa) for p, pa in zip(prompts, params)]
+
+        results: List[Optional[Dict[str, Any]]] = [self.get(k) for k in keys]
+        todo = [i for i, r in enumerate(results) if r is None]
+        self.hits += n - len(todo)
+        self.misses += len(todo)
+        if not todo:
+            return results  # type: ignore[return-value]
+
+        if run is None:
+            model, tok = load()
+            if load_draft is not None:
+                gen_kwargs["draft_model"] = load_draft()
+            run = lambda ps, bs: generate_batch(model, tok, ps, max_tokens=bs, **gen_kwargs)
+        todo.sort(key=lambda i: (prompts[i][:128], len(prompts[i])))   # keep shared prefixes / lengths together
+        size = max(1, int(gen_kwargs.get("batch_size", 8)))
+        # generate and commit one batch at a time so an interruption loses at most one batch
+        for k in range(0, len(todo), size):
+            idx = todo[k:k + size]
+            outs = run([prompts[i] for i in idx], [budgets[i] for i in idx])
+            for i, o in zip(idx, outs):
+                results[i] = o
+            self.put_many([(keys[i], art, ada, prompts[i], params[i], results[i]) for i in idx])
+        return results  # type: ignore[return-value]
+
+    def report(self):
+        total = self.hits + self.misses
+        print(f"[gen_cache] {self.hits}/{total} generations reused"
+              f"{' from ' + str(self.path) if self.path else ' (cache off)'}")
+
+def open_gen_cache(data_dir: Path, name: Optional[str], digests: Optional[DigestCache] = None,
+                   client=None) -> GenCache:
+    """Cache file `name` in `data_dir`; an empty name gives a pass-through cache."""
+    return GenCache(Path(data_dir) / name if name else None, digests, client)
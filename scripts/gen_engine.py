@@ -0,0 +1,369 @@
+# scripts/gen_engine.py
+# Batched generation for mlx_lm models.
+#
+#   outs = generate_batch(model, tok, prompts, max_tokens=128, stop_strings=[...])
+#
+# Prompts are tokenized like mlx_lm.generate, sorted by length, and run in
+# batches of `batch_size`: each batch is left-padded into one [B, L] prefill
+# through a shared KV cache, with a boolean attention mask hiding the pads
+# (RoPE is relative, so left padding does not change the real tokens'
+# attention). Decoding then proceeds one token per step for the whole batch;
+# every sequence retires on its own EOS / stop string / token budget, and the
+# batch is compacted once most of it has retired.
+#
+# Each output is a dict:
+#   text           decoded continuation (no prompt, no EOS, cut at a stop string)
+#   text_eos       the same continuation cut at the first EOS
+#   tokens         generated token ids
+#   prompt_tokens  prompt length
+#   finish_reason  "eos" | "stop" | "length"
+#   eos_index      index in `tokens` of the first EOS, or None
+#   checkpoints    {"n": text} for each requested checkpoint n: the text the
+#                  same call would have returned with max_tokens=n (greedy
+#                  decoding makes a shorter budget a prefix of a longer one)
+# With ignore_eos=True decoding runs through EOS (EOS ids stay in `tokens`,
+# not in `text`), so one stream yields both the EOS-terminated output
+# (text_eos) and the full-budget one (text).
+# Greedy by default (temp=0), matching mlx_lm.generate's defaults.
+#
+# With a prefix_cache (prefix_cache.py), prompts are grouped by their first
+# min_tokens tokens; within a group the shared token prefix comes from the
+# cache (each row's pad slots + the part of the prefix that fits in front of
+# the batch's common length) and only the remaining tokens are prefilled.
+#
+# With a draft_model, each prompt instead goes through mlx_lm's speculative
+# loop (speculative_generate_step): the draft proposes num_draft tokens, the
+# target scores them in one forward pass and keeps the agreeing prefix plus
+# its own next token. Greedy output is the target's own greedy output; the
+# draft only changes speed. Speculative rows are decoded one at a time (no
+# batching, no prefix cache) and carry
+#   spec           {num_draft, accepted, rounds, tokens, seconds}
+# and with verify=True also a non-speculative decode of the same prompt:
+#   spec.matches_baseline, spec.baseline_seconds
+# spec_summary() turns these into acceptance rate and tokens/sec.
+# `python scripts/gen_engine.py --selftest` checks verify=True on serve_local's
+# stub llama, with the target itself and a differently seeded copy as drafts.
+#
+# With token_stats=k > 0, each output also has
+#   token_stats    {"entropy": [...], "varentropy": [...], "topk_mass": [...],
+#                   "rank": [...], "logprob": [...], "token_text": [...]}, one entry
+#                  per token in `tokens`
+# computed on-device for the whole batch each step (token_stats.py, top-k mass
+# over k tokens).
+#
+# Stop strings are matched while decoding (stop_matcher.py): each row has a
+# streaming detokenizer feeding an Aho-Corasick matcher, and stop strings that
+# are single tokens stop the row by id; a row retires the step its stop
+# sequence completes.
+
+from __future__ import annotations
+import argparse, copy, sys, time
+from itertools import groupby
+from typing import Dict, Any, List, Optional, Sequence, Union
+
+import mlx.core as mx
+from mlx_lm.models.cache import make_prompt_cache, KVCache
+from mlx_lm.sample_utils import make_sampler
+from mlx_lm.generate import speculative_generate_step
+
+from prefix_cache import supports as prefix_supported, common_prefix
+from stop_matcher import StopMatcher, stop_token_ids
+from token_stats import FIELDS as STAT_FIELDS, step_stats, to_host
+
+Prompt = Union[str, Sequence[int]]
+
+def encode(tok, prompt: Prompt) -> List[int]:
+    if isinstance(prompt, str):
+        add_special = tok.bos_token is None or not prompt.startswith(tok.bos_token)
+        return list(tok.encode(prompt, add_special_tokens=add_special))
+    return list(prompt)
+
+def eos_ids(tok) -> set:
+    ids = set(getattr(tok, "eos_token_ids", None) or [])
+    if getattr(tok, "eos_token_id", None) is not None:
+        ids.add(tok.eos_token_id)
+    return ids
+
+def cut_at_stop(text: str, stops: Sequence[str]) -> Optional[int]:
+    hits = [i for i in (text.find(s) for s in stops if s) if i != -1]
+    return min(hits) if hits else None
+
+def detokenizer(tok):
+    """A fresh streaming detokenizer (TokenizerWrapper shares one instance)."""
+    d = copy.copy(tok.detokenizer)
+    d.reset()
+    return d
+
+class RowState:
+    """Per-sequence decode state: EOS / stop / budget / checkpoint bookkeeping."""
+    def __init__(self, tok, prompt_len: int, budget: int, stops: Sequence[str], stop_ids: set, eos: set,
+                 ignore_eos: bool, cps: set, stream: bool = False, stats: bool = False):
+        self.tok, self.budget, self.stops, self.eos, self.ignore_eos, self.cps = tok, budget, stops, eos, ignore_eos, cps
+        self.matcher = StopMatcher(stops, stop_ids)
+        self.detok = detokenizer(tok) if stops or stream else None
+        self.done = False
+        self.sent = 0
+        self.out = {"text": "", "tokens": [], "prompt_tokens": prompt_len, "finish_reason": "length",
+                    "eos_index": None, "checkpoints": {}}
+        if stats:
+            self.out["token_stats"] = {**{k: [] for k in STAT_FIELDS}, "token_text": []}
+
+    def _stop(self, text: str):
+        self.out["text"] = text
+        self.out["finish_reason"] = "stop"
+        self.done = True
+
+    def push(self, t: int, stat: Optional[Dict[str, float]] = None) -> bool:
+        """Take one generated token (and its token_stats); True once the sequence is finished."""
+        o, eos = self.out, self.eos
+        if t in eos and o["eos_index"] is None:
+            o["eos_index"] = len(o["tokens"])
+        if t in eos and not self.ignore_eos:
+            o["finish_reason"] = "eos"
+            self.done = True
+            return True
+        o["tokens"].append(t)
+        if stat is not None and "token_stats" in o:
+            for k in STAT_FIELDS:
+                o["token_stats"][k].append(stat[k])
+            o["token_stats"]["token_text"].append(self.tok.decode([t]))
+        if self.matcher.is_stop_token(t):
+            self._stop(self.tok.decode([x for x in o["tokens"][:-1] if x not in eos]))
+            return True
+        if self.detok is not None and t not in eos:
+            self.detok.add_token(t)
+            seg = self.detok.last_segment
+            o["text"] += seg
+            cut = self.matcher.feed(seg)
+            if cut is not None:
+                self._stop(o["text"][:cut])
+                return True
+        n = len(o["tokens"])
+        if n in self.cps and n < self.budget:
+            o["checkpoints"][str(n)] = self.tok.decode([x for x in o["tokens"] if x not in eos])
+        if n >= self.budget:
+            self.done = True
+        return self.done
+
+    def delta(self) -> str:
+        """Text not handed out yet; while running, holds back what a stop string could still cut."""
+        text = self.out["text"]
+        end = len(text) if self.done else max(self.sent, len(text) - max(self.matcher.window - 1, 0))
+        piece, self.sent = text[self.sent:end], end
+        return piece
+
+    def finish(self) -> Dict[str, Any]:
+        o, tok, eos = self.out, self.tok, self.eos
+        if o["finish_reason"] != "stop":
+            o["text"] = tok.decode([t for t in o["tokens"] if t not in eos])
+        if o["eos_index"] is None:
+            o["text_eos"] = o["text"]
+        else:
+            o["text_eos"] = tok.decode(o["tokens"][:o["eos_index"]])
+            stop_at = cut_at_stop(o["text_eos"], self.stops)
+            if stop_at is not None:
+                o["text_eos"] = o["text_eos"][:stop_at]
+        for n in self.cps:
+            if n < self.budget:   # the sequence ended before reaching the checkpoint
+                o["checkpoints"].setdefault(str(n), o["text"])
+        return o
+
+def _compactable(cache) -> bool:
+    return all(type(c) is KVCache for c in cache)
+
+def pad_id(tok) -> int:
+    eos = eos_ids(tok)
+    return tok.pad_token_id if getattr(tok, "pad_token_id", None) is not None else (min(eos) if eos else 0)
+
+def prefill_padded(model, seqs: List[List[int]], pad: int, width: int = 0):
+    """
+    Left-pad `seqs` to `width` (default: the longest) and prefill them as one
+    batch into a fresh prompt cache. Returns (cache, last logits, valid mask).
+    With nothing to pad the model builds its own causal mask, which is the
+    only one a rotating (sliding-window) cache lines up with.
+    """
+    L = max(width, max(len(s) for s in seqs))
+    pads = [L - len(s) for s in seqs]
+    valid = mx.array([[False] * p + [True] * len(s) for s, p in zip(seqs, pads)])
+    tokens = mx.array([[pad] * p + s for s, p in zip(seqs, pads)])
+    # causal ∧ real key; the diagonal keeps pad queries from having no key at all
+    causal = mx.tril(mx.ones((L, L), dtype=mx.bool_))
+    mask = (causal[None] & valid[:, None, :]) | mx.eye(L, dtype=mx.bool_)[None]
+    cache = make_prompt_cache(model)
+    logits = model(tokens, mask=mask[:, None] if any(pads) else None, cache=cache)[:, -1, :]
+    return cache, logits, valid
+
+def _run_batch(model, tok, seqs: List[List[int]], budgets: List[int], stops: Sequence[str], stop_ids: set,
+               ignore_eos: bool, sampler, prefix_cache=None, prefix_len: int = 0,
+               checkpoints: Sequence[int] = (), stats_top_k: int = 0) -> List[Dict[str, Any]]:
+    B, L = len(seqs), max(len(s) for s in seqs)
+    eos = eos_ids(tok)
+    pad = pad_id(tok)
+    pads = [L - len(s) for s in seqs]
+
+    # cached span = the first P positions of every row: its pads, then prefix
+    # tokens; at least one prefix token per row and one prompt token left over
+    P = min(prefix_len, L - 1) if prefix_cache is not None else 0
+    if P and P - max(pads) >= 1:
+        valid = mx.array([[False] * p + [True] * len(s) for s, p in zip(seqs, pads)])
+        cache = prefix_cache.fork(model, [s[:P - p] for s, p in zip(seqs, pads)], pad)
+        block = mx.array([s[P - p:] for s, p in zip(seqs, pads)])
+        causal = mx.tril(mx.ones((L - P, L), dtype=mx.bool_), k=P)
+        mask = causal[None] & valid[:, None, :]
+        logits = model(block, mask=mask[:, None], cache=cache)[:, -1, :]
+    else:
+        cache, logits, valid = prefill_padded(model, seqs, pad)
+
+    cps = set(int(n) for n in checkpoints)
+    streams = [RowState(tok, len(s), b, stops, stop_ids, eos, ignore_eos, cps, stats=stats_top_k > 0)
+               for s, b in zip(seqs, budgets)]
+    rows = list(range(B))          # batch position → stream index
+    while True:
+        logprobs = logits - mx.logsumexp(logits, axis=-1, keepdims=True)
+        y = sampler(logprobs)
+        st = to_host(step_stats(logprobs, y, stats_top_k)) if stats_top_k else None
+        for i, (r, t) in enumerate(zip(rows, y.tolist())):
+            if not streams[r].done:    # retired rows ride along until the next compaction
+                streams[r].push(t, {k: v[i] for k, v in st.items()} if st else None)
+        alive = [i for i, r in enumerate(rows) if not streams[r].done]
+        if not alive:
+            break
+        if len(alive) <= len(rows) // 2 and _compactable(cache):
+            idx = mx.array(alive)
+            for c in cache:
+                c.keys, c.values = c.keys[idx], c.values[idx]
+            valid, y = valid[idx], y[idx]
+            rows = [rows[i] for i in alive]
+        mask = None   # no pads: the model's own mask, which is window-aware for rotating caches
+        if any(pads):
+            valid = mx.concatenate([valid, mx.ones((valid.shape[0], 1), dtype=mx.bool_)], axis=1)
+            mask = valid[:, None, None, :]
+        logits = model(y[:, None], mask=mask, cache=cache)[:, -1, :]
+    return [st.finish() for st in streams]
+
+def _run_speculative(model, draft_model, tok, seq: List[int], budget: int, stops: Sequence[str], stop_ids: set,
+                     ignore_eos: bool, sampler, num_draft: int, checkpoints: Sequence[int] = (),
+                     stats_top_k: int = 0) -> Dict[str, Any]:
+    """One sequence through mlx_lm's draft-and-verify loop, with the same bookkeeping as a batch row."""
+    st = RowState(tok, len(seq), budget, stops, stop_ids, eos_ids(tok), ignore_eos, set(int(n) for n in checkpoints),
+                  stats=stats_top_k > 0)
+    accepted = rounds = 0
+    t0 = time.perf_counter()
+    steps = speculative_generate_step(mx.array(seq), model, draft_model, num_draft_tokens=num_draft,
+                                      max_tokens=budget, sampler=sampler)
+    for t, lp, from_draft in steps:
+        accepted += int(bool(from_draft))
+        rounds += int(not from_draft)   # each verify pass ends with one target-sampled token
+        stat = None
+        if stats_top_k:
+            stat = {k: v[0] for k, v in to_host(step_stats(lp[None], mx.array([int(t)]), stats_top_k)).items()}
+        if st.push(int(t), stat):
+            break
+    steps.close()
+    o = st.finish()
+    o["spec"] = {"num_draft": num_draft, "accepted": accepted, "rounds": rounds,
+                 "tokens": len(o["tokens"]), "seconds": round(time.perf_counter() - t0, 4)}
+    return o
+
+def draft_path(spec: str, run_entry: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    Draft model for a step's `draft_model` setting: "" = off, "quantized" = the
+    run's quantized artifact (artifacts.json), anything else a path / hub id.
+    """
+    spec = (spec or "").strip()
+    if not spec:
+        return None
+    if spec == "quantized":
+        return (run_entry or {}).get("quantized_dir") or None
+    return spec
+
+def spec_summary(outs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Acceptance rate and effective tokens/sec over speculative outputs."""
+    sp = [o["spec"] for o in outs if o and o.get("spec")]
+    if not sp:
+        return {}
+    accepted = sum(x["accepted"] for x in sp)
+    proposed = sum(x["rounds"] * x["num_draft"] for x in sp)
+    tokens, secs = sum(x["tokens"] for x in sp), sum(x["seconds"] for x in sp)
+    out = {"sequences": len(sp), "tokens": tokens, "seconds": round(secs, 3),
+           "acceptance_rate": round(accepted / proposed, 4) if proposed else 0.0,
+           "tokens_per_sec": round(tokens / secs, 1) if secs else 0.0}
+    checked = [x for x in sp if "matches_baseline" in x]
+    if checked:
+        base_secs = sum(x["baseline_seconds"] for x in checked)
+        out["verified"] = len(checked)
+        out["mismatches"] = sum(not x["matches_baseline"] for x in checked)
+        out["baseline_tokens_per_sec"] = round(sum(x["tokens"] for x in checked) / base_secs, 1) if base_secs else 0.0
+    return out
+
+def generate_batch(model, tok, prompts: List[Prompt], max_tokens: Union[int, List[int]] = 128,
+                   stop_strings: Sequence[str] = (), ignore_eos: bool = False,
+                   batch_size: int = 8, temp: float = 0.0, prefix_cache=None,
+                   checkpoints: Sequence[int] = (), draft_model=None, num_draft: int = 3,
+                   verify: bool = False, token_stats: int = 0) -> List[Dict[str, Any]]:
+    """Generate continuations for all `prompts`; results are in input order."""
+    n = len(prompts)
+    budgets = list(max_tokens) if isinstance(max_tokens, (list, tuple)) else [int(max_tokens)] * n
+    enc = [encode(tok, p) for p in prompts]
+    sampler = make_sampler(temp=temp)
+    stop_ids = stop_token_ids(tok, stop_strings)
+    if ignore_eos:
+        stop_ids -= eos_ids(tok)   # running through EOS is the point
+    if draft_model is not None:
+        results = []
+        for ids, b in zip(enc, budgets):
+            o = _run_speculative(model, draft_model, tok, ids, b, list(stop_strings), stop_ids, ignore_eos,
+                                 sampler, num_draft, checkpoints, token_stats)
+            if verify:
+                t0 = time.perf_counter()
+                ref = _run_batch(model, tok, [ids], [b], list(stop_strings), stop_ids, ignore_eos, sampler,
+                                 checkpoints=checkpoints)[0]
+                o["spec"]["baseline_seconds"] = round(time.perf_counter() - t0, 4)
+                o["spec"]["matches_baseline"] = ref["tokens"] == o["tokens"] and ref["text"] == o["text"]
+            results.append(o)
+        return results
+    plain = prefix_supported(model)
+    if prefix_cache is not None and not (prefix_cache.enabled and plain):
+        prefix_cache = None
+    m = prefix_cache.min_tokens if prefix_cache is not None else 0
+    # same leading tokens together, then similar lengths → little padding
+    order = sorted(range(n), key=lambda i: (enc[i][:m], len(enc[i])))
+    results: List[Optional[Dict[str, Any]]] = [None] * n
+    # the pad mask grows a column per step, which a rotating / quantized cache
+    # does not: those models decode one unpadded row at a time
+    size = max(1, batch_size) if plain else 1
+    for _, grp in groupby(order, key=lambda i: tuple(enc[i][:m])):
+        grp = list(grp)
+        P = common_prefix([enc[i] for i in grp]) if m else 0
+        for k in range(0, len(grp), size):
+            chunk = grp[k:k + size]
+            outs = _run_batch(model, tok, [enc[i] for i in chunk], [budgets[i] for i in chunk],
+                              list(stop_strings), stop_ids, ignore_eos, sampler,
+                              prefix_cache if P >= m else None, P, checkpoints, token_stats)
+            for i, o in zip(chunk, outs):
+                results[i] = o
+    return results  # type: ignore[return-value]
+
+def selftest():
+    """Speculative decoding with verify=True on serve_local's stub llama: every row must match the plain decode."""
+    from serve_local import stub_backend
+    model, tok = stub_backend()
+    prompts = ["tide", "stone and river", "the moon does not race", "patience is", "a long " * 6]
+    budgets = [5, 17, 9, 30, 12]
+    bad = []
+    for name, draft in (("same", model), ("perturbed", stub_backend(seed=1)[0])):
+        outs = generate_batch(model, tok, prompts, budgets, draft_model=draft, num_draft=3, verify=True)
+        s = spec_summary(outs)
+        print(f"[gen_engine] selftest {name} draft: {s['verified'] - s['mismatches']}/{s['verified']} match the "
+              f"plain decode; acceptance {s['acceptance_rate']}")
+        bad += [(name, i) for i, o in enumerate(outs) if not o["spec"]["matches_baseline"]]
+    if bad:
+        raise SystemExit(f"selftest mismatches: {bad}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Batched / speculative generation engine.")
+    ap.add_argument("--selftest", action="store_true", help="check speculative verify on a tiny random model")
+    a, _ = ap.parse_known_args()   # --config / --set belong to config_loader (via serve_local)
+    if not a.selftest:
+        ap.print_help(); sys.exit(0)
+    selftest()
@@ -0,0 +1,110 @@
+# scripts/model_pool.py
+# In-process pool of loaded mlx_lm models shared by the generation steps.
+#
+#   model, tok = get_pool().get(model_path, adapter_path)
+#
+# Entries are keyed on (model_path, adapter_path, quantization) and evicted
+# least-recently-used once the resident weights exceed the pool budget
+# (run.model_pool_gb; 0 = half of system RAM). The most recently requested
+# model is never evicted, so a single oversized model still loads. Room is
+# made before loading, from the on-disk weight size.
+# report() prints load counts and load times per entry.
+
+from __future__ import annotations
+import gc, json, time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+from train_memory import resolve_model_dir, model_shape, system_memory_gb, GB
+
+def quantization_of(model_path: str) -> str:
+    """'q4g64'-style tag from the model's config.json, '' for unquantized/unknown."""
+    mdir = resolve_model_dir(model_path)
+    try:
+        cfg = json.loads((mdir / "config.json").read_text(encoding="utf-8"))
+    except Exception:
+        return ""
+    q = cfg.get("quantization") or cfg.get("quantization_config") or {}
+    return f"q{q.get('bits')}g{q.get('group_size')}" if q else ""
+
+def weight_bytes(model) -> int:
+    from mlx.utils import tree_flatten
+    return sum(v.nbytes for _, v in tree_flatten(model.parameters()))
+
+class ModelPool:
+    def __init__(self, budget_gb: float = 0):
+        self.budget_bytes = int((float(budget_gb) or system_memory_gb() * 0.5) * GB)
+        self.entries: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self.stats: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+
+    def key(self, model_path: str, adapter_path: Optional[str]) -> Tuple[str, str, str]:
+        return (str(model_path), str(adapter_path or ""), quantization_of(str(model_path)))
+
+    def get(self, model_path: str, adapter_path: Optional[str] = None):
+        """(model, tokenizer) for this artifact, loading it on a miss."""
+        k = self.key(model_path, adapter_path)
+        st = self.stats.setdefault(k, {"loads": 0, "hits": 0, "load_seconds": 0.0, "evictions": 0})
+        if k in self.entries:
+            self.entries.move_to_end(k)
+            st["hits"] += 1
+            e = self.entries[k]
+            return e["model"], e["tok"]
+
+        from mlx_lm import load as mlx_load
+        import mlx.core as mx
+        # make room first so the new weights never sit on top of a full pool
+        self._evict(incoming=model_shape(str(model_path))["weight_bytes"], keep_newest=False)
+        t0 = time.perf_counter()
+        model, tok = mlx_load(str(model_path), adapter_path=str(adapter_path) if adapter_path else None)
+        mx.eval(model.parameters())
+        dt = time.perf_counter() - t0
+        st["loads"] += 1
+        st["load_seconds"] += dt
+        self.entries[k] = {"model": model, "tok": tok, "bytes": weight_bytes(model)}
+        print(f"[model_pool] loaded {model_path}{' + ' + str(adapter_path) if adapter_path else ''} "
+              f"in {dt:.1f}s ({self.entries[k]['bytes'] / GB:.2f} GB)")
+        self._evict()
+        return model, tok
+
+    def resident_bytes(self) -> int:
+        return sum(e["bytes"] for e in self.entries.values())
+
+    def _evict(self, incoming: int = 0, keep_newest: bool = True):
+        while len(self.entries) > int(keep_newest) and self.resident_bytes() + incoming > self.budget_bytes:
+            k, _ = self.entries.popitem(last=False)
+            self.stats[k]["evictions"] += 1
+            print(f"[model_pool] evicted {k[0]}{' + ' + k[1] if k[1] else ''}")
+        gc.collect()
+        try:
+            import mlx.core as mx
+            mx.clear_cache()
+        except Exception:
+            pass
+
+    def clear(self):
+        self.entries.clear()
+        self._evict()
+
+    def report(self) -> Dict[str, Any]:
+        rows = [{"model_path": k[0], "adapter_path": k[1], "quantization": k[2], **v}
+                for k, v in self.stats.items()]
+        loads = sum(r["loads"] for r in rows)
+        hits = sum(r["hits"] for r in rows)
+        secs = sum(r["load_seconds"] for r in rows)
+        print(f"[model_pool] {loads} loads ({secs:.1f}s), {hits} reuses, "
+              f"{len(self.entries)} resident ({self.resident_bytes() / GB:.2f} GB)")
+        for r in rows:
+            print(f"  - {r['model_path']}{' + ' + r['adapter_path'] if r['adapter_path'] else ''}"
+                  f"{' [' + r['quantization'] + ']' if r['quantization'] else ''}: "
+                  f"loads={r['loads']} hits={r['hits']} load_s={r['load_seconds']:.1f} evictions={r['evictions']}")
+        return {"loads": loads, "hits": hits, "load_seconds": round(secs, 2), "entries": rows}
+
+_POOL: Optional[ModelPool] = None
+
+def get_pool(budget_gb: float = 0) -> ModelPool:
+    """Process-wide pool (the budget is taken from the first call)."""
+    global _POOL
+    if _POOL is None:
+        _POOL = ModelPool(budget_gb)
+    return _POOL
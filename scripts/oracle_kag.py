@@ -42,12 +42,14 @@ import yaml
 import time
 from pathlib import Path
 from collections import Counter
-from mlx_lm import load, generate
+from mlx_lm import load
 
 # ---------------------------
 # CONFIG LOADER
 # ---------------------------
 from config_loader import load_config
+from gen_engine import generate_batch
+from prefix_cache import get_prefix_cache
 
 # --- SETUP ---
 start = time.time()
@@ -139,11 +141,13 @@ def parse_markdown(md_path, outdir="stories_out"):
 # ---------------------------
 # ORACLE LLM QUERY
 # ---------------------------
-def query_llm_inprocess(model, tokenizer, story_text, prompt_template, num_tags=10, max_tokens=200):
-    prompt = prompt_template.format(num_tags=num_tags) + "\n\nStory:\n" + story_text[:3000]
-    response = generate(model=model, tokenizer=tokenizer, prompt=prompt, max_tokens=max_tokens)
-    tags = [t.strip(" -•#") for t in response.splitlines() if t.strip()]
-    return tags[:num_tags]
+def query_llm_inprocess(model, tokenizer, story_texts, prompt_template, num_tags=10, max_tokens=200, batch_size=8):
+    """Tag lists for a batch of stories (one generation batch for all of them)."""
+    head = prompt_template.format(num_tags=num_tags) + "\n\nStory:\n"
+    outs = generate_batch(model, tokenizer, [head + t[:3000] for t in story_texts],
+                          max_tokens=max_tokens, batch_size=batch_size,
+                          prefix_cache=get_prefix_cache(CFG.run.prefix_cache_mb, CFG.run.prefix_min_tokens))
+    return [[t.strip(" -•#") for t in o["text"].splitlines() if t.strip()][:num_tags] for o in outs]
 
 # ---------------------------
 # HASHTAG NORMALIZATION + REINFORCEMENT
@@ -202,24 +206,24 @@ def main():
     start = time.time()
 
     print(f"=== Oracle KAG starting ===")
-    print(f"Model: {model_name}")
-    print(f"Input: {input_md}")
+    print(f"Model: {MODEL_ID}")
+    print(f"Input: {INPUT_MD}")
 
-    model, tokenizer = load(model_name)
+    model, tokenizer = load(MODEL_ID)
 
-    stories = parse_markdown(input_md, outdir="stories_out")
+    stories = parse_markdown(INPUT_MD, outdir="stories_out")
     all_story_tags = []
 
-    for title, text in stories.items():
-        emotional_tags = query_llm_inprocess(
-            model,
-            tokenizer,
-            text,
-            emotional_prompt,
-            num_tags=num_tags,
-            max_tokens=max_tokens
-        )
-
+    story_tags = query_llm_inprocess(
+        model,
+        tokenizer,
+        list(stories.values()),
+        PROMPT,
+        num_tags=NUM_TAGS,
+        max_tokens=MAX_TOKENS,
+        batch_size=int(getattr(PARAMS, "batch_size", 8)),
+    )
+    for title, emotional_tags in zip(stories.keys(), story_tags):
         cleaned = sorted(
             set(filter(None, (normalize_tag(t) for t in emotional_tags)))
         )
@@ -230,8 +234,8 @@ def main():
     # Reinforce across corpus
     reinforced = reinforce_hashtags(
         all_story_tags,
-        top_n=int(reinforce_cfg["top_n"]),
-        min_global=int(reinforce_cfg["min_global"])
+        top_n=TOP_N,
+        min_global=MIN_GLOBAL
     )
 
     for title, tags in zip(stories.keys(), reinforced):
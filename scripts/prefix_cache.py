@@ -0,0 +1,157 @@
+# scripts/prefix_cache.py
+# Shared-prefix KV cache: prefilled KV state for prompt prefixes that many
+# prompts repeat (few-shot blocks, persona preambles), reused instead of
+# re-prefilled.
+#
+#   pc = get_prefix_cache(budget_mb)
+#   cache = pc.fork(model, [prefix_ids])          # one row, ready for the suffix
+#
+# Entries are keyed on (model, sha256 of the prefix token ids, start offset):
+# the start offset is the number of masked left-pad slots in front of the
+# prefix, so rows of a left-padded batch get KV computed at their own
+# positions and the result is exact. fork() copies entries into fresh
+# KVCache objects (one batch row per prefix), so continuations never write
+# into a cached entry. Entries are evicted least-recently-used past the memory
+# budget, and dropped when their model is garbage-collected.
+#
+# Only models whose prompt cache is plain KVCache layers are supported
+# (supports()); rotating / quantized caches are prefilled as usual.
+# report() prints hit rate, tokens reused and the prefill time saved.
+
+from __future__ import annotations
+import time, hashlib, weakref
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+import mlx.core as mx
+from mlx_lm.models.cache import make_prompt_cache, KVCache
+
+MB = 1024 ** 2
+
+def prefix_hash(ids: List[int]) -> str:
+    return hashlib.sha256(b"".join(int(t).to_bytes(4, "little") for t in ids)).hexdigest()
+
+def supports(model) -> bool:
+    return all(type(c) is KVCache for c in make_prompt_cache(model))
+
+def common_prefix(seqs: List[List[int]]) -> int:
+    """Length of the longest token prefix shared by all `seqs`."""
+    if not seqs:
+        return 0
+    n = min(len(s) for s in seqs)
+    first = seqs[0]
+    for i in range(n):
+        t = first[i]
+        if any(s[i] != t for s in seqs):
+            return i
+    return n
+
+class PrefixCache:
+    def __init__(self, budget_mb: float = 512, min_tokens: int = 32):
+        self.budget_bytes = int(float(budget_mb) * MB)
+        self.min_tokens = int(min_tokens)
+        self.entries: "OrderedDict[Tuple[int, str, int], Dict[str, Any]]" = OrderedDict()
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "evictions": 0,
+                      "tokens_reused": 0, "prefill_seconds": 0.0, "prefill_seconds_saved": 0.0}
+        self._models: Dict[int, Any] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_bytes > 0
+
+    def _watch(self, model):
+        mid = id(model)
+        if mid not in self._models:
+            self._models[mid] = weakref.finalize(model, self._drop_model, mid)
+
+    def _drop_model(self, mid: int):
+        for k in [k for k in self.entries if k[0] == mid]:
+            del self.entries[k]
+        self._models.pop(mid, None)
+
+    def _prefill(self, model, ids: List[int], start: int, pad: int) -> List[Tuple[mx.array, mx.array]]:
+        L = start + len(ids)
+        tokens = mx.array([[pad] * start + list(ids)])
+        mask = None
+        if start:
+            valid = mx.array([[False] * start + [True] * len(ids)])
+            causal = mx.tril(mx.ones((L, L), dtype=mx.bool_))
+            mask = ((causal[None] & valid[:, None, :]) | mx.eye(L, dtype=mx.bool_)[None])[:, None]
+        cache = make_prompt_cache(model)
+        model(tokens, mask=mask, cache=cache)
+        kv = [(k[..., start:, :], v[..., start:, :]) for k, v in (c.state for c in cache)]
+        mx.eval(kv)
+        return kv
+
+    def get(self, model, ids: List[int], start: int = 0, pad: int = 0) -> List[Tuple[mx.array, mx.array]]:
+        """Per-layer (keys, values) of `ids` prefilled at positions start..start+len-1."""
+        key = (id(model), prefix_hash(ids), int(start))
+        self.stats["lookups"] += 1
+        e = self.entries.get(key)
+        if e is not None:
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            self.stats["tokens_reused"] += len(ids)
+            self.stats["prefill_seconds_saved"] += e["seconds"]
+            return e["kv"]
+        self.stats["misses"] += 1
+        t0 = time.perf_counter()
+        kv = self._prefill(model, ids, start, pad)
+        dt = time.perf_counter() - t0
+        self.stats["prefill_seconds"] += dt
+        if self.enabled:
+            self._watch(model)
+            self.entries[key] = {"kv": kv, "seconds": dt, "tokens": len(ids),
+                                 "bytes": sum(k.nbytes + v.nbytes for k, v in kv)}
+            self._evict()
+        return kv
+
+    def fork(self, model, rows: List[List[int]], pad: int = 0) -> List[KVCache]:
+        """
+        Fresh prompt cache holding one batch row per prefix in `rows`, left-padded
+        to the longest (pad slots are zeros; the caller masks them). Continue by
+        feeding each row's remaining tokens.
+        """
+        width = max(len(r) for r in rows)
+        per_row = [self.get(model, r, width - len(r), pad) for r in rows]
+        cache = make_prompt_cache(model)
+        for li, c in enumerate(cache):
+            ks, vs = [], []
+            for r, kv in zip(rows, per_row):
+                k, v = kv[li]
+                n_pad = width - len(r)
+                if n_pad:
+                    k = mx.concatenate([mx.zeros((*k.shape[:2], n_pad, k.shape[3]), dtype=k.dtype), k], axis=2)
+                    v = mx.concatenate([mx.zeros((*v.shape[:2], n_pad, v.shape[3]), dtype=v.dtype), v], axis=2)
+                ks.append(k); vs.append(v)
+            c.state = (mx.concatenate(ks, axis=0), mx.concatenate(vs, axis=0))
+        return cache
+
+    def resident_bytes(self) -> int:
+        return sum(e["bytes"] for e in self.entries.values())
+
+    def _evict(self):
+        while self.entries and self.resident_bytes() > self.budget_bytes:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def report(self) -> Dict[str, Any]:
+        s = dict(self.stats)
+        s["hit_rate"] = round(s["hits"] / s["lookups"], 3) if s["lookups"] else 0.0
+        s["prefill_seconds"] = round(s["prefill_seconds"], 2)
+        s["prefill_seconds_saved"] = round(s["prefill_seconds_saved"], 2)
+        s["resident_mb"] = round(self.resident_bytes() / MB, 1)
+        print(f"[prefix_cache] {s['hits']}/{s['lookups']} hits ({s['hit_rate']:.0%}), "
+              f"{s['tokens_reused']} prefix tokens reused, prefill {s['prefill_seconds']:.1f}s "
+              f"spent / {s['prefill_seconds_saved']:.1f}s saved, {len(self.entries)} entries "
+              f"({s['resident_mb']} MB), {s['evictions']} evictions")
+        return s
+
+_CACHE: Optional[PrefixCache] = None
+
+def get_prefix_cache(budget_mb: float = 512, min_tokens: int = 32) -> PrefixCache:
+    """Process-wide prefix cache (settings are taken from the first call)."""
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = PrefixCache(budget_mb, min_tokens)
+    return _CACHE
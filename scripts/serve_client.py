@@ -0,0 +1,140 @@
+# scripts/serve_client.py
+# Thin client for serve_local.py.
+#
+#   client = open_client(CFG.run.server)        # None when run.server is ""
+#   outs = client.complete("default", prompts, max_tokens=64)     # gen_engine output dicts
+#   for piece in client.stream("fused", prompt): print(piece, end="")
+#
+# Addresses: "http://127.0.0.1:8765" or "unix:/path/to/socket". Every call
+# is one HTTP request; a list of prompts goes out in one request, and the
+# server batches it together with whatever else is running. generate() and
+# tokenizer_meta() have the shape gen_cache.GenCache needs, so the evaluation
+# steps use the server instead of loading models when run.server is set.
+
+from __future__ import annotations
+import json, socket, http.client
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from typing import Dict, Any, Iterator, List, Optional, Sequence, Union
+from urllib.parse import urlparse
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = 600):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+class ServerError(RuntimeError):
+    pass
+
+class LocalClient:
+    def __init__(self, address: str, timeout: float = 600):
+        self.address, self.timeout = address, timeout
+        self.last: Optional[Dict[str, Any]] = None   # engine output of the last stream()
+
+    def _conn(self) -> http.client.HTTPConnection:
+        if self.address.startswith("unix:"):
+            return UnixHTTPConnection(self.address[len("unix:"):], self.timeout)
+        u = urlparse(self.address)
+        return http.client.HTTPConnection(u.hostname or "127.0.0.1", u.port or 8765, timeout=self.timeout)
+
+    def _request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None):
+        conn = self._conn()
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        conn.request(method, path, body=data, headers={"Content-Type": "application/json"})
+        resp = conn.getresponse()
+        if resp.status != 200:
+            raise ServerError(f"{method} {path}: {resp.status} {resp.read().decode('utf-8', 'replace')}")
+        return conn, resp
+
+    def _json(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        conn, resp = self._request(method, path, body)
+        try:
+            return json.loads(resp.read())
+        finally:
+            conn.close()
+
+    def health(self) -> Dict[str, Any]:
+        return self._json("GET", "/health")
+
+    def models(self) -> List[Dict[str, Any]]:
+        return self._json("GET", "/v1/models")["data"]
+
+    def tokenizer_meta(self, model: str, adapter: Optional[str] = None) -> Dict[str, Any]:
+        return self._json("POST", "/v1/tokenizer", {"model": model, "adapter": adapter})
+
+    @staticmethod
+    def _body(model: str, prompt, max_tokens: int, adapter: Optional[str], stop: Optional[Sequence[str]],
+              temperature: float, ignore_eos: bool, checkpoints: Sequence[int], token_stats: int = 0) -> Dict[str, Any]:
+        body = {"model": model, "prompt": prompt, "max_tokens": int(max_tokens), "temperature": float(temperature),
+                "ignore_eos": bool(ignore_eos), "checkpoints": [int(n) for n in checkpoints]}
+        if token_stats:
+            body["token_stats"] = int(token_stats)
+        if adapter:
+            body["adapter"] = adapter
+        if stop is not None:     # None = the server's policy stop strings
+            body["stop"] = list(stop)
+        return body
+
+    def complete(self, model: str, prompts: List[str], max_tokens: int = 128, adapter: Optional[str] = None,
+                 stop: Optional[Sequence[str]] = None, temperature: float = 0.0, ignore_eos: bool = False,
+                 checkpoints: Sequence[int] = (), token_stats: int = 0) -> List[Dict[str, Any]]:
+        """gen_engine output dicts for `prompts`, in order."""
+        res = self._json("POST", "/v1/completions", self._body(model, list(prompts), max_tokens, adapter, stop,
+                                                               temperature, ignore_eos, checkpoints, token_stats))
+        return [c["engine"] for c in sorted(res["choices"], key=lambda c: c["index"])]
+
+    def stream(self, model: str, prompt: str, max_tokens: int = 128, adapter: Optional[str] = None,
+               stop: Optional[Sequence[str]] = None, temperature: float = 0.0, ignore_eos: bool = False,
+               checkpoints: Sequence[int] = ()) -> Iterator[str]:
+        """Text pieces as they are generated; the full output is in .last afterwards."""
+        body = self._body(model, prompt, max_tokens, adapter, stop, temperature, ignore_eos, checkpoints)
+        body["stream"] = True
+        self.last = None
+        conn, resp = self._request("POST", "/v1/completions", body)
+        try:
+            for line in resp:
+                line = line.strip()
+                if not line.startswith(b"data: "):
+                    continue
+                if line == b"data: [DONE]":
+                    break
+                chunk = json.loads(line[len(b"data: "):])
+                if "error" in chunk:
+                    raise ServerError(chunk["error"]["message"])
+                c = chunk["choices"][0]
+                if c.get("engine"):
+                    self.last = c["engine"]
+                if c["text"]:
+                    yield c["text"]
+        finally:
+            conn.close()
+
+    def generate(self, model_path: str, adapter_path: Optional[str], prompts: List[str],
+                 max_tokens: Union[int, List[int]], stop_strings: Sequence[str] = (), ignore_eos: bool = False,
+                 temp: float = 0.0, checkpoints: Sequence[int] = (), token_stats: int = 0,
+                 **_) -> List[Dict[str, Any]]:
+        """generate_batch over the server (batching / prefix / draft options are the server's business)."""
+        n = len(prompts)
+        budgets = list(max_tokens) if isinstance(max_tokens, (list, tuple)) else [int(max_tokens)] * n
+        out: List[Optional[Dict[str, Any]]] = [None] * n
+        groups = [list(g) for _, g in groupby(sorted(range(n), key=lambda i: budgets[i]), key=lambda i: budgets[i])]
+
+        def one(idx: List[int]):
+            res = self.complete(model_path, [prompts[i] for i in idx], budgets[idx[0]], adapter_path,
+                                list(stop_strings), temp, ignore_eos, checkpoints, token_stats)
+            for i, o in zip(idx, res):
+                out[i] = o
+
+        # one request per budget, all in flight at once so the server batches them together
+        with ThreadPoolExecutor(max_workers=max(1, len(groups))) as ex:
+            list(ex.map(one, groups))
+        return out  # type: ignore[return-value]
+
+def open_client(address: Optional[str]) -> Optional[LocalClient]:
+    """Client for `address`; None (generate in-process) when it is empty."""
+    return LocalClient(address) if address else None
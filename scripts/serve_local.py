@@ -0,0 +1,368 @@
+# scripts/serve_local.py
+# Local OpenAI-compatible completion server with continuous batching.
+#
+#   python scripts/serve_local.py                       # serve_local.host:port from config
+#   python scripts/serve_local.py --socket run/mlx.sock # Unix socket instead of TCP
+#   python scripts/serve_local.py --stub --selftest     # tiny random model, self-check, exit
+#
+# Endpoints:
+#   GET  /health              loaded artifacts and batcher counters
+#   GET  /v1/models           artifacts from artifacts.json ("<model_id>:<label>")
+#   POST /v1/completions      {model, prompt (str | [str]), max_tokens, temperature, stop, stream}
+#                             + extensions: adapter, ignore_eos, checkpoints, token_stats
+#   POST /v1/tokenizer        {model, adapter} → eos/pad token info
+#
+# `model` is resolved by artifact_resolver ("default" = the generation policy's
+# artifact_preference, "quantized" / "fused" / "adapter", "<model_id>:<label>",
+# or a model path). Without `stop`, the policy's stop_strings apply. Each
+# artifact gets one worker thread that owns the model (loaded through the
+# model pool) and a ContinuousBatcher: prompts from concurrent requests join
+# the running decode batch between steps (continuous_batch.py). Choices carry
+# the OpenAI fields plus `engine`, the full gen_engine output dict, so
+# serve_client.py can stand in for in-process generation (run.server).
+# With stream=true, text arrives as server-sent events ("data: {...}" lines,
+# then "data: [DONE]"), one choice delta per event.
+#
+# --stub serves every model name from a small randomly initialized llama with
+# a byte tokenizer, so the server, client and batching can be exercised without
+# weights; --selftest starts it on a temporary socket, sends concurrent
+# streaming and plain requests, and checks them against gen_engine.
+
+from __future__ import annotations
+import os, sys, json, time, queue, uuid, argparse, tempfile, threading, codecs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from config_loader import load_config
+from artifact_resolver import resolve, listing, load_policy
+from stop_matcher import policy_stop_strings
+
+CFG       = load_config()
+STEP_NAME = os.environ.get("STEP_NAME", "serve_local")
+STEP_CFG  = CFG[STEP_NAME]
+
+ARTIFACTS = Path(CFG.run.data_dir) / CFG.run.artifacts
+POLICIES  = (Path(CFG.run.output_dir) / CFG.run.policy, Path(CFG.run.data_dir) / CFG.run.policy)
+MAX_BATCH = int(getattr(STEP_CFG, "max_batch", 0) or CFG.run.gen_batch_size)
+
+# --- stub backend ---
+class ByteDetokenizer:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.dec = codecs.getincrementaldecoder("utf-8")("replace")
+        self.text, self.offset = "", 0
+
+    def add_token(self, t: int):
+        if t < 256:
+            self.text += self.dec.decode(bytes([t]))
+
+    def finalize(self):
+        self.text += self.dec.decode(b"", final=True)
+
+    @property
+    def last_segment(self) -> str:
+        seg, self.offset = self.text[self.offset:], len(self.text)
+        return seg
+
+class ByteTokenizer:
+    """UTF-8 bytes as ids 0-255, EOS = 256."""
+    vocab_size = 257
+    bos_token = None
+    eos_token, eos_token_id, eos_token_ids = "</s>", 256, [256]
+    pad_token = pad_token_id = None
+    detokenizer = ByteDetokenizer()
+
+    def encode(self, s: str, add_special_tokens: bool = True) -> List[int]:
+        return list(s.encode("utf-8"))
+
+    def decode(self, ids: List[int]) -> str:
+        return bytes(t for t in ids if t < 256).decode("utf-8", "replace")
+
+def stub_backend(seed: int = 0):
+    import mlx.core as mx
+    from mlx_lm.models import llama
+    args = llama.ModelArgs(model_type="llama", hidden_size=64, num_hidden_layers=2, intermediate_size=128,
+                           num_attention_heads=4, num_key_value_heads=2, rms_norm_eps=1e-5,
+                           vocab_size=ByteTokenizer.vocab_size)
+    mx.random.seed(seed)
+    model = llama.Model(args)
+    mx.eval(model.parameters())
+    return model, ByteTokenizer()
+
+# --- workers ---
+class Job:
+    def __init__(self, index: int, prompt: Any, params: Dict[str, Any], events: "queue.Queue"):
+        self.index, self.prompt, self.params, self.events = index, prompt, params, events
+
+class Worker(threading.Thread):
+    """Owns one model and its ContinuousBatcher; jobs arrive on `inbox`."""
+    def __init__(self, key: Tuple[str, str], load, max_batch: int):
+        super().__init__(daemon=True, name=f"worker:{key[0]}")
+        self.key, self.load, self.max_batch = key, load, max_batch
+        self.inbox: "queue.Queue[Job]" = queue.Queue()
+        self.ready = threading.Event()
+        self.error: Optional[str] = None
+        self.tok = self.batcher = None
+
+    def run(self):
+        try:
+            from continuous_batch import ContinuousBatcher
+            model, self.tok = self.load()
+            self.batcher = ContinuousBatcher(model, self.tok, self.max_batch)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+        self.ready.set()
+        while True:
+            if self.batcher is None or not self.batcher.busy:
+                self._take(self.inbox.get())
+            while True:
+                try:
+                    self._take(self.inbox.get_nowait())
+                except queue.Empty:
+                    break
+            if self.batcher is not None and self.batcher.busy:
+                try:
+                    self.batcher.step()
+                except Exception as e:
+                    for req in self.batcher.abort():
+                        req.job.events.put((req.job.index, "error", f"{type(e).__name__}: {e}"))
+
+    def _take(self, job: Job):
+        if self.error:
+            job.events.put((job.index, "error", self.error))
+            return
+        on_event = lambda req, piece, done: job.events.put((job.index, "delta", piece, req.result if done else None))
+        try:
+            self.batcher.submit(job.prompt, on_event=on_event, **job.params).job = job
+        except Exception as e:
+            job.events.put((job.index, "error", f"{type(e).__name__}: {e}"))
+
+    def tokenizer_meta(self) -> Dict[str, Any]:
+        self.ready.wait()
+        if self.error:
+            raise RuntimeError(self.error)
+        return {k: getattr(self.tok, k, None) for k in ("eos_token", "eos_token_id", "pad_token", "pad_token_id")}
+
+class Backends:
+    def __init__(self, stub: bool = False, max_batch: int = MAX_BATCH):
+        self.stub, self.max_batch = stub, max_batch
+        self.workers: Dict[Tuple[str, str], Worker] = {}
+        self.lock = threading.Lock()
+        self.pool_lock = threading.Lock()
+
+    def resolve(self, name: str, adapter: Optional[str]) -> Tuple[str, Optional[str], str]:
+        if self.stub:
+            return "stub", None, "stub"
+        return resolve(name, ARTIFACTS, load_policy(*POLICIES), adapter)
+
+    def worker(self, model_path: str, adapter_path: Optional[str]) -> Worker:
+        key = (str(model_path), str(adapter_path or ""))
+        with self.lock:
+            w = self.workers.get(key)
+            if w is None:
+                w = self.workers[key] = Worker(key, lambda: self._load(model_path, adapter_path), self.max_batch)
+                w.start()
+            return w
+
+    def _load(self, model_path: str, adapter_path: Optional[str]):
+        if self.stub:
+            return stub_backend()
+        from model_pool import get_pool
+        with self.pool_lock:
+            return get_pool(CFG.run.model_pool_gb).get(model_path, adapter_path)
+
+    def health(self) -> Dict[str, Any]:
+        return {"ok": True, "workers": [{"model_path": k[0], "adapter_path": k[1] or None, "error": w.error,
+                                         "stats": w.batcher.stats if w.batcher else None}
+                                        for k, w in self.workers.items()]}
+
+FINISH = {"eos": "stop", "stop": "stop", "length": "length"}
+
+def completion_params(body: Dict[str, Any]) -> Dict[str, Any]:
+    stop = body.get("stop")
+    if stop is None:
+        stop = policy_stop_strings(*POLICIES)
+    elif isinstance(stop, str):
+        stop = [stop]
+    return {"max_tokens": int(body.get("max_tokens") or 128), "temp": float(body.get("temperature") or 0.0),
+            "stop_strings": list(stop), "ignore_eos": bool(body.get("ignore_eos", False)),
+            "checkpoints": [int(n) for n in body.get("checkpoints") or []],
+            "token_stats": int(body.get("token_stats") or 0)}
+
+class Handler(BaseHTTPRequestHandler):
+    backends: Backends = None   # set by make_server
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _json(self, obj: Any, status: int = 200):
+        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> Dict[str, Any]:
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/health":
+            return self._json(self.backends.health())
+        if self.path == "/v1/models":
+            data = [{"id": "stub", "object": "model"}] if self.backends.stub else \
+                   [{"object": "model", **m} for m in listing(ARTIFACTS)]
+            return self._json({"object": "list", "data": data})
+        self._json({"error": {"message": f"unknown path {self.path}"}}, 404)
+
+    def do_POST(self):
+        try:
+            body = self._body()
+            mpath, apath, label = self.backends.resolve(body.get("model", ""), body.get("adapter"))
+        except (ValueError, LookupError) as e:
+            return self._json({"error": {"message": str(e)}}, 400)
+        worker = self.backends.worker(mpath, apath)
+        if self.path == "/v1/tokenizer":
+            try:
+                return self._json(worker.tokenizer_meta())
+            except RuntimeError as e:
+                return self._json({"error": {"message": str(e)}}, 500)
+        if self.path != "/v1/completions":
+            return self._json({"error": {"message": f"unknown path {self.path}"}}, 404)
+
+        prompts = body.get("prompt", "")
+        prompts = prompts if isinstance(prompts, list) else [prompts]
+        params = completion_params(body)
+        events: "queue.Queue" = queue.Queue()
+        for i, p in enumerate(prompts):
+            worker.inbox.put(Job(i, p, params, events))
+        head = {"id": f"cmpl-{uuid.uuid4().hex[:24]}", "object": "text_completion",
+                "created": int(time.time()), "model": body.get("model") or label}
+        if body.get("stream"):
+            self._stream(head, events, len(prompts))
+        else:
+            self._collect(head, events, len(prompts))
+
+    def _choice(self, i: int, text: str, out: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        c = {"index": i, "text": text, "logprobs": None,
+             "finish_reason": FINISH.get(out["finish_reason"]) if out else None}
+        if out:
+            c["engine"] = out
+        return c
+
+    def _collect(self, head: Dict[str, Any], events: "queue.Queue", n: int):
+        outs: Dict[int, Dict[str, Any]] = {}
+        while len(outs) < n:
+            ev = events.get()
+            if ev[1] == "error":
+                return self._json({"error": {"message": ev[2]}}, 500)
+            if ev[3] is not None:
+                outs[ev[0]] = ev[3]
+        choices = [self._choice(i, outs[i]["text"], outs[i]) for i in range(n)]
+        prompt_toks = sum(o["prompt_tokens"] for o in outs.values())
+        gen_toks = sum(len(o["tokens"]) for o in outs.values())
+        self._json({**head, "choices": choices, "usage": {"prompt_tokens": prompt_toks, "completion_tokens": gen_toks,
+                                                          "total_tokens": prompt_toks + gen_toks}})
+
+    def _stream(self, head: Dict[str, Any], events: "queue.Queue", n: int):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        done = 0
+        try:
+            while done < n:
+                ev = events.get()
+                if ev[1] == "error":
+                    chunk = {"error": {"message": ev[2]}}
+                    done += 1
+                else:
+                    chunk = {**head, "choices": [self._choice(ev[0], ev[2], ev[3])]}
+                    done += ev[3] is not None
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass   # client went away; its rows finish in the batch and are dropped
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+
+class UnixHandler(Handler):
+    def address_string(self):
+        return "unix"
+
+def make_server(backends: Backends, host: str = "127.0.0.1", port: int = 8765, sock: str = ""):
+    if sock:
+        handler = type("BoundUnixHandler", (UnixHandler,), {"backends": backends})
+        return UnixHTTPServer(sock, handler)
+    handler = type("BoundHandler", (Handler,), {"backends": backends})
+    return ThreadingHTTPServer((host, port), handler)
+
+def selftest(max_batch: int):
+    """Concurrent streamed + plain requests through the stub server vs. gen_engine."""
+    from gen_engine import generate_batch
+    from serve_client import LocalClient
+    model, tok = stub_backend()
+    prompts = ["tide", "stone and river", "the moon does not race", "patience is", "a long " * 6]
+    budgets = [5, 17, 9, 30, 12]
+    ref = generate_batch(model, tok, prompts, budgets, stop_strings=[])
+
+    sock = os.path.join(tempfile.mkdtemp(), "serve.sock")
+    backends = Backends(stub=True, max_batch=max_batch)
+    srv = make_server(backends, sock=sock)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    client = LocalClient(f"unix:{sock}")
+    got: Dict[int, Tuple[str, str]] = {}
+
+    def one(i: int):
+        if i % 2:
+            text = "".join(client.stream("stub", prompts[i], max_tokens=budgets[i], stop=[]))
+            got[i] = (text, client.last["text"])
+        else:
+            o = client.complete("stub", [prompts[i]], max_tokens=budgets[i], stop=[])[0]
+            got[i] = (o["text"], o["text"])
+
+    threads = [threading.Thread(target=one, args=(i,)) for i in range(len(prompts))]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    srv.shutdown()
+    bad = [i for i in range(len(prompts)) if got.get(i) != (ref[i]["text"], ref[i]["text"])]
+    stats = backends.health()["workers"][0]["stats"]
+    print(f"[serve_local] selftest: {len(prompts) - len(bad)}/{len(prompts)} match gen_engine; batcher {stats}")
+    if bad:
+        raise SystemExit(f"selftest mismatches: {bad}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Local OpenAI-compatible completion server.")
+    ap.add_argument("--host", default=getattr(STEP_CFG, "host", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(getattr(STEP_CFG, "port", 8765)))
+    ap.add_argument("--socket", default=getattr(STEP_CFG, "socket", ""))
+    ap.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    ap.add_argument("--stub", action="store_true", help="serve a tiny random model (no weights needed)")
+    ap.add_argument("--selftest", action="store_true", help="with --stub: self-check against gen_engine and exit")
+    a, _ = ap.parse_known_args()   # --config / --set belong to config_loader
+    if a.selftest:
+        selftest(a.max_batch)
+        sys.exit(0)
+    srv = make_server(Backends(stub=a.stub, max_batch=a.max_batch), a.host, a.port, a.socket)
+    where = f"unix:{a.socket}" if a.socket else f"http://{a.host}:{a.port}"
+    print(f"[serve_local] serving {'stub model' if a.stub else ARTIFACTS} on {where} (max batch {a.max_batch})")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
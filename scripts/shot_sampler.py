@@ -0,0 +1,110 @@
+# scripts/shot_sampler.py
+# Few-shot example sampler built once per corpus.
+#
+#   sampler = ShotSampler(texts)
+#   shots = sampler.draw(k, sampler.rng(seed, prompt, attempt))
+#
+# Texts are bucketed by word count (short ≤ 4, medium 5–12, long > 12) into
+# index arrays. A draw takes one example from each non-empty bucket, then
+# fills up to k with distinct examples drawn uniformly from the rest of the
+# corpus (rejection sampling), so it costs O(k) rather than a pass over the
+# corpus. This is the same distribution as shuffling the whole corpus and
+# taking a prefix, as 04_snapshot used to. rng() derives a generator from
+# (seed, prompt, attempt), so a draw does not depend on what was drawn before
+# it.
+#
+#   python scripts/shot_sampler.py --bench [--lines 1000000] [--k 4]
+
+from __future__ import annotations
+import sys, time, random, hashlib, argparse
+from typing import List, Sequence
+
+import numpy as np
+
+SHORT_MAX  = 4
+MEDIUM_MAX = 12
+
+class ShotSampler:
+    def __init__(self, texts: Sequence[str], short_max: int = SHORT_MAX, medium_max: int = MEDIUM_MAX):
+        self.texts = list(texts)
+        wc = np.fromiter((len(t.split()) for t in self.texts), dtype=np.int32, count=len(self.texts))
+        self.buckets = [b for b in (np.flatnonzero(wc <= short_max),
+                                    np.flatnonzero((wc > short_max) & (wc <= medium_max)),
+                                    np.flatnonzero(wc > medium_max)) if len(b)]
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @staticmethod
+    def rng(seed, *key) -> random.Random:
+        """Generator seeded from (seed, *key), e.g. (seed, prompt, attempt)."""
+        h = hashlib.sha256("\0".join(str(x) for x in (seed, *key)).encode("utf-8")).digest()
+        return random.Random(int.from_bytes(h[:8], "little"))
+
+    def draw_indices(self, k: int, rng: random.Random) -> List[int]:
+        n = len(self.texts)
+        picked = [int(b[rng.randrange(len(b))]) for b in self.buckets][:k]
+        need = min(k, n) - len(picked)
+        if need <= 0:
+            return picked
+        taken = set(picked)
+        if need * 2 > n - len(taken):   # nearly the whole corpus: sample the complement directly
+            rest = rng.sample([i for i in range(n) if i not in taken], need)
+        else:
+            rest = []
+            while len(rest) < need:
+                i = rng.randrange(n)
+                if i not in taken:
+                    taken.add(i); rest.append(i)
+        return picked + rest
+
+    def draw(self, k: int, rng: random.Random) -> List[str]:
+        return [self.texts[i] for i in self.draw_indices(k, rng)]
+
+def legacy_pick(unique: List[str], short: List[str], medium: List[str], longer: List[str], k: int) -> List[str]:
+    """The per-call sampler 04_snapshot used before (kept for --bench)."""
+    pool = []
+    if short: pool.append(random.choice(short))
+    if medium: pool.append(random.choice(medium))
+    if longer: pool.append(random.choice(longer))
+    rest = [t for t in unique if t not in pool]
+    random.shuffle(rest)
+    return (pool + rest)[:k]
+
+def bench(lines: int, k: int, legacy_calls: int = 3, draws: int = 20000):
+    rnd = random.Random(0)
+    words = ["tide", "stone", "river", "moon", "patience", "the", "a", "of", "is", "never", "slow", "light"]
+    texts = [f"{i} " + " ".join(rnd.choice(words) for _ in range(rnd.choice((2, 3, 6, 9, 15, 20))))
+             for i in range(lines)]
+    short = [t for t in texts if len(t.split()) <= SHORT_MAX]
+    medium = [t for t in texts if SHORT_MAX < len(t.split()) <= MEDIUM_MAX]
+    longer = [t for t in texts if len(t.split()) > MEDIUM_MAX]
+
+    t0 = time.perf_counter()
+    for _ in range(legacy_calls):
+        legacy_pick(texts, short, medium, longer, k)
+    legacy = (time.perf_counter() - t0) / legacy_calls
+
+    t0 = time.perf_counter()
+    sampler = ShotSampler(texts)
+    build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for i in range(draws):
+        sampler.draw(k, ShotSampler.rng(42, "prompt", i))
+    new = (time.perf_counter() - t0) / draws
+
+    print(f"corpus {lines:,} lines · k={k}")
+    print(f"  legacy pick_diverse_shots : {legacy * 1e3:10.2f} ms / draw")
+    print(f"  ShotSampler build (once)  : {build * 1e3:10.2f} ms")
+    print(f"  ShotSampler.draw          : {new * 1e6:10.2f} µs / draw  (incl. seeding)")
+    print(f"  speedup per draw          : {legacy / new:10.0f}×")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Few-shot sampler benchmark.")
+    ap.add_argument("--bench", action="store_true")
+    ap.add_argument("--lines", type=int, default=1_000_000)
+    ap.add_argument("--k", type=int, default=4)
+    a = ap.parse_args()
+    if not a.bench:
+        ap.print_help(); sys.exit(0)
+    bench(a.lines, a.k)
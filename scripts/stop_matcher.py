@@ -0,0 +1,109 @@
+# scripts/stop_matcher.py
+# Streaming stop-sequence matcher shared by the generation loops (gen_engine,
+# 115_entropy).
+#
+#   m = StopMatcher(stop_strings, stop_token_ids(tok, stop_strings))
+#   for each generated token t with decoded piece s:
+#       if m.is_stop_token(t): halt
+#       cut = m.feed(s)          # char offset where a stop sequence starts, or None
+#
+# Stop strings are matched with an Aho-Corasick automaton fed one character at
+# a time, so each character costs O(1) amortized and the only history kept is
+# the automaton state (at most the longest stop string's worth of tail),
+# instead of re-scanning the whole growing buffer after every token. Stop strings
+# that are a single token in the vocabulary are also stopped on by token id,
+# before any detokenization.
+#
+# policy_stop_strings() collects `stop_strings` from generation_policy.json
+# (written by 022_prepare_prompts).
+
+from __future__ import annotations
+import json
+from collections import deque
+from pathlib import Path
+from typing import Iterable, List, Optional, Set
+
+class StopMatcher:
+    def __init__(self, stop_strings: Iterable[str] = (), stop_ids: Iterable[int] = ()):
+        self.stop_strings = [s for s in dict.fromkeys(stop_strings) if s]
+        self.stop_ids: Set[int] = set(stop_ids)
+        # trie → goto / fail / longest pattern ending at each state
+        self.goto: List[dict] = [{}]
+        self.depth: List[int] = [0]
+        self.hit: List[int] = [0]
+        for s in self.stop_strings:
+            node = 0
+            for ch in s:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({}); self.depth.append(self.depth[node] + 1); self.hit.append(0)
+                node = nxt
+            self.hit[node] = max(self.hit[node], len(s))
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            u = queue.popleft()
+            for ch, v in self.goto[u].items():
+                f = self.fail[u]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[v] = self.goto[f].get(ch, 0) if self.goto[f].get(ch, 0) != v else 0
+                self.hit[v] = max(self.hit[v], self.hit[self.fail[v]])
+                queue.append(v)
+        self.reset()
+
+    def __bool__(self) -> bool:
+        return bool(self.stop_strings or self.stop_ids)
+
+    @property
+    def window(self) -> int:
+        """Chars of tail context the matcher can need (longest stop string)."""
+        return max((len(s) for s in self.stop_strings), default=0)
+
+    def reset(self):
+        self.state = 0
+        self.pos = 0
+
+    def is_stop_token(self, token_id: int) -> bool:
+        return token_id in self.stop_ids
+
+    def feed(self, piece: str) -> Optional[int]:
+        """Advance over `piece`; offset (in everything fed so far) where a completed stop string starts."""
+        state, goto, fail, hit = self.state, self.goto, self.fail, self.hit
+        for ch in piece:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            self.pos += 1
+            if hit[state]:
+                self.state = state
+                return self.pos - hit[state]
+        self.state = state
+        return None
+
+def stop_token_ids(tok, stop_strings: Iterable[str]) -> Set[int]:
+    """Ids of stop strings that are exactly one token (e.g. "</s>", "###")."""
+    ids: Set[int] = set()
+    for s in stop_strings:
+        if not s:
+            continue
+        try:
+            enc = tok.encode(s, add_special_tokens=False)
+        except TypeError:
+            enc = tok.encode(s)
+        if len(enc) == 1 and tok.decode(enc) == s:
+            ids.add(int(enc[0]))
+    return ids
+
+def policy_stop_strings(*paths: Path) -> List[str]:
+    """Union of `stop_strings` across the generation policy files that exist."""
+    out: List[str] = []
+    for p in paths:
+        if p and Path(p).exists():
+            try:
+                out += json.loads(Path(p).read_text(encoding="utf-8")).get("stop_strings", []) or []
+            except Exception:
+                pass
+    return list(dict.fromkeys(s for s in out if s))
@@ -0,0 +1,151 @@
+# scripts/stream_fuse.py
+# Streaming LoRA fuse: merge an mlx_lm LoRA adapter into the base weights one
+# tensor at a time, straight from memory-mapped safetensors shards.
+#
+#   W' = W + scale · (lora_bᵀ @ lora_aᵀ)          (as mlx_lm LoRALinear.fuse)
+#
+# Output shards keep the base shard names, tensor names, dtypes and byte
+# offsets, so each shard header is copied verbatim and tensor data is streamed
+# behind it; untouched tensors are copied in chunks, LoRA targets are merged in
+# row blocks. Peak memory is a few row blocks plus the (small) adapter, not a
+# model copy.
+#
+# Supported: unquantized base weights in F32/F16/BF16, LoRA adapters. Anything
+# else (quantized base, DoRA, names that do not line up) raises Unsupported
+# and the caller falls back to `mlx_lm fuse`.
+#
+#   python scripts/stream_fuse.py --model <id|dir> --adapter-path <dir> --save-path <dir>
+
+from __future__ import annotations
+import os, sys, json, shutil, struct, argparse
+from pathlib import Path
+from typing import Dict, Any, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.dirname(__file__))
+from train_memory import resolve_model_dir
+
+COPY_CHUNK  = 64 * 1024 * 1024
+BLOCK_BYTES = 64 * 1024 * 1024     # float32 working set per merged row block
+# non-weight files carried into the fused dir (config, tokenizer, generation,
+# custom model code); *.bin / *.pth / *.gguf weight duplicates are left behind
+SIDE_FILES  = ("*.json", "tokenizer.model", "*.tiktoken", "*.txt", "*.py")
+DTYPES = {"F32": np.float32, "F16": np.float16, "BF16": np.uint16}
+
+class Unsupported(Exception):
+    pass
+
+def read_header(path: Path) -> Tuple[Dict[str, Any], int]:
+    with path.open("rb") as f:
+        (n,) = struct.unpack("<Q", f.read(8))
+        return json.loads(f.read(n)), 8 + n
+
+def tensor_view(mm: np.memmap, base: int, info: Dict[str, Any]) -> np.ndarray:
+    if info["dtype"] not in DTYPES:
+        raise Unsupported(f"dtype {info['dtype']}")
+    start, end = info["data_offsets"]
+    return mm[base + start: base + end].view(DTYPES[info["dtype"]]).reshape(info["shape"])
+
+def to_f32(x: np.ndarray, dtype: str) -> np.ndarray:
+    if dtype == "BF16":
+        return (x.astype(np.uint32) << 16).view(np.float32)
+    return x.astype(np.float32)
+
+def from_f32(x: np.ndarray, dtype: str) -> np.ndarray:
+    if dtype == "BF16":
+        u = x.view(np.uint32)
+        return ((u + 0x7FFF + ((u >> 16) & 1)) >> 16).astype(np.uint16)  # round to nearest even
+    return x.astype(DTYPES[dtype])
+
+def load_adapter(adapter_dir: Path) -> Tuple[Dict[str, Tuple[np.ndarray, np.ndarray]], float]:
+    """{base weight name: (lora_a, lora_b)} in float32, and the LoRA scale."""
+    cfg = json.loads((adapter_dir / "adapter_config.json").read_text(encoding="utf-8"))
+    if cfg.get("fine_tune_type", "lora") != "lora" or cfg.get("use_dora"):
+        raise Unsupported(f"fine_tune_type {cfg.get('fine_tune_type')}")
+    scale = float((cfg.get("lora_parameters") or {}).get("scale", 20.0))
+    path = adapter_dir / "adapters.safetensors"
+    header, base = read_header(path)
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    pairs: Dict[str, Dict[str, np.ndarray]] = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        mod, _, leaf = name.rpartition(".")
+        if leaf not in ("lora_a", "lora_b"):
+            raise Unsupported(f"adapter tensor {name}")
+        pairs.setdefault(mod + ".weight", {})[leaf] = to_f32(tensor_view(mm, base, info), info["dtype"])
+    return {k: (v["lora_a"], v["lora_b"]) for k, v in pairs.items()}, scale
+
+def merge_into(out, w: np.ndarray, dtype: str, a: np.ndarray, b: np.ndarray, scale: float):
+    """Write W + scale·bᵀaᵀ to `out` in row blocks (W is (out, in), a (in, r), b (r, out))."""
+    if w.ndim != 2 or w.shape != (b.shape[1], a.shape[0]):
+        raise Unsupported(f"shape {w.shape} vs lora {a.shape}/{b.shape}")
+    rows = max(1, BLOCK_BYTES // (4 * w.shape[1]))
+    bt_scaled = scale * b.T
+    for i in range(0, w.shape[0], rows):
+        blk = to_f32(np.asarray(w[i:i + rows]), dtype)
+        blk += bt_scaled[i:i + rows] @ a.T
+        out.write(from_f32(blk, dtype).tobytes())
+
+def fuse(model_id: str, adapter_dir: Path, save_path: Path, log=print) -> Dict[str, Any]:
+    adapter_dir, save_path = Path(adapter_dir), Path(save_path)
+    src = resolve_model_dir(model_id)
+    if src is None:
+        from huggingface_hub import snapshot_download
+        src = Path(snapshot_download(model_id, allow_patterns=["*.json", "*.safetensors", "*.model", "*.txt", "*.tiktoken", "*.py"]))
+    cfg = json.loads((src / "config.json").read_text(encoding="utf-8"))
+    if cfg.get("quantization") or cfg.get("quantization_config"):
+        raise Unsupported("quantized base model")
+    loras, scale = load_adapter(adapter_dir)
+    shards = sorted(src.glob("*.safetensors"))
+    if not shards:
+        raise Unsupported("no safetensors shards")
+
+    # check every adapter target exists before writing anything
+    headers = {p: read_header(p) for p in shards}
+    names = {n for h, _ in headers.values() for n in h if n != "__metadata__"}
+    missing = [k for k in loras if k not in names]
+    if missing:
+        raise Unsupported(f"{len(missing)} adapter targets not in base weights, e.g. {missing[0]}")
+
+    save_path.mkdir(parents=True, exist_ok=True)
+    for p in src.iterdir():
+        if p.is_file() and any(p.match(pat) for pat in SIDE_FILES):
+            shutil.copy2(p, save_path / p.name)
+
+    merged = 0
+    for p in shards:
+        header, base = headers[p]
+        mm = np.memmap(p, dtype=np.uint8, mode="r")
+        order = sorted((n for n in header if n != "__metadata__"), key=lambda n: header[n]["data_offsets"][0])
+        with (save_path / p.name).open("wb") as out:
+            out.write(mm[:base].tobytes())  # header unchanged: same names, dtypes, offsets
+            pos = 0
+            for name in order:
+                info = header[name]
+                start, end = info["data_offsets"]
+                if start > pos:  # alignment padding
+                    out.write(mm[base + pos: base + start].tobytes())
+                if name in loras:
+                    a, b = loras[name]
+                    merge_into(out, tensor_view(mm, base, info), info["dtype"], a, b, scale)
+                    merged += 1
+                else:
+                    for off in range(base + start, base + end, COPY_CHUNK):
+                        out.write(mm[off: min(off + COPY_CHUNK, base + end)].tobytes())
+                pos = end
+        log(f"[stream_fuse] {p.name}: done")
+        del mm
+    if merged != len(loras):
+        raise Unsupported(f"merged {merged} of {len(loras)} adapter targets")
+    return {"merged": merged, "shards": len(shards), "scale": scale, "source": str(src)}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Streaming LoRA fuse (mlx_lm adapter format).")
+    ap.add_argument("--model", required=True)
+    ap.add_argument("--adapter-path", required=True)
+    ap.add_argument("--save-path", required=True)
+    a = ap.parse_args()
+    info = fuse(a.model, Path(a.adapter_path), Path(a.save_path))
+    print(f"Fused {info['merged']} LoRA targets across {info['shards']} shards → {a.save_path}")
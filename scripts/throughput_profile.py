@@ -0,0 +1,143 @@
+# scripts/throughput_profile.py
+# Machine-local training throughput profile ("profile DB").
+#
+# A micro-benchmark runs a few `mlx_lm lora` iterations per
+# (model, max_seq_length, batch_size, lora_rank) and records the measured
+# it/sec, tokens/sec, tokens/iter and peak memory. Entries are keyed by this
+# machine (host, chip, RAM) so one cache file can be shared across daily runs.
+# Planners use predict_row() to turn an experiments.csv row into wall-clock
+# and memory estimates.
+
+from __future__ import annotations
+import os, sys, json, time, shlex, platform, statistics, subprocess
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from train_log import stream_cmd, read_metrics
+
+DEFAULT_DB = "~/.cache/mlxtrain/throughput_profile.json"
+
+def machine_id() -> str:
+    chip = platform.processor() or platform.machine()
+    try:
+        r = subprocess.run(["sysctl", "-n", "machdep.cpu.brand_string"], capture_output=True, text=True)
+        chip = r.stdout.strip() or chip
+    except Exception:
+        pass
+    try:
+        ram = round(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3)
+    except (ValueError, OSError, AttributeError):
+        ram = 0
+    return f"{platform.node()}|{chip}|{ram}GB"
+
+def entry_key(model_id: str, seq: int, batch: int, rank: int) -> str:
+    return f"{model_id}|seq={int(seq)}|bs={int(batch)}|r={int(rank)}"
+
+def load_db(path: str | Path = DEFAULT_DB) -> Dict[str, Any]:
+    p = Path(path).expanduser()
+    if p.exists():
+        try:
+            return json.loads(p.read_text(encoding="utf-8"))
+        except Exception:
+            pass
+    return {"machines": {}}
+
+def save_db(db: Dict[str, Any], path: str | Path = DEFAULT_DB):
+    p = Path(path).expanduser()
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(".tmp")
+    tmp.write_text(json.dumps(db, indent=2), encoding="utf-8")
+    tmp.replace(p)
+
+def machine_entries(db: Dict[str, Any]) -> Dict[str, Any]:
+    return db.setdefault("machines", {}).setdefault(machine_id(), {}).setdefault("entries", {})
+
+def measure(model_id: str, data_dir: str, seq: int, batch: int, rank: int,
+            iters: int, work_dir: Path) -> Optional[Dict[str, Any]]:
+    """
+    Train `iters` LoRA steps with a report every step and summarize them.
+    The first report (graph build, first Metal allocations) is dropped.
+    """
+    import yaml
+    work_dir = Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    cfg = work_dir / "lora_config.yaml"
+    cfg.write_text(yaml.safe_dump({"lora_parameters": {"rank": int(rank), "dropout": 0.0, "scale": 20.0}}),
+                   encoding="utf-8")
+    cmd = " ".join([
+        f"{shlex.quote(sys.executable)} -m mlx_lm lora",
+        f"--model {shlex.quote(model_id)}",
+        f"--data {shlex.quote(str(data_dir))}",
+        "--train --fine-tune-type lora --num-layers -1",
+        f"--batch-size {int(batch)}",
+        f"--iters {int(iters)}",
+        f"--max-seq-length {int(seq)}",
+        f"--adapter-path {shlex.quote(str(work_dir / 'adapter'))}",
+        "--steps-per-report 1",
+        f"--steps-per-eval {int(iters) * 10}",
+        "--val-batches 1",
+        f"-c {shlex.quote(str(cfg))}",
+    ])
+    metrics = work_dir / "metrics.jsonl"
+    metrics.unlink(missing_ok=True)
+    t0 = time.time()
+    rc = stream_cmd(cmd, work_dir / "bench.log", metrics, prefix="[bench] ")
+    recs = [r for r in read_metrics(metrics) if r.get("kind") == "train"]
+    if rc != 0 or not recs:
+        return {"ok": False, "returncode": rc, "log": str(work_dir / "bench.log")}
+    steady = recs[1:] or recs
+    last = recs[-1]
+    return {
+        "ok": True,
+        "it_per_sec": round(statistics.median(r["it_per_sec"] for r in steady), 4),
+        "tokens_per_sec": round(statistics.median(r["tokens_per_sec"] for r in steady), 2),
+        "tokens_per_iter": round(last.get("trained_tokens", 0) / max(1, last["iter"]), 1),
+        "peak_mem_gb": max(r.get("peak_mem_gb", 0.0) for r in recs),
+        "bench_iters": int(iters),
+        "bench_seconds": round(time.time() - t0, 1),
+        "measured_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+def lookup(db: Dict[str, Any], model_id: str, seq: int, batch: int, rank: int) -> Optional[Dict[str, Any]]:
+    """
+    Exact measurement if present; otherwise scale the nearest measurement of
+    the same model by tokens per iteration (throughput in tokens/sec is taken
+    as constant, activation memory as proportional to batch × seq).
+    """
+    entries = machine_entries(db)
+    hit = entries.get(entry_key(model_id, seq, batch, rank))
+    if hit and hit.get("ok"):
+        return {**hit, "source": "measured"}
+    same = [e for k, e in entries.items() if k.split("|")[0] == model_id and e.get("ok")]
+    if not same:
+        return None
+    want = int(seq) * int(batch)
+    near = min(same, key=lambda e: abs(e["seq"] * e["batch"] - want))
+    ratio = want / max(1, near["seq"] * near["batch"])
+    base_mem = near.get("weights_gb", 0.0)
+    tokens_per_iter = near["tokens_per_iter"] * ratio
+    return {
+        "it_per_sec": near["tokens_per_sec"] / max(1.0, tokens_per_iter),
+        "tokens_per_sec": near["tokens_per_sec"],
+        "tokens_per_iter": tokens_per_iter,
+        "peak_mem_gb": base_mem + (near["peak_mem_gb"] - base_mem) * ratio,
+        "source": f"scaled from seq={near['seq']} bs={near['batch']}",
+    }
+
+def predict_row(db: Dict[str, Any], row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Wall-clock (seconds) and peak memory (GB) for training one row, or None."""
+    prof = lookup(db, str(row["model_id"]), int(row["max_seq_length"]),
+                  int(row["batch_size"]), int(row.get("lora_rank") or 8))
+    if not prof:
+        return None
+    iters = int(row["iters"])
+    return {
+        "est_seconds": round(iters / max(1e-9, prof["it_per_sec"]), 1),
+        "est_peak_mem_gb": round(prof["peak_mem_gb"], 2),
+        "est_trained_tokens": int(prof["tokens_per_iter"] * iters),
+        "profile_source": prof["source"],
+    }
+
+def fmt_seconds(s: float) -> str:
+    s = int(s)
+    return f"{s // 3600}h{(s % 3600) // 60:02d}m" if s >= 3600 else f"{s // 60}m{s % 60:02d}s"
@@ -0,0 +1,133 @@
+# scripts/token_stats.py
+# Per-token uncertainty statistics computed on-device from a decode step's
+# log-probabilities, for a whole batch at once.
+#
+#   s = step_stats(logprobs, chosen)      # logprobs [B, V], chosen token ids [B]
+#   rows = to_host(s)                     # {"entropy": [B floats], ...}, one sync
+#
+# Fields (natural log):
+#   entropy     H = -Σ p·log p
+#   varentropy  Σ p·(log p + H)²   (variance of the surprisal)
+#   topk_mass   probability mass of the top_k tokens
+#   rank        0-based rank of the chosen token (0 = argmax)
+#   logprob     log p of the chosen token
+# Everything stays an array op over [B, V]; only B scalars per field come back
+# to Python. The previous approach (logprobs.tolist() + math.exp over the full
+# vocabulary per token) is kept as legacy_entropy for --bench.
+#
+# gen_engine.generate_batch(token_stats=k) attaches them to each output
+# (out["token_stats"], columns aligned with out["tokens"], plus token_text);
+# snapshot / examination with token_stats: k write them out of the same decode:
+#
+#   write_entropy([(meta, out), ...], tokens_jsonl, summary_csv)
+#
+#   python scripts/token_stats.py --bench [--vocab 32064] [--batch 8] [--steps 50]
+
+from __future__ import annotations
+import csv, sys, json, math, time, argparse
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple
+
+import mlx.core as mx
+
+FIELDS = ("entropy", "varentropy", "topk_mass", "rank", "logprob")
+TOP_K = 10
+
+def step_stats(logprobs: mx.array, chosen: mx.array, top_k: int = TOP_K) -> Dict[str, mx.array]:
+    """Uncertainty statistics per row of `logprobs` [B, V] for the sampled tokens `chosen` [B]."""
+    lp = logprobs.astype(mx.float32)
+    p = mx.exp(lp)
+    plp = mx.where(p > 0, p * lp, 0.0)        # 0·log 0 = 0 (masked tokens have lp = -inf)
+    H = -mx.sum(plp, axis=-1)
+    dev = mx.where(p > 0, lp + H[:, None], 0.0)
+    var = mx.sum(p * dev * dev, axis=-1)
+    k = min(int(top_k), lp.shape[-1])
+    topk = mx.sum(mx.exp(mx.topk(lp, k, axis=-1)), axis=-1)
+    chosen_lp = mx.take_along_axis(lp, chosen.astype(mx.int32)[:, None], axis=-1)[:, 0]
+    rank = mx.sum(lp > chosen_lp[:, None], axis=-1)
+    return {"entropy": H, "varentropy": var, "topk_mass": topk, "rank": rank, "logprob": chosen_lp}
+
+def to_host(stats: Dict[str, mx.array]) -> Dict[str, list]:
+    mx.eval(*stats.values())
+    return {k: v.tolist() for k, v in stats.items()}
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"mean": 0.0, "median": 0.0, "min": 0.0, "max": 0.0}
+    ys = sorted(values); n = len(ys); h = n // 2
+    return {"mean": sum(ys) / n, "median": ys[h] if n % 2 else 0.5 * (ys[h - 1] + ys[h]),
+            "min": ys[0], "max": ys[-1]}
+
+SUMMARY_COLS = ["tokens", "mean_entropy", "median_entropy", "min_entropy", "max_entropy",
+                "mean_varentropy", "mean_topk_mass", "mean_rank", "mean_logprob"]
+
+def write_entropy(items: Sequence[Tuple[Dict[str, Any], Dict[str, Any]]], tokens_path: Path, summary_path: Path) -> int:
+    """
+    Per-token JSONL and per-output CSV from generate_batch outputs that carry
+    token_stats; `meta` (step, model_id, artifact, prompt, ...) leads every
+    record. Tokens after an ignored EOS are flagged past_eos and left out of
+    the summary, which covers the EOS-terminated generation. Returns the
+    number of outputs written.
+    """
+    items = [(m, o) for m, o in items if o.get("token_stats")]
+    meta_cols = list(dict.fromkeys(k for m, _ in items for k in m))
+    with Path(tokens_path).open("w", encoding="utf-8") as tf, \
+         Path(summary_path).open("w", encoding="utf-8", newline="") as sf:
+        w = csv.writer(sf)
+        w.writerow(meta_cols + SUMMARY_COLS)
+        for meta, o in items:
+            ts = o["token_stats"]
+            end = o["eos_index"] if o.get("eos_index") is not None else len(o["tokens"])
+            for j, t in enumerate(o["tokens"]):
+                rec = {**meta, "token_index": j, "token_id": t, "token_text": ts["token_text"][j],
+                       **{k: ts[k][j] for k in FIELDS}, "past_eos": j >= end}
+                tf.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            H = summarize(ts["entropy"][:end])
+            means = [summarize(ts[k][:end])["mean"] for k in ("varentropy", "topk_mass", "rank", "logprob")]
+            w.writerow([meta.get(k, "") for k in meta_cols] + [end] +
+                       [f"{H[k]:.4f}" for k in ("mean", "median", "min", "max")] +
+                       [f"{v:.4f}" for v in means])
+    return len(items)
+
+def legacy_entropy(logprobs) -> float:
+    """The per-token Python entropy 115_entropy used before (kept for --bench)."""
+    vals = list(logprobs)
+    m = max(vals)
+    exps = [math.exp(v - m) for v in vals]
+    Z = sum(exps)
+    ps = [e / (Z + 1e-12) for e in exps]
+    return -sum(p * math.log(p + 1e-12) for p in ps)
+
+def bench(vocab: int, batch: int, steps: int):
+    mx.random.seed(0)
+    logits = [mx.random.normal((batch, vocab)) * 3 for _ in range(steps)]
+    lps = [x - mx.logsumexp(x, axis=-1, keepdims=True) for x in logits]
+    ys = [mx.argmax(x, axis=-1) for x in lps]
+    mx.eval(lps, ys)
+
+    t0 = time.perf_counter()
+    legacy = [[legacy_entropy(lp[i].tolist()) for i in range(batch)] for lp in lps]
+    t_legacy = (time.perf_counter() - t0) / (steps * batch)
+
+    to_host(step_stats(lps[0], ys[0]))   # compile / warm up
+    t0 = time.perf_counter()
+    new = [to_host(step_stats(lp, y))["entropy"] for lp, y in zip(lps, ys)]
+    t_new = (time.perf_counter() - t0) / (steps * batch)
+
+    err = max(abs(a - b) for ra, rb in zip(legacy, new) for a, b in zip(ra, rb))
+    print(f"vocab {vocab:,} · batch {batch} · {steps} steps")
+    print(f"  legacy tolist + math.exp (entropy only) : {t_legacy * 1e6:10.1f} µs / token")
+    print(f"  step_stats on-device (all fields)       : {t_new * 1e6:10.1f} µs / token")
+    print(f"  speedup                                 : {t_legacy / t_new:10.0f}×")
+    print(f"  max |ΔH|                                : {err:.2e}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Per-token uncertainty statistics benchmark.")
+    ap.add_argument("--bench", action="store_true")
+    ap.add_argument("--vocab", type=int, default=32064)
+    ap.add_argument("--batch", type=int, default=8)
+    ap.add_argument("--steps", type=int, default=50)
+    a = ap.parse_args()
+    if not a.bench:
+        ap.print_help(); sys.exit(0)
+    bench(a.vocab, a.batch, a.steps)
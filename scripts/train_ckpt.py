@@ -0,0 +1,166 @@
+# scripts/train_ckpt.py
+# Checkpoint bookkeeping for `mlx_lm lora` runs.
+#
+# mlx_lm saves <adapter_path>/NNNNNNN_adapters.safetensors every --save-every
+# iterations, numbering from 1 again on every launch. After each launch (and
+# before the next one, in case the previous process died) those files are
+# harvested into <adapter_path>/checkpoints/ under their absolute iteration
+# number, validated, and recorded in <adapter_path>/checkpoints.json:
+#
+#   {"offset": 900, "completed_iter": null,
+#    "checkpoints": [{"iter": 800, "file": "...", "bytes": ..., "saved_utc": "..."}],
+#    "fingerprint": {"train_sha256": "...", "hparams": {...}}}
+#
+# The fingerprint (from the caller) names the training data and the row's
+# hyperparameters; a resume only continues from or skips on checkpoints whose
+# fingerprint matches, anything else starts the row over.
+#
+# Only adapter weights can be checkpointed: the mlx_lm CLI does not expose the
+# optimizer state, so Adam moments restart on resume.
+
+from __future__ import annotations
+import re, json, time, struct, shutil
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+CKPT_RE = re.compile(r"^(\d{7})_adapters\.safetensors$")
+
+def manifest_path(adapter_path: Path) -> Path:
+    return Path(adapter_path) / "checkpoints.json"
+
+def load_manifest(adapter_path: Path) -> Dict[str, Any]:
+    p = manifest_path(adapter_path)
+    if p.exists():
+        try:
+            return json.loads(p.read_text(encoding="utf-8"))
+        except Exception:
+            pass
+    return {"offset": 0, "completed_iter": None, "checkpoints": [], "fingerprint": None}
+
+def save_manifest(adapter_path: Path, manifest: Dict[str, Any]):
+    p = manifest_path(adapter_path)
+    tmp = p.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    tmp.replace(p)
+
+def is_valid_safetensors(p: Path) -> bool:
+    """Cheap integrity check: header parses and all tensor data fits in the file."""
+    try:
+        size = p.stat().st_size
+        with p.open("rb") as f:
+            (n,) = struct.unpack("<Q", f.read(8))
+            if n <= 0 or 8 + n > size:
+                return False
+            header = json.loads(f.read(n))
+        end = max((v["data_offsets"][1] for k, v in header.items() if k != "__metadata__"), default=0)
+        return 8 + n + end <= size
+    except Exception:
+        return False
+
+def harvest(adapter_path: Path, manifest: Dict[str, Any]) -> int:
+    """Move fresh mlx_lm checkpoints into checkpoints/ with absolute iteration numbers."""
+    adapter_path = Path(adapter_path)
+    ckdir = adapter_path / "checkpoints"
+    moved = 0
+    for p in sorted(adapter_path.glob("*_adapters.safetensors")):
+        m = CKPT_RE.match(p.name)
+        if not m:
+            continue
+        if not is_valid_safetensors(p):
+            p.unlink(missing_ok=True)
+            continue
+        it = int(manifest.get("offset", 0)) + int(m.group(1))
+        ckdir.mkdir(parents=True, exist_ok=True)
+        dest = ckdir / f"{it:07d}_adapters.safetensors"
+        p.replace(dest)
+        manifest["checkpoints"] = [c for c in manifest["checkpoints"] if c["iter"] != it]
+        manifest["checkpoints"].append({
+            "iter": it,
+            "file": str(dest),
+            "bytes": dest.stat().st_size,
+            "saved_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(dest.stat().st_mtime)),
+        })
+        moved += 1
+    manifest["checkpoints"].sort(key=lambda c: c["iter"])
+    return moved
+
+def prune(manifest: Dict[str, Any], keep: int):
+    """Keep only the newest `keep` checkpoints (keep <= 0 keeps everything)."""
+    if keep <= 0:
+        return
+    ckpts = manifest["checkpoints"]
+    for c in ckpts[:-keep]:
+        Path(c["file"]).unlink(missing_ok=True)
+    manifest["checkpoints"] = ckpts[-keep:]
+
+def latest_valid(manifest: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    for c in reversed(manifest["checkpoints"]):
+        if is_valid_safetensors(Path(c["file"])):
+            return c
+    return None
+
+def stale(manifest: Dict[str, Any], fingerprint: Optional[Dict[str, Any]]) -> bool:
+    """True when the manifest holds progress made with another fingerprint (other data / hyperparameters)."""
+    progress = manifest.get("checkpoints") or manifest.get("completed_iter")
+    return bool(progress) and fingerprint is not None and manifest.get("fingerprint") != fingerprint
+
+def plan_resume(adapter_path: Path, target_iters: int, keep: int, resume: bool,
+                fingerprint: Optional[Dict[str, Any]] = None) -> Tuple[Optional[str], int, Dict[str, Any]]:
+    """
+    Tidy the checkpoint state of one row and decide where training starts.
+    Returns (resume_adapter_file or None, start_iter, manifest).
+    start_iter >= target_iters means the row is already complete. With a
+    `fingerprint`, checkpoints recorded under a different one are discarded.
+    """
+    adapter_path = Path(adapter_path)
+    manifest = load_manifest(adapter_path)
+    if stale(manifest, fingerprint):
+        resume = False
+    if not resume:
+        for c in manifest["checkpoints"]:
+            Path(c["file"]).unlink(missing_ok=True)
+        for p in adapter_path.glob("*_adapters.safetensors"):
+            if CKPT_RE.match(p.name):
+                p.unlink()
+        manifest = {"offset": 0, "completed_iter": None, "checkpoints": [], "fingerprint": fingerprint}
+        save_manifest(adapter_path, manifest)
+        return None, 0, manifest
+
+    if fingerprint is not None:
+        manifest["fingerprint"] = fingerprint
+    harvest(adapter_path, manifest)
+    prune(manifest, keep)
+    done = manifest.get("completed_iter") or 0
+    final = adapter_path / "adapters.safetensors"
+    if done >= target_iters and is_valid_safetensors(final):
+        save_manifest(adapter_path, manifest)
+        return None, done, manifest
+
+    last = latest_valid(manifest)
+    start = last["iter"] if last else 0
+    manifest["offset"] = start
+    save_manifest(adapter_path, manifest)
+    return (last["file"] if last else None), start, manifest
+
+def finish(adapter_path: Path, manifest: Dict[str, Any], keep: int, completed_iter: Optional[int]):
+    """Harvest after a launch; record completion when the run exited cleanly."""
+    adapter_path = Path(adapter_path)
+    harvest(adapter_path, manifest)
+    final = adapter_path / "adapters.safetensors"
+    if completed_iter is not None and is_valid_safetensors(final):
+        manifest["completed_iter"] = completed_iter
+        if not any(c["iter"] == completed_iter for c in manifest["checkpoints"]):
+            # the final weights double as a checkpoint, so a larger budget
+            # later (e.g. a promoted sweep row) continues from here
+            dest = adapter_path / "checkpoints" / f"{completed_iter:07d}_adapters.safetensors"
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(final, dest)
+            manifest["checkpoints"].append({
+                "iter": completed_iter,
+                "file": str(dest),
+                "bytes": dest.stat().st_size,
+                "saved_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            })
+            manifest["checkpoints"].sort(key=lambda c: c["iter"])
+    prune(manifest, keep)
+    save_manifest(adapter_path, manifest)
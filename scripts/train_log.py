@@ -0,0 +1,137 @@
+# scripts/train_log.py
+# Live streaming + parsing of `mlx_lm lora` output.
+# Shared by the training steps: the child's stdout is teed line by line into a
+# per-row log, and every report line is parsed into a metrics JSONL record.
+
+from __future__ import annotations
+import os, re, sys, json, time, subprocess
+from pathlib import Path
+from typing import Dict, Any, Optional, Callable
+
+# mlx_lm.tuner.trainer report formats (0.26.x):
+#   Iter 10: Train loss 2.345, Learning Rate 1.000e-05, It/sec 0.512, Tokens/sec 512.345, Trained Tokens 10240, Peak mem 8.123 GB
+#   Iter 10: Val loss 2.900, Val took 5.123s
+ITER_RE = re.compile(r"^Iter (\d+):")
+FIELDS = {
+    "train_loss":     re.compile(r"Train loss ([-+0-9.eE]+|nan|inf)"),
+    "val_loss":       re.compile(r"Val loss ([-+0-9.eE]+|nan|inf)"),
+    "val_seconds":    re.compile(r"Val took ([-+0-9.eE]+)s"),
+    "learning_rate":  re.compile(r"Learning Rate ([-+0-9.eE]+)"),
+    "it_per_sec":     re.compile(r"It/sec ([-+0-9.eE]+)"),
+    "tokens_per_sec": re.compile(r"Tokens/sec ([-+0-9.eE]+)"),
+    "trained_tokens": re.compile(r"Trained Tokens (\d+)"),
+    "peak_mem_gb":    re.compile(r"Peak mem ([-+0-9.eE]+) GB"),
+}
+
+def parse_report_line(line: str) -> Optional[Dict[str, Any]]:
+    """Return a metrics dict for an mlx_lm train/val report line, else None."""
+    m = ITER_RE.match(line.strip())
+    if not m:
+        return None
+    rec: Dict[str, Any] = {"iter": int(m.group(1))}
+    for key, rx in FIELDS.items():
+        hit = rx.search(line)
+        if hit:
+            rec[key] = int(hit.group(1)) if key == "trained_tokens" else float(hit.group(1))
+    if len(rec) == 1:
+        return None  # e.g. "Iter 100: Saved adapter weights ..."
+    rec["kind"] = "val" if "val_loss" in rec else "train"
+    return rec
+
+def stream_cmd(
+    cmd: str,
+    log_path: Path,
+    metrics_path: Optional[Path] = None,
+    prefix: str = "",
+    tags: Optional[Dict[str, Any]] = None,
+    on_metrics: Optional[Callable[[Dict[str, Any]], None]] = None,
+    iter_offset: int = 0,
+    append: bool = False,
+) -> int:
+    """
+    Run `cmd` in a shell, echoing and logging its output as it arrives.
+    Parsed report lines are appended to `metrics_path` (one JSON object per
+    line, tagged with `tags`) and flushed immediately so they can be tailed.
+    `iter_offset` shifts reported iterations when a run resumes mid-way.
+    """
+    log_path = Path(log_path)
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+
+    mf = None
+    if metrics_path is not None:
+        Path(metrics_path).parent.mkdir(parents=True, exist_ok=True)
+        mf = Path(metrics_path).open("a", encoding="utf-8")
+
+    try:
+        with log_path.open("a" if append else "w", encoding="utf-8") as lf:
+            proc = subprocess.Popen(
+                cmd,
+                shell=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                bufsize=1,
+                env=env,
+            )
+            for line in proc.stdout:
+                lf.write(line); lf.flush()
+                sys.stdout.write(prefix + line); sys.stdout.flush()
+                rec = parse_report_line(line)
+                if rec is None:
+                    continue
+                rec["iter"] += iter_offset
+                rec = {**(tags or {}), **rec,
+                       "time_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+                if mf:
+                    mf.write(json.dumps(rec) + "\n"); mf.flush()
+                if on_metrics:
+                    on_metrics(rec)
+            return proc.wait()
+    finally:
+        if mf:
+            mf.close()
+
+# Signatures of an out-of-memory death: Metal/allocator errors in the log, or
+# the process being SIGKILLed (macOS memory pressure / jetsam).
+OOM_PATTERNS = (
+    "insufficient memory",
+    "outofmemory",
+    "out of memory",
+    "unable to allocate",
+    "std::bad_alloc",
+    "greater than the maximum allowed buffer size",
+)
+
+def looks_like_oom(returncode: int, log_path: Path, tail_bytes: int = 16384) -> bool:
+    if returncode in (-9, 137):
+        return True
+    p = Path(log_path)
+    if not p.exists():
+        return False
+    with p.open("rb") as f:
+        f.seek(max(0, p.stat().st_size - tail_bytes))
+        tail = f.read().decode("utf-8", "ignore").lower()
+    return any(s in tail for s in OOM_PATTERNS)
+
+def read_metrics(metrics_path: Path) -> list[Dict[str, Any]]:
+    """Load a metrics JSONL written by stream_cmd (missing file → [])."""
+    p = Path(metrics_path)
+    if not p.exists():
+        return []
+    out = []
+    with p.open("r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                try:
+                    out.append(json.loads(line))
+                except Exception:
+                    pass
+    return out
+
+def last_value(records: list[Dict[str, Any]], key: str) -> Optional[float]:
+    """Most recent value of `key` across metrics records, or None."""
+    for rec in reversed(records):
+        if key in rec:
+            return rec[key]
+    return None
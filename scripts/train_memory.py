@@ -0,0 +1,136 @@
+# scripts/train_memory.py
+# Rough memory footprint of an experiments.csv row for `mlx_lm lora`.
+# Used by 03_train.py to decide how many rows fit in unified memory at once.
+#
+#   total ≈ frozen weights + LoRA (weights, grads, Adam state)
+#         + activations (per layer, no recomputation) + logits + fixed overhead
+#
+# Model shapes come from the HF config.json when the model is local or in the
+# HF cache; otherwise the parameter count is guessed from the model name.
+# A measured entry in the throughput profile DB (throughput_profile.py) wins
+# over the analytic estimate.
+
+from __future__ import annotations
+import os, re, json, glob, math
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+GB = 1024 ** 3
+FIXED_OVERHEAD_GB = 1.0
+DEFAULT_LORA_RANK = 8
+LORA_TARGETS_PER_LAYER = 2          # mlx_lm default for llama-style: q_proj, v_proj
+NAME_HINTS_B = {"mini": 3.8, "small": 7.0, "medium": 14.0}
+
+def hf_cache_dirs() -> list[Path]:
+    roots = []
+    if os.environ.get("HF_HUB_CACHE"):
+        roots.append(Path(os.environ["HF_HUB_CACHE"]))
+    hf_home = Path(os.environ.get("HF_HOME", Path.home() / ".cache" / "huggingface"))
+    roots.append(hf_home / "hub")
+    return roots
+
+def resolve_model_dir(model_id: str) -> Optional[Path]:
+    """Local directory holding the model files (local path or HF cache snapshot)."""
+    p = Path(model_id).expanduser()
+    if p.is_dir():
+        return p
+    repo = "models--" + model_id.replace("/", "--")
+    for root in hf_cache_dirs():
+        snaps = sorted(glob.glob(str(root / repo / "snapshots" / "*")), key=os.path.getmtime)
+        if snaps:
+            return Path(snaps[-1])
+    return None
+
+def model_shape(model_id: str) -> Dict[str, Any]:
+    """hidden/layers/heads/vocab + weight bytes, as far as they can be known."""
+    info: Dict[str, Any] = {}
+    mdir = resolve_model_dir(model_id)
+    if mdir is not None:
+        cfg_path = mdir / "config.json"
+        if cfg_path.exists():
+            cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+            cfg = cfg.get("text_config", cfg)
+            info["hidden"] = cfg.get("hidden_size")
+            info["layers"] = cfg.get("num_hidden_layers")
+            info["heads"] = cfg.get("num_attention_heads")
+            info["vocab"] = cfg.get("vocab_size")
+            info["intermediate"] = cfg.get("intermediate_size")
+        index = mdir / "model.safetensors.index.json"
+        if index.exists():
+            meta = json.loads(index.read_text(encoding="utf-8")).get("metadata", {})
+            if meta.get("total_size"):
+                info["weight_bytes"] = int(meta["total_size"])
+        if "weight_bytes" not in info:
+            # follow symlinks in the HF cache to the real blob sizes
+            sizes = [os.stat(f).st_size for f in glob.glob(str(mdir / "*.safetensors"))]
+            if sizes:
+                info["weight_bytes"] = sum(sizes)
+    if "weight_bytes" not in info:
+        info["weight_bytes"] = int(guess_params_b(model_id) * 1e9 * 2)  # bf16
+    if not info.get("hidden") or not info.get("layers"):
+        # llama-ish proportions: params ≈ 12·L·h², L ≈ h/128
+        params = info["weight_bytes"] / 2
+        h = int(round((params * 128 / 12) ** (1 / 3) / 128) * 128) or 4096
+        info.setdefault("hidden", h)
+        info["layers"] = info.get("layers") or max(1, h // 128)
+        info["heads"] = info.get("heads") or max(1, h // 128)
+        info["vocab"] = info.get("vocab") or 32000
+    return info
+
+def guess_params_b(model_id: str) -> float:
+    name = model_id.lower()
+    m = re.search(r"(\d+(?:\.\d+)?)\s*b\b", name.replace("-", " ").replace("_", " "))
+    if m:
+        return float(m.group(1))
+    for hint, b in NAME_HINTS_B.items():
+        if hint in name:
+            return b
+    return 7.0
+
+def estimate_row_memory_gb(row: Dict[str, Any], profile_db: Optional[Dict[str, Any]] = None) -> float:
+    """Estimated peak unified memory (GB) for training one experiments.csv row."""
+    if profile_db:
+        from throughput_profile import predict_row
+        pred = predict_row(profile_db, row)
+        if pred:
+            return pred["est_peak_mem_gb"]
+    shape = model_shape(str(row["model_id"]))
+    h, L = int(shape["hidden"]), int(shape["layers"])
+    heads, vocab = int(shape["heads"]), int(shape["vocab"])
+    b = int(row.get("batch_size") or 1)
+    s = int(row.get("max_seq_length") or 512)
+    r = int(row.get("lora_rank") or DEFAULT_LORA_RANK)
+
+    weights = shape["weight_bytes"]
+    lora_params = L * LORA_TARGETS_PER_LAYER * r * (h + h)
+    lora = lora_params * 4 * 4                      # fp32 weight + grad + Adam m, v
+    acts = L * b * s * (34 * h + 5 * heads * s)     # Korthikanti et al., half precision
+    logits = b * s * vocab * 4 * 2                  # fp32 logits + their grad
+    return round((weights + lora + acts + logits) / GB + FIXED_OVERHEAD_GB, 2)
+
+def system_memory_gb() -> float:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / GB
+    except (ValueError, OSError, AttributeError):
+        return 16.0
+
+def memory_budget_gb(budget_gb: float, fraction: float) -> float:
+    """Explicit budget, or `fraction` of system RAM when budget_gb is 0."""
+    return float(budget_gb) or system_memory_gb() * float(fraction)
+
+def rebatch(row: Dict[str, Any], new_batch: int, done_iters: int, use_accum: bool) -> Dict[str, Any]:
+    """
+    Shrink a row's batch size while keeping the examples it trains on.
+    With gradient accumulation the accumulation steps grow by the same
+    factor; without it the remaining iterations are scaled up instead.
+    Mutates `row` and returns {"from": ..., "to": ...}.
+    """
+    keys = ("batch_size", "grad_accum", "iters")
+    before = {k: int(row.get(k) or 1) for k in keys}
+    factor = before["batch_size"] / max(1, new_batch)
+    row["batch_size"] = int(new_batch)
+    if use_accum:
+        row["grad_accum"] = max(1, math.ceil(before["grad_accum"] * factor))
+    else:
+        row["iters"] = done_iters + math.ceil((before["iters"] - done_iters) * factor)
+    return {"from": before, "to": {k: int(row.get(k) or 1) for k in keys}}